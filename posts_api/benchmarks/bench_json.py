@@ -0,0 +1,65 @@
+"""
+Бенчмарк JSON-представления ответов API.
+
+Сравнивает стандартный output_json из flask_restful с быстрым представлением
+из flask_app.api.representations на данных, которые отдает GET /posts.
+
+Запуск (из каталога posts_api): python -m benchmarks.bench_json
+"""
+import datetime
+import timeit
+
+from flask_restful.representations.json import output_json as restful_output_json
+
+from flask_app import create_app
+from flask_app.api import representations
+from flask_app.serializers import posts_list_schema
+
+POSTS = 20
+COMMENTS_PER_POST = 10
+NUMBER = 500
+
+
+def make_payload():
+    """Формирование данных, аналогичных ответу GET /posts"""
+    now = datetime.datetime.now()
+    posts = [
+        {
+            'id': i,
+            'author_id': i % 7,
+            'title': f'Title {i}',
+            'content': 'Lorem ipsum dolor sit amet. ' * 20,
+            'publication_datetime': now,
+            'comments': [
+                {
+                    'id': i * COMMENTS_PER_POST + j,
+                    'author_id': j,
+                    'post_id': i,
+                    'title': f'Comment title {j}',
+                    'content': 'Comment content. ' * 5,
+                    'publication_datetime': now,
+                }
+                for j in range(COMMENTS_PER_POST)
+            ]
+        }
+        for i in range(POSTS)
+    ]
+    return {'pagination': {'currentPage': 1, 'size': POSTS}, 'data': posts_list_schema.dump(posts)}
+
+
+def main():
+    payload = make_payload()
+    with create_app().test_request_context():
+        results = {
+            'flask_restful.output_json': timeit.timeit(lambda: restful_output_json(payload, 200), number=NUMBER),
+            'representations.output_json': timeit.timeit(lambda: representations.output_json(payload, 200),
+                                                         number=NUMBER),
+        }
+    encoder = 'orjson' if representations.orjson is not None else 'json (stdlib)'
+    print(f'encoder: {encoder}, posts: {POSTS}, comments per post: {COMMENTS_PER_POST}')
+    for name, total in results.items():
+        print(f'{name:<30} {total / NUMBER * 1e6:10.1f} us/response')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Бенчмарк построения запросов горячих путей: запросы, собираемые заново при каждом вызове,
+против кэшированных запросов модуля repository (baked-запросы и выражения Core
+с кэшем компиляции).
+
+Для каждого запроса измеряется время CPU одного вызова, включая выполнение запроса
+к тестовой БД SQLite, т.е. разница между способами - затраты на построение и компиляцию.
+
+Запуск (из каталога posts_api): python -m benchmarks.bench_queries
+"""
+import time
+
+from sqlalchemy import and_, select
+
+from flask_app import create_app, db, repository
+from flask_app.config import TestingConfiguration
+from flask_app.models import Comment, Post, User
+
+CALLS = 2000
+REPEAT = 5
+
+
+def fill_database():
+    user = User(email='bench@test.com', username='bench', password='-')
+    db.session.add(user)
+    db.session.commit()
+    post = Post(author_id=user.id, title='Title', content='Content')
+    db.session.add(post)
+    db.session.commit()
+    comment = Comment(author_id=user.id, post_id=post.id, title='Comment', content='Content')
+    db.session.add(comment)
+    db.session.commit()
+    return user, post.id, comment.id
+
+
+def uncached_queries(user, post_id, comment_id):
+    posts, comments = Post.__table__, Comment.__table__
+    return {
+        'user by username': lambda: User.query.filter(User.username == user.username).first(),
+        'post with owner': lambda: db.session.query(Post, (Post.author_id == user.id).label('is_owner')).filter(
+            Post.id == post_id, Post.deleted_at.is_(None)
+        ).first(),
+        'comment with owner': lambda: db.session.query(
+            Post.id, Comment, (Comment.author_id == user.id).label('is_owner')
+        ).select_from(Post).outerjoin(
+            Comment, and_(Comment.post_id == Post.id, Comment.id == comment_id)
+        ).filter(Post.id == post_id, Post.deleted_at.is_(None)).first(),
+        'post fragment row': lambda: db.session.execute(
+            select([posts.c.id, posts.c.rendered, posts.c.view_count]).where(
+                and_(posts.c.id == post_id, posts.c.deleted_at.is_(None))
+            )
+        ).first(),
+        'comment rows': lambda: db.session.execute(
+            select(repository.comment_columns(comments)).where(
+                comments.c.post_id.in_([post_id])
+            ).order_by(comments.c.id)
+        ).fetchall(),
+    }
+
+
+def cached_queries(user, post_id, comment_id):
+    return {
+        'user by username': lambda: repository.user_by_username(user.username),
+        'post with owner': lambda: repository.post_with_owner(post_id, user.id),
+        'comment with owner': lambda: repository.comment_with_owner(post_id, comment_id, user.id),
+        'post fragment row': lambda: repository.fragment_row(post_id),
+        'comment rows': lambda: repository.comment_rows([post_id]).fetchall(),
+    }
+
+
+def measure(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.process_time()
+        for _ in range(CALLS):
+            func()
+        timings.append(time.process_time() - start)
+    return min(timings) / CALLS
+
+
+def main():
+    app = create_app(TestingConfiguration)
+    with app.app_context():
+        db.create_all()
+        args = fill_database()
+        uncached, cached = uncached_queries(*args), cached_queries(*args)
+        print(f'{"query":<20} {"uncached":>12} {"cached":>12}')
+        total_uncached = total_cached = 0
+        for name in uncached:
+            before, after = measure(uncached[name]), measure(cached[name])
+            total_uncached += before
+            total_cached += after
+            print(f'{name:<20} {before * 1e6:9.1f} us {after * 1e6:9.1f} us')
+        print(f'{"per request (sum)":<20} {total_uncached * 1e6:9.1f} us {total_cached * 1e6:9.1f} us')
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
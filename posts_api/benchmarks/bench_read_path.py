@@ -0,0 +1,88 @@
+"""
+Бенчмарк чтения постов: объекты ORM (Post.query) против строк SQLAlchemy Core.
+
+Для каждого способа измеряется время получения и сериализации постов
+с комментариями в пересчете на одну строку и пиковое потребление памяти (tracemalloc).
+
+Запуск (из каталога posts_api): python -m benchmarks.bench_read_path
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from flask_app import create_app, db
+from flask_app.config import TestingConfiguration
+from flask_app.models import Comment, Post, User
+from flask_app.readers import fetch_posts
+from flask_app.serializers import posts_list_schema
+
+POSTS = 200
+COMMENTS_PER_POST = 10
+REPEAT = 5
+
+
+def fill_database():
+    user = User(email='bench@test.com', username='bench', password='-')
+    db.session.add(user)
+    db.session.commit()
+    posts = [Post(author_id=user.id, title=f'Title {i}', content='Lorem ipsum. ' * 50) for i in range(POSTS)]
+    db.session.add_all(posts)
+    db.session.commit()
+    db.session.add_all([
+        Comment(author_id=user.id, post_id=post.id, title=f'Comment {j}', content='Comment content. ' * 5)
+        for post in posts for j in range(COMMENTS_PER_POST)
+    ])
+    db.session.commit()
+    return [post.id for post in posts]
+
+
+def read_orm(post_ids):
+    posts = Post.query.filter(Post.id.in_(post_ids)).all()
+    return posts_list_schema.dump(posts)
+
+
+def read_core(post_ids):
+    return posts_list_schema.dump(fetch_posts(post_ids))
+
+
+def measure(func, post_ids):
+    timings = []
+    for _ in range(REPEAT):
+        db.session.remove()
+        start = time.process_time()
+        func(post_ids)
+        timings.append(time.process_time() - start)
+
+    db.session.remove()
+    tracemalloc.start()
+    func(post_ids)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    class BenchConfiguration(TestingConfiguration):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchConfiguration)
+    try:
+        with app.app_context():
+            db.create_all()
+            post_ids = fill_database()
+            rows = POSTS * (COMMENTS_PER_POST + 1)
+            print(f'posts: {POSTS}, comments per post: {COMMENTS_PER_POST}')
+            for name, func in (('ORM Post.query', read_orm), ('Core select()', read_core)):
+                cpu, peak = measure(func, post_ids)
+                print(f'{name:<16} {cpu / rows * 1e6:8.1f} us CPU/row {peak / rows:10.0f} B peak/row')
+            db.session.remove()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
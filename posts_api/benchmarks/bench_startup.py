@@ -0,0 +1,39 @@
+"""
+Бенчмарк холодного старта приложения.
+
+Каждый сценарий выполняется в отдельном процессе интерпретатора,
+выводится медианное время выполнения.
+
+Запуск (из каталога posts_api): python -m benchmarks.bench_startup
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+REPEAT = 7
+
+SCENARIOS = {
+    'interpreter': 'pass',
+    'import flask_app': 'import flask_app',
+    'create_app()': 'from flask_app import create_app; create_app()',
+    'import manage (CLI)': 'import manage',
+}
+
+
+def measure(code):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    for name, code in SCENARIOS.items():
+        print(f'{name:<25} {measure(code) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Бенчмарк проверки входных данных при создании и изменении постов и комментариев:
+Schema.load из marshmallow против предкомпилированной загрузки (flask_app.validation).
+
+Для каждой схемы и набора данных (корректные данные и данные с ошибками)
+измеряется число загрузок в секунду.
+
+Запуск (из каталога posts_api): python -m benchmarks.bench_validation
+"""
+import timeit
+
+from marshmallow import Schema, ValidationError
+
+from flask_app.serializers import comment_create_schema, post_create_schema, post_patch_schema
+
+NUMBER = 20000
+REPEAT = 5
+
+PAYLOADS = {
+    'valid': {'title': 'Title', 'content': 'Lorem ipsum dolor sit amet. ' * 20},
+    'invalid': {'id': 1, 'title': '', 'content': None},
+}
+
+
+def marshmallow_load(schema):
+    return lambda data: Schema.load(schema, data)
+
+
+def compiled_load(schema):
+    return schema._compiled_loader.load
+
+
+def measure(load, data):
+    def run():
+        try:
+            load(data)
+        except ValidationError:
+            pass
+
+    return min(timeit.repeat(run, number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    schemas = (
+        ('POST /posts', post_create_schema),
+        ('PATCH /posts', post_patch_schema),
+        ('POST /comments', comment_create_schema),
+    )
+    print(f'{"schema":<16} {"data":<8} {"marshmallow":>14} {"compiled":>14} {"speedup":>8}')
+    for name, schema in schemas:
+        for kind, data in PAYLOADS.items():
+            before = measure(marshmallow_load(schema), data)
+            after = measure(compiled_load(schema), data)
+            print(f'{name:<16} {kind:<8} {1 / before:10.0f} /s {1 / after:10.0f} /s {before / after:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
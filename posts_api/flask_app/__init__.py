@@ -1,29 +1,54 @@
 from flask import Flask
-from flask_migrate import Migrate, MigrateCommand
 from flask_rest_paginate import Pagination
-from flask_script import Manager
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from .config import Configuration, ProductionConfiguration
-
-# Приложение
-app = Flask(__name__)
-app.config.from_object(ProductionConfiguration)
+from .tracing import Tracer
 
 # База данных
-db = SQLAlchemy(app)
-
-# Миграции БД
-from .models import *
-
-migrate = Migrate(app, db)
-manager = Manager(app)
-manager.add_command('db', MigrateCommand)
+db = SQLAlchemy()
 
 # Пагинация
-pagination = Pagination(app, db)
-
-# Регистрация BP
-from .api.blueprint import api_bp
-
-app.register_blueprint(api_bp, url_prefix='/api/v1')
+pagination = Pagination()
+
+# Трассировка запросов
+tracer = Tracer()
+
+
+def create_app(config=ProductionConfiguration):
+    """
+    Фабрика приложения.
+    Расширения инициализируются для каждого созданного приложения,
+    инструменты миграций и CLI подключаются только в manage.py.
+    :param config: класс конфигурации
+    :return: экземпляр приложения
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if app.config['PROXY_FIX_X_FOR']:
+        # Адрес клиента (ограничение частоты запросов) вместо адреса прокси
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    db.init_app(app)
+    pagination.init_app(app, db)
+    tracer.init_app(app)
+
+    # Регистрация моделей и BP
+    from . import models
+    from .views import main_bp
+    from .api.blueprint import api_bp
+
+    app.register_blueprint(main_bp)
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    if app.config['WARMUP_ON_INIT']:
+        from .warmup import warm_up
+
+        with app.app_context():
+            try:
+                warm_up()
+            except Exception:
+                # Приложение запускается, но не сообщает о готовности (GET /readyz)
+                app.logger.exception('warm-up failed')
+    return app
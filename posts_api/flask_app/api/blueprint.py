@@ -1,34 +1,86 @@
 import datetime
-import pytz
 
-from flask import Blueprint, jsonify, request, g, url_for
+from flask import Blueprint, Response, current_app, request, g, stream_with_context, url_for
 from flask_restful import Api, Resource
 
+from .deadlines import RequestDeadlines
 from .mixins import DataHandlerMixin
+from .profiling import RequestProfiler
+from .ratelimit import RateLimiter
+from .resolvers import NotFound, post_exists, resolve_comment, resolve_post, resolve_post_row
+from .representations import JSON_MIMETYPE, dumps, json_response, loads, output_json, raw_json_response
 from flask_app import db, pagination
-from flask_app.models import Post, User, Comment
+from flask_app.archive import archived_post_exists
+from flask_app.authors import expand_authors
+from flask_app.availability import check_availability, user_filter
+from flask_app.batch import run_batch
+from flask_app.changes import CREATE, UPDATE, DELETE, changes_horizon, changes_since, record_change
+from flask_app.counters import view_counter
+from flask_app.fragments import (
+    FragmentsDumper, assemble_posts, comments_body, page_body, post_rows, render_fragment
+)
+from flask_app.models import Post, User, Comment, publication_now
+from flask_app.post_cache import cached_page, post_cache
+from flask_app.readers import PostsDumper, fetch_comments, fetch_posts
+from flask_app.repository import PostsPage
 from flask_app.serializers import (
-    posts_list_schema, user_reg_schema,
-    post_create_schema, post_patch_schema,
-    comment_create_schema, comment_patch_schema
+    user_reg_schema,
+    post_create_schema, post_patch_schema, posts_list_schema, post_previews_list_schema,
+    comment_create_schema, comment_patch_schema, comments_list_schema,
+    changes_list_schema, batch_schema
 )
+from flask_app.snapshots import day_posts, sealed, snapshot_store
+from flask_app.stream import broker
 from flask_app.views import auth
 
 api_bp = Blueprint(name='api', import_name=__name__)
 api = Api(api_bp)
+api.representations[JSON_MIMETYPE] = output_json
+deadlines = RequestDeadlines(api_bp)
+profiler = RequestProfiler(api_bp)
+limiter = RateLimiter(api_bp)
 
 
 @api_bp.route('/')
 def api_root():
     """Корень API."""
-    return jsonify(
+    return json_response(
         {
             'registration': url_for('api.registration'),
-            'posts': url_for('api.posts')
+            'posts': url_for('api.posts'),
+            'changes': url_for('api.changes'),
+            'stream': url_for('api.stream'),
+            'batch': url_for('api.batch')
         }
     )
 
 
+def parse_expand():
+    """
+    Разбор параметра expand запроса (поддерживается только expand=author)
+    :return: (раскрывать ли авторов, None) или (None, сообщение об ошибке и статус-код)
+    """
+    fields = {field for field in request.args.get('expand', '').split(',') if field}
+    unsupported = fields - {'author'}
+    if unsupported:
+        return None, ({'message': f'unsupported expand: {",".join(sorted(unsupported))}'}, 400)
+    return bool(fields), None
+
+
+def parse_preview():
+    """
+    Разбор параметра preview запроса - длины сокращенного содержания постов
+    :return: (длина или None, None) или (None, сообщение об ошибке и статус-код)
+    """
+    preview = request.args.get('preview')
+    if preview is None:
+        return None, None
+    max_length = current_app.config['PREVIEW_MAX_LENGTH']
+    if not preview.isdigit() or not 1 <= int(preview) <= max_length:
+        return None, ({'message': f'preview must be an integer between 1 and {max_length}'}, 400)
+    return int(preview), None
+
+
 class UserRegistration(DataHandlerMixin, Resource):
     """Представление для регистрации пользователей."""
 
@@ -50,20 +102,137 @@ class UserRegistration(DataHandlerMixin, Resource):
         user.hash_password(data['password'])
         db.session.add(user)
         db.session.commit()
+        user_filter.add(user)
         return user_reg_schema.dump(user), 201
 
 
+class RegistrationAvailabilityView(Resource):
+    """Представление для проверки доступности имени пользователя и email`а."""
+
+    def get(self):
+        """
+        Метод обработки GET-запроса, возвращает для переданных параметров username и email,
+        свободны ли они для регистрации.
+        """
+        username = request.args.get('username')
+        email = request.args.get('email')
+        if not username and not email:
+            return {'message': 'username or email is required'}, 400
+        return check_availability(username, email)
+
+
 class PostsListView(DataHandlerMixin, Resource):
     """Представление для просмотра и создания постов."""
 
     def get(self):
         """
         Метод обработки GET-запроса, возвращает список постов с комментариями к ним.
+        С параметром archived=true возвращается список архивных постов,
+        с параметром ids=1,2,3 - посты с указанными идентификаторами.
+        С параметром expand=author к постам и комментариям добавляются данные авторов,
+        с параметром preview=N содержание постов сокращается до N символов в запросе к БД.
+        С параметром date=YYYY-MM-DD возвращаются все посты, опубликованные в указанный день.
         """
-        posts = Post.query.order_by(Post.publication_datetime.desc()).all()
-        if not posts:
+        if 'date' in request.args:
+            return self._get_day(request.args['date'])
+        expand, error = parse_expand()
+        if error:
+            return error
+        preview, error = parse_preview()
+        if error:
+            return error
+        if 'ids' in request.args:
+            return self._get_many(request.args['ids'], expand, preview)
+
+        # Фрагменты содержат полный текст постов, поэтому сокращенные посты читаются через Core
+        from_fragments = current_app.config['READ_FROM_FRAGMENTS'] and preview is None
+        archived = request.args.get('archived', '').lower() in ('1', 'true')
+        if from_fragments and not expand:
+            # Собранные страницы кэшируются в общем кэше воркеров, если он настроен
+            body = cached_page(request.full_path, lambda: self._page_body(archived))
+            if body is None:
+                return {'message': 'There is no posts'}
+            return raw_json_response(body)
+
+        dumper = FragmentsDumper(archived) if from_fragments else PostsDumper(archived, preview)
+        page = pagination.paginate(PostsPage(archived, from_fragments), dumper, True)
+        if not page['pagination']['totalElements']:
             return {'message': 'There is no posts'}
-        return pagination.paginate(posts, posts_list_schema, True)
+        if from_fragments:
+            page['data'] = [loads(post) for post in page['data']]
+        if expand:
+            expand_authors(page['data'])
+        return page
+
+    @staticmethod
+    def _page_body(archived):
+        """JSON страницы постов, собранной из фрагментов, или None, если постов нет"""
+        page = pagination.paginate(PostsPage(archived, True), FragmentsDumper(archived), True)
+        if not page['pagination']['totalElements']:
+            return None
+        return page_body(page)
+
+    @staticmethod
+    def _get_day(date):
+        """
+        Получение постов (в том числе архивных) с комментариями, опубликованных в указанный день.
+        Для завершенных дней отдается файл снимка (manage.py write_snapshots) с заголовками
+        кэширования и ETag, если снимка нет - посты собираются из фрагментов.
+        """
+        try:
+            day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+        except ValueError:
+            return {'message': 'date must be in YYYY-MM-DD format'}, 400
+        store = snapshot_store()
+        if store is not None and sealed(day):
+            response = store.send(day, 'gzip' in request.accept_encodings)
+            if response is not None:
+                return response
+        _, body = day_posts(day)
+        return raw_json_response(body)
+
+    @staticmethod
+    def _get_many(ids, expand=False, preview=None):
+        """
+        Получение постов по списку идентификаторов двумя запросами (посты и комментарии),
+        архивные посты запрашиваются, только если часть постов не найдена в основной таблице.
+        Посты возвращаются в порядке идентификаторов запроса, для отсутствующих постов
+        возвращается сообщение об ошибке.
+        """
+        max_ids = current_app.config['POSTS_MULTIGET_MAX_IDS']
+        try:
+            post_ids = [int(post_id) for post_id in ids.split(',')]
+        except ValueError:
+            return {'message': 'ids must be a comma-separated list of integers'}, 400
+        if len(post_ids) > max_ids:
+            return {'message': f'no more than {max_ids} ids allowed'}, 400
+
+        unique_ids = list(dict.fromkeys(post_ids))
+        not_found = NotFound('post').message
+        if current_app.config['READ_FROM_FRAGMENTS'] and preview is None:
+            found = {}
+            for archived in (False, True):
+                rows = post_rows([post_id for post_id in unique_ids if post_id not in found], archived)
+                found.update(zip(rows, assemble_posts(list(rows.values()), archived)))
+            parts = [
+                found[post_id] if post_id in found
+                else dumps({'id': post_id, 'message': not_found}).decode('utf-8')
+                for post_id in post_ids
+            ]
+            if expand:
+                return {'data': expand_authors([loads(part) for part in parts])}
+            return raw_json_response(('{"data":[' + ','.join(parts) + ']}').encode('utf-8'))
+
+        posts = {}
+        for archived in (False, True):
+            missing_ids = [post_id for post_id in unique_ids if post_id not in posts]
+            fetched = fetch_posts(missing_ids, archived=archived, preview=preview)
+            posts.update((post['id'], post) for post in fetched)
+        schema = posts_list_schema if preview is None else post_previews_list_schema
+        found = dict(zip(posts, schema.dump(list(posts.values()))))
+        if expand:
+            expand_authors(found.values())
+        return {'data': [found.get(post_id, {'id': post_id, 'message': not_found}) for post_id in post_ids]}
 
     @auth.login_required
     def post(self):
@@ -80,10 +249,13 @@ class PostsListView(DataHandlerMixin, Resource):
             author_id=g.user.id,
             title=data['title'],
             content=data['content'],
-            publication_datetime=datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+            publication_datetime=publication_now()
         )
         db.session.add(post)
+        render_fragment(post)
+        record_change(CREATE, post)
         db.session.commit()
+        post_cache.invalidate(post.id)
         return post_create_schema.dump(post), 201
 
 
@@ -91,12 +263,44 @@ class PostEditView(DataHandlerMixin, Resource):
     """Представление для просмотра, редактирования и удаления поста."""
 
     def get(self, id):
-        """Метод обработки GET-запроса, реализует просмотр экземпляра поста"""
-        post = Post.query.filter(Post.id == id).first()
-        not_found = self._check_data(post=post)
+        """
+        Метод обработки GET-запроса, реализует просмотр экземпляра поста.
+        Пост, отсутствующий в основной таблице, ищется в архиве.
+        С параметром expand=author к посту и комментариям добавляются данные авторов.
+        Просмотр учитывается в счетчике воркера и записывается в БД позже.
+        Пост (и его отсутствие) кэшируется в памяти воркера, одновременные запросы
+        одного поста загружают его из БД один раз.
+        """
+        expand, error = parse_expand()
+        if error:
+            return error
+
+        body = post_cache.get(id, lambda: self._load(id))
+        if body is None:
+            return NotFound('post').response
+        view_counter.increment(id)
+        if expand:
+            return expand_authors([loads(body)])[0], 200
+        return raw_json_response(body)
+
+    @staticmethod
+    def _load(id):
+        """
+        Загрузка JSON поста с комментариями, пост, отсутствующий в основной таблице, ищется в архиве
+        :return: JSON поста или None, если пост не найден
+        """
+        if not current_app.config['READ_FROM_FRAGMENTS']:
+            posts = fetch_posts([id]) or fetch_posts([id], archived=True)
+            return dumps(post_create_schema.dump(posts[0])).decode('utf-8') if posts else None
+
+        archived = False
+        row, not_found = resolve_post_row(id)
+        if not_found:
+            archived = True
+            row, not_found = resolve_post_row(id, archived=True)
         if not_found:
-            return not_found[0], not_found[1]
-        return post_create_schema.dump(post), 200
+            return None
+        return assemble_posts([row], archived)[0]
 
     @auth.login_required
     def put(self, id):
@@ -104,10 +308,9 @@ class PostEditView(DataHandlerMixin, Resource):
         Метод обработки PUT-запроса, реализует изменение поста.
         Права доступа имеет только автор поста.
         """
-        post = Post.query.filter(Post.id == id).first()
-        not_found_or_not_owner = self._check_data('post', g.user, post=post)
+        post, not_found_or_not_owner = resolve_post(id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
+            return not_found_or_not_owner.response
 
         json_data = request.get_json()
         data, status = self._request_data_handler(json_data, post_create_schema)
@@ -117,7 +320,10 @@ class PostEditView(DataHandlerMixin, Resource):
         post.title = data['title']
         post.content = data['content']
         db.session.add(post)
+        render_fragment(post)
+        record_change(UPDATE, post)
         db.session.commit()
+        post_cache.invalidate(post.id)
         return post_create_schema.dump(post)
 
     @auth.login_required
@@ -126,10 +332,9 @@ class PostEditView(DataHandlerMixin, Resource):
         Метод обработки PATCH-запроса, реализует частичное изменение поста.
         Права доступа имеет только автор поста.
         """
-        post = Post.query.filter(Post.id == id).first()
-        not_found_or_not_owner = self._check_data('post', g.user, post=post)
+        post, not_found_or_not_owner = resolve_post(id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
+            return not_found_or_not_owner.response
 
         json_data = request.get_json()
         data, status = self._request_data_handler(json_data, post_patch_schema)
@@ -139,7 +344,10 @@ class PostEditView(DataHandlerMixin, Resource):
         for key in data:
             setattr(post, key, data[key])
         db.session.add(post)
+        render_fragment(post)
+        record_change(UPDATE, post)
         db.session.commit()
+        post_cache.invalidate(post.id)
         return post_create_schema.dump(post)
 
     @auth.login_required
@@ -148,17 +356,48 @@ class PostEditView(DataHandlerMixin, Resource):
         Метод обработки DELETE-запроса, реализует удаление поста.
         Права доступа имеет только автор поста.
         """
-        post = Post.query.filter(Post.id == id).first()
-        not_found_or_not_owner = self._check_data('post', g.user, post=post)
+        post, not_found_or_not_owner = resolve_post(id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
-        db.session.delete(post)
+            return not_found_or_not_owner.response
+        record_change(DELETE, post)
+        if current_app.config['SOFT_DELETE']:
+            # Пост и комментарии удаляются из БД фоновой очисткой (manage.py purge_deleted)
+            post.deleted_at = datetime.datetime.utcnow()
+        else:
+            db.session.delete(post)
         db.session.commit()
+        post_cache.invalidate(id)
         return '', 204
 
 
 class CommentsCreateView(DataHandlerMixin, Resource):
-    """Представление для создания комментариев к постам."""
+    """Представление для просмотра и создания комментариев к постам."""
+
+    def get(self, post_id):
+        """
+        Метод обработки GET-запроса, возвращает список комментариев к посту (в том числе архивному).
+        С параметром expand=author к комментариям добавляются данные авторов.
+        """
+        expand, error = parse_expand()
+        if error:
+            return error
+
+        archived = False
+        not_found = post_exists(post_id)
+        if not_found:
+            archived = archived_post_exists(post_id)
+            if not archived:
+                return not_found.response
+        if current_app.config['READ_FROM_FRAGMENTS']:
+            body = comments_body(post_id, archived)
+            if not expand:
+                return raw_json_response(body)
+            comments = loads(body)
+        else:
+            comments = comments_list_schema.dump(fetch_comments([post_id], archived)[post_id])
+        if expand:
+            expand_authors(comments)
+        return comments, 200
 
     @auth.login_required
     def post(self, post_id):
@@ -166,10 +405,9 @@ class CommentsCreateView(DataHandlerMixin, Resource):
         Метод обработки POST-запроса, реализует создание комментария к посту.
         Доступно только авторизованным пользователям.
         """
-        post = Post.query.filter(Post.id == post_id).first()
-        not_found = self._check_data(post=post)
-        if not_found:
-            return not_found[0], not_found[1]
+        not_found_or_archived = post_exists(post_id, for_write=True)
+        if not_found_or_archived:
+            return not_found_or_archived.response
 
         json_data = request.get_json()
         data, status = self._request_data_handler(json_data, comment_create_schema)
@@ -181,10 +419,13 @@ class CommentsCreateView(DataHandlerMixin, Resource):
             author_id=g.user.id,
             title=data['title'],
             content=data['content'],
-            publication_datetime=datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+            publication_datetime=publication_now()
         )
         db.session.add(comment)
+        render_fragment(comment)
+        record_change(CREATE, comment)
         db.session.commit()
+        post_cache.invalidate(post_id)
         return comment_create_schema.dump(comment), 201
 
 
@@ -197,14 +438,9 @@ class CommentEditView(DataHandlerMixin, Resource):
         Метод обработки PUT-запроса, реализует изменение комментария к посту.
         Права доступа имеет только автор комментария.
         """
-        post = Post.query.filter(Post.id == post_id).first()
-        not_found = self._check_data(post=post)
-        if not_found:
-            return not_found[0], not_found[1]
-        comment = post.comments.filter(Comment.id == id).first()
-        not_found_or_not_owner = self._check_data(user_=g.user, permission_key='comment', comment=comment)
+        comment, not_found_or_not_owner = resolve_comment(post_id, id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
+            return not_found_or_not_owner.response
 
         json_data = request.get_json()
         data, status = self._request_data_handler(json_data, comment_create_schema)
@@ -214,7 +450,10 @@ class CommentEditView(DataHandlerMixin, Resource):
         comment.title = data['title']
         comment.content = data['content']
         db.session.add(comment)
+        render_fragment(comment)
+        record_change(UPDATE, comment)
         db.session.commit()
+        post_cache.invalidate(post_id)
         return comment_create_schema.dump(comment)
 
     @auth.login_required
@@ -223,14 +462,9 @@ class CommentEditView(DataHandlerMixin, Resource):
         Метод обработки PATCH-запроса, реализует частичное изменение комментария к посту.
         Права доступа имеет только автор комментария.
         """
-        post = Post.query.filter(Post.id == post_id).first()
-        not_found = self._check_data(post=post)
-        if not_found:
-            return not_found[0], not_found[1]
-        comment = post.comments.filter(Comment.id == id).first()
-        not_found_or_not_owner = self._check_data(user_=g.user, permission_key='comment', comment=comment)
+        comment, not_found_or_not_owner = resolve_comment(post_id, id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
+            return not_found_or_not_owner.response
 
         json_data = request.get_json()
         data, status = self._request_data_handler(json_data, comment_patch_schema)
@@ -240,7 +474,10 @@ class CommentEditView(DataHandlerMixin, Resource):
         for key in data:
             setattr(comment, key, data[key])
         db.session.add(comment)
+        render_fragment(comment)
+        record_change(UPDATE, comment)
         db.session.commit()
+        post_cache.invalidate(post_id)
         return comment_create_schema.dump(comment)
 
     @auth.login_required
@@ -249,22 +486,99 @@ class CommentEditView(DataHandlerMixin, Resource):
         Метод обработки DELETE-запроса, реализует удаление комментария к посту.
         Права доступа имеет только автор комментария.
         """
-        post = Post.query.filter(Post.id == post_id).first()
-        not_found = self._check_data(post=post)
-        if not_found:
-            return not_found[0], not_found[1]
-        comment = post.comments.filter(Comment.id == id).first()
-        not_found_or_not_owner = self._check_data(user_=g.user, permission_key='comment', comment=comment)
+        comment, not_found_or_not_owner = resolve_comment(post_id, id, g.user)
         if not_found_or_not_owner:
-            return not_found_or_not_owner[0], not_found_or_not_owner[1]
+            return not_found_or_not_owner.response
 
+        record_change(DELETE, comment)
         db.session.delete(comment)
         db.session.commit()
+        post_cache.invalidate(post_id)
         return '', 204
 
 
+class ChangesView(Resource):
+    """Представление для инкрементальной синхронизации по журналу изменений."""
+
+    def get(self):
+        """
+        Метод обработки GET-запроса, возвращает изменения постов и комментариев
+        с номером больше since (не более limit записей).
+        """
+        config = current_app.config
+        try:
+            since = int(request.args.get('since', 0))
+            limit = int(request.args.get('limit', config['CHANGES_DEFAULT_LIMIT']))
+        except ValueError:
+            return {'message': 'since and limit must be integers'}, 400
+        if since < 0:
+            return {'message': 'since must be a non-negative integer'}, 400
+        if not 1 <= limit <= config['CHANGES_MAX_LIMIT']:
+            return {'message': f'limit must be between 1 and {config["CHANGES_MAX_LIMIT"]}'}, 400
+        if since < changes_horizon():
+            return {'message': 'changes since this sequence were compacted, full resync required'}, 410
+
+        changes, has_more = changes_since(since, limit)
+        return {
+            'changes': changes_list_schema.dump(changes),
+            'next': changes[-1].id if changes else since,
+            'has_more': has_more
+        }
+
+
+class StreamView(Resource):
+    """Представление для трансляции изменений постов и комментариев (Server-Sent Events)."""
+
+    def get(self):
+        """
+        Метод обработки GET-запроса, открывает поток событий.
+        При переподключении события после Last-Event-ID отправляются повторно.
+        Число подписчиков воркера ограничено, т.к. каждое соединение занимает поток воркера.
+        """
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                return {'message': 'Last-Event-ID must be an integer'}, 400
+        # Проверка без блокировки: превышение возможно лишь на число одновременно открываемых соединений
+        if broker.subscribers >= current_app.config['STREAM_MAX_SUBSCRIBERS']:
+            return json_response({'message': 'too many subscribers'}, 503,
+                                 {'Retry-After': str(current_app.config['LOAD_SHEDDING_RETRY_AFTER'])})
+
+        return Response(
+            stream_with_context(broker.stream(last_event_id)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+
+class BatchView(DataHandlerMixin, Resource):
+    """Представление для выполнения нескольких операций API одним запросом."""
+
+    @auth.login_required
+    def post(self):
+        """
+        Метод обработки POST-запроса, выполняет операции пакета по порядку.
+        Пароль проверяется один раз, операции выполняются от имени авторизованного пользователя.
+        С параметром atomic=true операции выполняются в одной транзакции.
+        """
+        json_data = request.get_json()
+        data, status = self._request_data_handler(json_data, batch_schema)
+        if status:
+            return data, status
+        max_operations = current_app.config['BATCH_MAX_OPERATIONS']
+        if len(data['operations']) > max_operations:
+            return {'message': f'no more than {max_operations} operations allowed'}, 400
+        return run_batch(data['operations'], data['atomic'])
+
+
 api.add_resource(UserRegistration, '/registration', endpoint='registration')
+api.add_resource(RegistrationAvailabilityView, '/registration/availability', endpoint='registration_availability')
 api.add_resource(PostsListView, '/posts', endpoint='posts')
 api.add_resource(PostEditView, '/posts/<int:id>')
 api.add_resource(CommentsCreateView, '/posts/<int:post_id>/comments')
 api.add_resource(CommentEditView, '/posts/<int:post_id>/comments/<int:id>')
+api.add_resource(ChangesView, '/changes', endpoint='changes')
+api.add_resource(StreamView, '/stream', endpoint='stream')
+api.add_resource(BatchView, '/batch', endpoint='batch')
@@ -0,0 +1,158 @@
+import sqlite3
+import time
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import HTTPException
+
+from .representations import json_response
+
+TIMEOUT_HEADER = 'X-Request-Timeout'
+# Число инструкций виртуальной машины SQLite между проверками срока запроса
+SQLITE_PROGRESS_STEPS = 1000
+# Код ошибки PostgreSQL query_canceled (в том числе по statement_timeout)
+QUERY_CANCELED = '57014'
+# Доля установленного statement_timeout, на которую оставшееся время может быть меньше него
+# до повторной установки параметра (превышение срока запроса не больше этой доли)
+STATEMENT_TIMEOUT_SLACK = 0.1
+
+
+class DeadlineExceeded(HTTPException):
+    """
+    Срок выполнения запроса истек: 503, если истек срок, заданный настройками,
+    и 504, если истек более короткий срок из заголовка X-Request-Timeout
+    """
+    description = 'request deadline exceeded'
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.code = 504 if deadline.client else 503
+        self.data = {'message': self.description}
+
+    def get_response(self, environ=None):
+        return json_response(self.data, self.code)
+
+
+class Deadline:
+    """Срок выполнения запроса (по time.monotonic)"""
+    __slots__ = ('expires', 'client')
+
+    def __init__(self, timeout, client=False):
+        self.expires = time.monotonic() + timeout
+        # Срок задан заголовком клиента
+        self.client = client
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+
+def current_deadline():
+    """Срок текущего запроса или None"""
+    return g.get('deadline') if has_app_context() else None
+
+
+def _sqlite_progress():
+    """
+    Обработчик прогресса выполнения SQLite: прерывание запроса к БД после истечения срока
+    текущего запроса, в том числе при построчной выборке результата после выполнения запроса
+    """
+    deadline = current_deadline()
+    return deadline is not None and deadline.remaining() <= 0
+
+
+class RequestDeadlines:
+    """
+    Ограничение времени выполнения запросов к blueprint`у.
+    Срок задается для каждого endpoint`а и метода в настройках (REQUEST_TIMEOUTS, REQUEST_TIMEOUT_DEFAULT)
+    и может быть сокращен клиентом заголовком X-Request-Timeout (в секундах).
+    Запросы к БД прерываются по истечении срока: в PostgreSQL - параметром statement_timeout
+    (SET LOCAL, равным оставшемуся времени, в начале транзакции и повторно, когда оставшееся время
+    становится меньше установленного значения), в SQLite - обработчиком прогресса выполнения,
+    который устанавливается на соединение один раз и проверяет срок текущего запроса.
+    Запрос к БД после истечения срока не выполняется.
+    """
+
+    def __init__(self, blueprint=None):
+        self._sql_listeners = False
+        if blueprint is not None:
+            self.init_blueprint(blueprint)
+
+    def init_blueprint(self, blueprint):
+        blueprint.before_request(self._before_request)
+        blueprint.teardown_request(self._teardown_request)
+        if not self._sql_listeners:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            event.listen(Engine, 'commit', self._end_transaction)
+            event.listen(Engine, 'rollback', self._end_transaction)
+            self._sql_listeners = True
+
+    @staticmethod
+    def request_timeout():
+        """Срок текущего запроса в секундах по настройкам или None"""
+        config = current_app.config
+        return config['REQUEST_TIMEOUTS'].get(request.endpoint, {}).get(
+            request.method, config['REQUEST_TIMEOUT_DEFAULT']
+        )
+
+    def _before_request(self):
+        timeout = self.request_timeout()
+        client_timeout = request.headers.get(TIMEOUT_HEADER)
+        if client_timeout is not None:
+            try:
+                client_timeout = float(client_timeout)
+            except ValueError:
+                client_timeout = None
+            if client_timeout is None or not 0 < client_timeout < float('inf'):
+                return json_response({'message': f'{TIMEOUT_HEADER} must be a positive number of seconds'}, 400)
+            if timeout is None or client_timeout < timeout:
+                g.deadline = Deadline(client_timeout, client=True)
+                return None
+        if timeout is not None:
+            g.deadline = Deadline(timeout)
+        return None
+
+    @staticmethod
+    def _teardown_request(exc):
+        g.pop('deadline', None)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        deadline = current_deadline()
+        if deadline is None:
+            return
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(deadline)
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            # Параметр действует до конца транзакции и ограничивает каждый запрос, поэтому устанавливается
+            # заново, если без этого запрос мог бы выполняться дольше оставшегося времени
+            timeout = max(int(remaining * 1000), 1)
+            current = conn.info.get('statement_timeout')
+            if current is None or current[0] is not deadline or timeout < current[1] * (1 - STATEMENT_TIMEOUT_SLACK):
+                cursor.execute('SET LOCAL statement_timeout = %s', (timeout,))
+                conn.info['statement_timeout'] = (deadline, timeout)
+        elif dialect == 'sqlite':
+            if not conn.info.get('progress_handler'):
+                conn.connection.set_progress_handler(_sqlite_progress, SQLITE_PROGRESS_STEPS)
+                conn.info['progress_handler'] = True
+
+    @staticmethod
+    def _end_transaction(conn):
+        conn.info.pop('statement_timeout', None)
+
+    @staticmethod
+    def _handle_error(exception_context):
+        deadline = current_deadline()
+        if deadline is None:
+            return
+        conn = exception_context.connection
+        original = exception_context.original_exception
+        if conn is not None and conn.dialect.name == 'sqlite':
+            interrupted = isinstance(original, sqlite3.OperationalError) and str(original) == 'interrupted'
+        else:
+            interrupted = getattr(original, 'pgcode', None) == QUERY_CANCELED
+        if interrupted:
+            raise DeadlineExceeded(deadline) from original
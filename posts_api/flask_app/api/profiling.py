@@ -0,0 +1,153 @@
+import cProfile
+import hashlib
+import hmac
+import itertools
+import os
+import pstats
+import threading
+import time
+
+from flask import current_app, g, request
+
+TOKEN_HEADER = 'X-Profile-Token'
+SIGNATURE_HEADER = 'X-Profile-Signature'
+
+
+def sign_profile_request(secret, method, path, expires):
+    """
+    Подпись запроса на профилирование для заголовка X-Profile-Signature
+    :param secret: ключ PROFILING_SECRET
+    :param method: HTTP-метод запроса
+    :param path: путь запроса с параметрами (например, /api/v1/posts?page=2)
+    :param expires: время окончания действия подписи (unix time)
+    :return: значение заголовка '<expires>:<hex hmac-sha256>'
+    """
+    message = f'{int(expires)}:{method.upper()}:{path}'.encode('utf-8')
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    return f'{int(expires)}:{digest}'
+
+
+def rotate(directory, keep):
+    """
+    Удаление файлов статистики, кроме keep самых новых.
+    Каталог общий для воркеров, поэтому файл может быть уже удален другим воркером
+    """
+    # Имена файлов начинаются со времени сохранения в миллисекундах
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.pstats'))
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class RequestProfiler:
+    """
+    Профилирование запросов к blueprint`у с помощью cProfile.
+    Запрос профилируется по требованию оператора (токен администратора или подписанный заголовок)
+    либо автоматически - каждый N-й запрос воркера (PROFILING_SAMPLE_RATE).
+    Полная статистика сохраняется в каталог PROFILING_DIR в формате .pstats (не более PROFILING_MAX_FILES
+    последних файлов),
+    оператору дополнительно возвращается сводка самых затратных функций в заголовке X-Profile-Summary.
+    Одновременно в воркере профилируется не более одного запроса.
+    """
+
+    def __init__(self, blueprint=None):
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        if blueprint is not None:
+            self.init_blueprint(blueprint)
+
+    def init_blueprint(self, blueprint):
+        blueprint.before_request(self._before_request)
+        blueprint.after_request(self._after_request)
+        blueprint.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def authorized():
+        """Запрошено ли профилирование текущего запроса оператором"""
+        config = current_app.config
+        token = request.headers.get(TOKEN_HEADER)
+        if token and config['PROFILING_TOKEN']:
+            return hmac.compare_digest(token.encode('utf-8'), config['PROFILING_TOKEN'].encode('utf-8'))
+
+        signature = request.headers.get(SIGNATURE_HEADER)
+        if signature and config['PROFILING_SECRET']:
+            expires, _, _ = signature.partition(':')
+            if not expires.isdigit() or int(expires) < time.time():
+                return False
+            expected = sign_profile_request(config['PROFILING_SECRET'], request.method, request.full_path.rstrip('?'),
+                                            int(expires))
+            return hmac.compare_digest(signature.encode('utf-8'), expected.encode('utf-8'))
+        return False
+
+    def sampled(self):
+        """Выбран ли текущий запрос для автоматического профилирования"""
+        rate = current_app.config['PROFILING_SAMPLE_RATE']
+        return bool(rate) and next(self._counter) % rate == 0
+
+    def _before_request(self):
+        authorized = self.authorized()
+        if not authorized and not self.sampled():
+            return None
+        if not self._lock.acquire(blocking=False):
+            g.profile_busy = authorized
+            return None
+        profiler = cProfile.Profile()
+        g.profile = (profiler, authorized)
+        profiler.enable()
+        return None
+
+    def _after_request(self, response):
+        if g.pop('profile_busy', False):
+            response.headers['X-Profile'] = 'busy'
+        if 'profile' not in g:
+            return response
+        profiler, authorized = g.pop('profile')
+        profiler.disable()
+        self._lock.release()
+
+        stats = pstats.Stats(profiler)
+        name = self._dump(stats)
+        if authorized:
+            response.headers['X-Profile-Id'] = name
+            response.headers['X-Profile-Summary'] = self.summary(stats, current_app.config['PROFILING_TOP'])
+        return response
+
+    def _teardown_request(self, exc):
+        # Запрос завершился исключением до after_request
+        if 'profile' in g:
+            profiler, _ = g.pop('profile')
+            profiler.disable()
+            self._lock.release()
+
+    @staticmethod
+    def _dump(stats):
+        """
+        Сохранение статистики в PROFILING_DIR, в каталоге остаются PROFILING_MAX_FILES последних файлов
+        :return: имя файла
+        """
+        config = current_app.config
+        directory = config['PROFILING_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f'{int(time.time() * 1000)}-{os.getpid()}-{request.endpoint}-{request.method}.pstats'
+        stats.dump_stats(os.path.join(directory, name))
+        if config['PROFILING_MAX_FILES'] is not None:
+            rotate(directory, config['PROFILING_MAX_FILES'])
+        return name
+
+    @staticmethod
+    def summary(stats, top):
+        """
+        Сводка самых затратных функций по суммарному времени (включая вызовы)
+        :return: строка '<мс> <файл>:<строка>(<функция>); ...'
+        """
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        parts = []
+        for (filename, line, func), (_, _, _, cumulative, _) in entries:
+            if func == "<method 'disable' of '_lsprof.Profiler' objects>":
+                continue
+            parts.append(f'{cumulative * 1000:.1f}ms {os.path.basename(filename)}:{line}({func})')
+            if len(parts) == top:
+                break
+        return '; '.join(parts)
@@ -0,0 +1,301 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import abort, current_app, g, request
+from sqlalchemy.pool import QueuePool
+
+from .representations import json_response
+
+MEMORY_STORAGE_URI = 'memory://'
+SQLITE_STORAGE_PREFIX = 'sqlite:///'
+# Заголовок балансировщика со временем получения запроса (t=<секунды> или <миллисекунды>)
+REQUEST_START_HEADER = 'X-Request-Start'
+# Долгоживущие запросы (поток событий) не удерживают соединение с БД и не учитываются среди выполняющихся
+UNCOUNTED_ENDPOINTS = frozenset(('api.stream',))
+# Значение max_overflow пула QueuePool по умолчанию
+DEFAULT_MAX_OVERFLOW = 10
+
+
+class MemoryStorage:
+    """
+    Хранилище корзин токенов в памяти процесса.
+    Каждый воркер gunicorn ведет собственные счетчики.
+    """
+    # Через сколько вызовов удалять полностью восстановившиеся корзины
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def consume(self, key, cost, capacity, rate, now):
+        """
+        Списание токенов из корзины
+        :return: (разрешен ли запрос, через сколько секунд повторить)
+        """
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+
+            self._calls += 1
+            if self._calls >= self.PRUNE_EVERY:
+                self._prune(capacity, rate, now)
+        return allowed, _retry_after(tokens, cost, rate, allowed)
+
+    def _prune(self, capacity, rate, now):
+        """Удаление корзин, которые к текущему моменту заполнились бы целиком"""
+        self._calls = 0
+        self._buckets = {
+            key: value for key, value in self._buckets.items()
+            if value[0] + (now - value[1]) * rate < capacity
+        }
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteStorage:
+    """
+    Хранилище корзин токенов в локальном файле SQLite.
+    Позволяет воркерам одного хоста разделять общие счетчики.
+    """
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        """Соединение создается отдельно для каждого потока после fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bucket '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def consume(self, key, cost, capacity, rate, now):
+        """
+        Списание токенов из корзины в рамках одной транзакции
+        :return: (разрешен ли запрос, через сколько секунд повторить)
+        """
+        conn = self._connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, _retry_after(tokens, cost, rate, allowed)
+
+    def reset(self):
+        self._connection.execute('DELETE FROM bucket')
+
+
+def _retry_after(tokens, cost, rate, allowed):
+    """Время (в секундах), через которое в корзине накопится нужное число токенов"""
+    if allowed:
+        return 0
+    if rate <= 0:
+        return None
+    return (cost - tokens) / rate
+
+
+def storage_from_uri(uri):
+    """Создание хранилища по URI из настроек приложения"""
+    if uri == MEMORY_STORAGE_URI:
+        return MemoryStorage()
+    if uri.startswith(SQLITE_STORAGE_PREFIX):
+        return SQLiteStorage(uri[len(SQLITE_STORAGE_PREFIX):])
+    raise ValueError(f'unsupported rate limit storage: {uri}')
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов к blueprint`у и сброс нагрузки.
+    Запросы учитываются в корзинах токенов по IP-адресу клиента, запросы с учетными
+    данными после проверки пароля - дополнительно в корзине пользователя.
+    Стоимость запроса задается для каждого endpoint`а и метода в настройках.
+    """
+
+    def __init__(self, blueprint=None):
+        self._storage = None
+        self._storage_uri = None
+        self._storage_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        if blueprint is not None:
+            self.init_blueprint(blueprint)
+
+    def init_blueprint(self, blueprint):
+        blueprint.before_request(self._before_request)
+        blueprint.teardown_request(self._teardown_request)
+
+    @property
+    def storage(self):
+        uri = current_app.config['RATELIMIT_STORAGE_URI']
+        if self._storage is None or self._storage_uri != uri:
+            with self._storage_lock:
+                if self._storage is None or self._storage_uri != uri:
+                    self._storage = storage_from_uri(uri)
+                    self._storage_uri = uri
+        return self._storage
+
+    def reset(self):
+        """Сброс всех счетчиков"""
+        self.storage.reset()
+
+    @property
+    def in_flight(self):
+        """Число выполняющихся в воркере запросов (не больше числа потоков воркера gunicorn)"""
+        return self._in_flight
+
+    @staticmethod
+    def client_key():
+        """
+        Ключ корзины токенов текущего запроса до проверки пароля - адрес клиента
+        (за прокси - из X-Forwarded-For, см. PROXY_FIX_X_FOR).
+        Имя пользователя из заголовка Authorization не используется: оно не проверено
+        """
+        return f'ip:{request.remote_addr}'
+
+    @staticmethod
+    def user_key(user):
+        """Ключ корзины токенов пользователя, прошедшего проверку пароля"""
+        return f'user:{user.id}'
+
+    @staticmethod
+    def request_cost():
+        """Стоимость текущего запроса в токенах"""
+        config = current_app.config
+        cost = config['RATELIMIT_COSTS'].get(request.endpoint, {}).get(
+            request.method, config['RATELIMIT_DEFAULT_COST']
+        )
+        if request.authorization:
+            cost += config['RATELIMIT_AUTH_COST']
+        return cost
+
+    @staticmethod
+    def queue_time():
+        """
+        Время ожидания запроса в очереди перед обработкой в секундах по заголовку X-Request-Start
+        (nginx: t=${msec} в секундах, Heroku - в миллисекундах), None - заголовка нет
+        """
+        value = request.headers.get(REQUEST_START_HEADER)
+        if not value:
+            return None
+        try:
+            start = float(value[2:] if value.startswith('t=') else value)
+        except ValueError:
+            return None
+        # Миллисекунды и микросекунды приводятся к секундам
+        while start > 1e11:
+            start /= 1000
+        return max(time.time() - start, 0)
+
+    def pool_waiters(self):
+        """
+        Оценка числа запросов воркера, ожидающих соединение с БД: если заняты все соединения
+        пула (pool_size + max_overflow из SQLALCHEMY_ENGINE_OPTIONS), то ожидают все остальные
+        выполняющиеся запросы. Ожидание возможно, только если потоков воркера больше, чем соединений
+        """
+        pool = current_app.extensions['sqlalchemy'].db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return 0
+        max_overflow = current_app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow', DEFAULT_MAX_OVERFLOW)
+        checked_out = pool.checkedout()
+        if checked_out < pool.size() + max(max_overflow, 0):
+            return 0
+        return max(self._in_flight - checked_out, 0)
+
+    def _shed_load(self):
+        """Проверка перегрузки: долгое ожидание в очереди сервера или нехватка соединений с БД"""
+        config = current_app.config
+        max_queue_time = config['LOAD_SHEDDING_MAX_QUEUE_TIME']
+        max_pool_waiters = config['LOAD_SHEDDING_MAX_POOL_WAITERS']
+        if max_queue_time is not None:
+            queue_time = self.queue_time()
+            if queue_time is not None and queue_time > max_queue_time:
+                return True
+        if max_pool_waiters is not None and self.pool_waiters() > max_pool_waiters:
+            return True
+        return False
+
+    def _before_request(self):
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED']:
+            return None
+
+        if request.endpoint not in UNCOUNTED_ENDPOINTS:
+            with self._in_flight_lock:
+                self._in_flight += 1
+            g.ratelimit_in_flight = True
+
+        if self._shed_load():
+            return self._error_response({'message': 'service overloaded'}, 503,
+                                        config['LOAD_SHEDDING_RETRY_AFTER'])
+
+        allowed, retry_after = self.storage.consume(
+            self.client_key(), self.request_cost(),
+            config['RATELIMIT_CAPACITY'], config['RATELIMIT_REFILL_RATE'], time.time()
+        )
+        if not allowed:
+            return self._error_response({'message': 'too many requests'}, 429, retry_after)
+        g.rate_limiter = self
+        return None
+
+    def charge_user(self, user):
+        """
+        Учет текущего запроса в корзине пользователя после успешной проверки пароля
+        :raise HTTPException: с ответом 429, если лимит пользователя исчерпан
+        """
+        config = current_app.config
+        allowed, retry_after = self.storage.consume(
+            self.user_key(user), self.request_cost(),
+            config['RATELIMIT_CAPACITY'], config['RATELIMIT_REFILL_RATE'], time.time()
+        )
+        if not allowed:
+            abort(self._error_response({'message': 'too many requests'}, 429, retry_after))
+
+    def _teardown_request(self, exc):
+        g.pop('rate_limiter', None)
+        if g.pop('ratelimit_in_flight', False):
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    @staticmethod
+    def _error_response(data, status, retry_after):
+        headers = {}
+        if retry_after is not None:
+            headers['Retry-After'] = str(max(math.ceil(retry_after), 1))
+        return json_response(data, status, headers)
+
+
+def charge_user(user):
+    """Учет запроса в корзине пользователя, прошедшего проверку пароля (вызывается из verify_password)"""
+    limiter = g.get('rate_limiter')
+    if limiter is not None:
+        limiter.charge_user(user)
@@ -0,0 +1,67 @@
+import datetime
+import decimal
+import json
+
+from flask import current_app, make_response
+
+from flask_app.tracing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - окружение разработки, установленное без orjson
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+
+
+def _default(obj):
+    """Приведение типов, которые не сериализуются стандартными средствами"""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        """Сериализация данных в JSON (bytes) с помощью orjson"""
+        return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(data):
+        """Сериализация данных в JSON (bytes) с помощью стандартного модуля json"""
+        return _encoder.encode(data).encode('utf-8')
+
+    loads = json.loads
+
+
+def output_json(data, code, headers=None):
+    """
+    Представление ответов flask_restful в формате JSON.
+    В отличие от стандартного output_json не форматирует вывод
+    и не перечитывает настройки приложения на каждый запрос.
+    """
+    with span('json.encode'):
+        body = dumps(data)
+    resp = make_response(body, code)
+    resp.mimetype = JSON_MIMETYPE
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def json_response(data, status=200, headers=None):
+    """Замена flask.jsonify, использующая быстрый сериализатор"""
+    with span('json.encode'):
+        body = dumps(data)
+    return current_app.response_class(body, status=status, headers=headers, mimetype=JSON_MIMETYPE)
+
+
+def raw_json_response(body, status=200, headers=None):
+    """Ответ с заранее сформированным JSON"""
+    return current_app.response_class(body, status=status, headers=headers, mimetype=JSON_MIMETYPE)
@@ -0,0 +1,144 @@
+from flask import current_app
+
+from flask_app.archive import (
+    archived_comment_with_owner, archived_post_exists, archived_post_with_owner, rehydrate_post
+)
+from flask_app.repository import active_post, active_post_exists, comment_with_owner, fragment_row, post_with_owner
+
+
+class Failure:
+    """Базовый класс неуспешного результата поиска объекта"""
+    status = None
+    # Шаблон сообщения об ошибке, {key} - тип объекта
+    template = None
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.key}>'
+
+    @property
+    def message(self):
+        return self.template.format(key=self.key)
+
+    @property
+    def response(self):
+        """Сообщение об ошибке и статус-код"""
+        return {'message': self.message}, self.status
+
+
+class NotFound(Failure):
+    """Объект не найден"""
+    status = 404
+    template = '{key} not found'
+
+
+class Forbidden(Failure):
+    """Пользователь не является автором объекта"""
+    status = 403
+    template = 'you cannot edit this {key}'
+
+
+class Archived(Failure):
+    """Объект перенесен в архив и недоступен для изменения"""
+    status = 409
+    template = '{key} is archived'
+
+
+def _unarchive(post_id):
+    """
+    Обработка изменения поста, найденного в архиве, согласно ARCHIVE_WRITE_POLICY:
+    'rehydrate' - пост возвращается из архива в текущей транзакции, 'reject' - изменение отклоняется.
+    Вызывается только после проверки прав доступа, т.к. возврат переносит пост со всеми комментариями
+    :return: None, если пост возвращен из архива, иначе Archived
+    """
+    if current_app.config['ARCHIVE_WRITE_POLICY'] != 'rehydrate':
+        return Archived('post')
+    rehydrate_post(post_id)
+    return None
+
+
+def post_exists(post_id, for_write=False):
+    """
+    Проверка существования поста без загрузки его данных
+    :param for_write: пост будет изменен, архивный пост обрабатывается согласно ARCHIVE_WRITE_POLICY
+    :return: None или NotFound/Archived
+    """
+    if active_post_exists(post_id):
+        return None
+    if not for_write or not archived_post_exists(post_id):
+        return NotFound('post')
+    return _unarchive(post_id)
+
+
+def resolve_post_row(post_id, archived=False):
+    """
+    Поиск сохраненного фрагмента поста без загрузки объекта ORM
+    :param archived: поиск в архиве постов
+    :return: (строка (id, rendered, view_count), None) или (None, NotFound)
+    """
+    row = fragment_row(post_id, archived)
+    return (row, None) if row else (None, NotFound('post'))
+
+
+def resolve_post(post_id, user=None, rehydrate=True):
+    """
+    Поиск поста и проверка прав доступа одним запросом
+    :param post_id: идентификатор поста
+    :param user: пользователь, запрашивающий изменение поста,
+    если не указан, то проверка прав доступа пропускается
+    :param rehydrate: обрабатывать архивный пост согласно ARCHIVE_WRITE_POLICY (только вместе с user)
+    :return: (пост, None) или (None, NotFound/Forbidden/Archived)
+    """
+    if user is None:
+        post = active_post(post_id)
+        return (post, None) if post else (None, NotFound('post'))
+
+    row = post_with_owner(post_id, user.id)
+    if row is None:
+        if not rehydrate:
+            return None, NotFound('post')
+        # Права доступа к архивному посту проверяются по архиву до его возврата в основные таблицы
+        archived = archived_post_with_owner(post_id, user.id)
+        if archived is None:
+            return None, NotFound('post')
+        failure = _unarchive(post_id) if archived.is_owner else Forbidden('post')
+        return (None, failure) if failure else resolve_post(post_id, user, rehydrate=False)
+    post, is_owner = row
+    if not is_owner:
+        return None, Forbidden('post')
+    return post, None
+
+
+def resolve_comment(post_id, comment_id, user, rehydrate=True):
+    """
+    Поиск комментария к посту и проверка прав доступа одним запросом:
+    пост выбирается с внешним соединением комментария, что позволяет
+    отличить отсутствующий пост от отсутствующего комментария
+    :param post_id: идентификатор поста
+    :param comment_id: идентификатор комментария
+    :param user: пользователь, запрашивающий изменение комментария
+    :param rehydrate: обрабатывать архивный пост согласно ARCHIVE_WRITE_POLICY
+    :return: (комментарий, None) или (None, NotFound/Forbidden/Archived)
+    """
+    row = comment_with_owner(post_id, comment_id, user.id)
+    if row is None:
+        if not rehydrate:
+            return None, NotFound('post')
+        archived = archived_comment_with_owner(post_id, comment_id, user.id)
+        if archived is None:
+            failure = NotFound('post')
+        elif archived.comment_id is None:
+            failure = NotFound('comment')
+        elif not archived.is_owner:
+            failure = Forbidden('comment')
+        else:
+            failure = _unarchive(post_id)
+        return (None, failure) if failure else resolve_comment(post_id, comment_id, user, rehydrate=False)
+    _, comment, is_owner = row
+    if comment is None:
+        return None, NotFound('comment')
+    if not is_owner:
+        return None, Forbidden('comment')
+    return comment, None
@@ -0,0 +1,110 @@
+import datetime
+import time
+
+from sqlalchemy import and_, literal, select
+
+from . import db
+from .models import publication_now
+from .repository import comment_archive_table, comment_table, post_archive_table, post_table
+
+# Колонки, переносимые между основными и архивными таблицами
+POST_FIELDS = ('id', 'author_id', 'title', 'content', 'publication_datetime', 'view_count', 'rendered')
+COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'title', 'content', 'publication_datetime', 'rendered')
+
+
+def _copy(source, target, fields, condition, archived_at=None):
+    """Копирование строк из source в target одним запросом INSERT ... SELECT"""
+    columns = [source.c[name] for name in fields]
+    names = list(fields)
+    if archived_at is not None:
+        columns.append(literal(archived_at, type_=target.c.archived_at.type))
+        names.append('archived_at')
+    db.session.execute(target.insert().from_select(names, select(columns).where(condition)))
+
+
+def _move(post_ids, archived_at=None):
+    """
+    Перенос постов и их комментариев между таблицами в рамках текущей транзакции.
+    При archived_at строки переносятся в архив, иначе - из архива в основные таблицы.
+    """
+    if archived_at is not None:
+        posts, comments = post_table, comment_table
+        target_posts, target_comments = post_archive_table, comment_archive_table
+    else:
+        posts, comments = post_archive_table, comment_archive_table
+        target_posts, target_comments = post_table, comment_table
+
+    # Пост копируется раньше комментариев, а удаляется позже, чтобы не нарушать внешние ключи
+    _copy(posts, target_posts, POST_FIELDS, posts.c.id.in_(post_ids), archived_at)
+    _copy(comments, target_comments, COMMENT_FIELDS, comments.c.post_id.in_(post_ids), archived_at)
+    db.session.execute(comments.delete().where(comments.c.post_id.in_(post_ids)))
+    db.session.execute(posts.delete().where(posts.c.id.in_(post_ids)))
+
+
+def archive_posts(older_than, batch_size, pause=0):
+    """
+    Перенос постов, опубликованных раньше older_than, и их комментариев в архивные таблицы.
+    Каждый пакет переносится в отдельной транзакции. Идентификаторы сохраняются,
+    поэтому ссылки на архивные посты остаются рабочими.
+    Помеченные как удаленные посты не архивируются - их удаляет фоновая очистка.
+    :param older_than: datetime.timedelta - возраст постов
+    :param batch_size: число постов в пакете
+    :param pause: пауза между пакетами в секундах
+    :return: число перенесенных постов
+    """
+    # Время публикации хранится в часовом поясе публикации, а не в UTC
+    threshold = publication_now() - older_than
+    query = select([post_table.c.id]).where(
+        post_table.c.deleted_at.is_(None) & (post_table.c.publication_datetime < threshold)
+    ).order_by(post_table.c.id).limit(batch_size)
+
+    total = 0
+    while True:
+        post_ids = [row.id for row in db.session.execute(query)]
+        if not post_ids:
+            break
+        _move(post_ids, archived_at=datetime.datetime.utcnow())
+        db.session.commit()
+        total += len(post_ids)
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def archived_post_exists(post_id):
+    """Проверка наличия поста в архиве"""
+    stmt = select([post_archive_table.c.id]).where(post_archive_table.c.id == post_id)
+    return db.session.execute(stmt).first() is not None
+
+
+def archived_post_with_owner(post_id, user_id):
+    """(идентификатор архивного поста, является ли пользователь автором) или None"""
+    stmt = select([
+        post_archive_table.c.id, (post_archive_table.c.author_id == user_id).label('is_owner')
+    ]).where(post_archive_table.c.id == post_id)
+    return db.session.execute(stmt).first()
+
+
+def archived_comment_with_owner(post_id, comment_id, user_id):
+    """
+    (идентификатор архивного поста, идентификатор комментария или None, является ли пользователь
+    автором комментария) или None, если поста нет в архиве
+    """
+    posts, comments = post_archive_table, comment_archive_table
+    join = posts.outerjoin(comments, and_(comments.c.post_id == posts.c.id, comments.c.id == comment_id))
+    stmt = select([
+        posts.c.id, comments.c.id.label('comment_id'), (comments.c.author_id == user_id).label('is_owner')
+    ]).select_from(join).where(posts.c.id == post_id)
+    return db.session.execute(stmt).first()
+
+
+def rehydrate_post(post_id):
+    """
+    Возврат поста и его комментариев из архива в основные таблицы
+    в рамках текущей транзакции (фиксируется вызывающим кодом)
+    :return: был ли пост найден в архиве
+    """
+    if not archived_post_exists(post_id):
+        return False
+    _move([post_id])
+    return True
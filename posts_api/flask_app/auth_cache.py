@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+import os
+
+from flask import current_app
+
+from .shared_cache import AUTH, MISS, current_cache
+
+# Ключ записей создается в памяти процесса и не сохраняется в файл кэша, поэтому по содержимому
+# файла нельзя подбирать пароли. При загрузке приложения в мастере (preload_app) ключ
+# наследуется воркерами и записи общие, иначе каждый воркер использует свои записи.
+_SECRET = os.urandom(32)
+
+
+def _key(username, password):
+    message = f'{username}\0{password}'.encode('utf-8')
+    return hmac.new(_SECRET, message, hashlib.sha256).hexdigest()
+
+
+def cached_user_id(username, password):
+    """
+    Идентификатор пользователя, пароль которого недавно успешно проверен,
+    или None, если проверка не кэширована (либо общий кэш отключен)
+    """
+    shared = current_cache()
+    if shared is None or not current_app.config['AUTH_CACHE_TTL']:
+        return None
+    value = shared.get(AUTH, _key(username, password))
+    if value is MISS or value is None:
+        return None
+    return int(value)
+
+
+def remember_user(username, password, user_id):
+    """Сохранение успешной проверки пароля в общем кэше на AUTH_CACHE_TTL секунд"""
+    shared = current_cache()
+    ttl = current_app.config['AUTH_CACHE_TTL']
+    if shared is not None and ttl:
+        shared.set(AUTH, _key(username, password), str(user_id).encode('ascii'), ttl)
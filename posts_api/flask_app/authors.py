@@ -0,0 +1,92 @@
+import threading
+import time
+
+from flask import current_app
+
+from . import db
+from .models import User
+
+
+class AuthorCache:
+    """
+    Кэш имен пользователей (идентификатор -> имя) в памяти воркера с ограниченным временем жизни записей.
+    Имя пользователя не изменяется через API, поэтому устаревание ограничено только временем жизни записи.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids, now):
+        """
+        Получение имен из кэша
+        :return: (словарь {идентификатор: имя}, список отсутствующих идентификаторов)
+        """
+        found, missing = {}, []
+        entries = self._entries
+        for user_id in user_ids:
+            entry = entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                found[user_id] = entry[0]
+            else:
+                missing.append(user_id)
+        return found, missing
+
+    def set_many(self, usernames, ttl, max_size, now):
+        """Сохранение имен в кэш, при переполнении удаляются устаревшие записи, затем - все"""
+        with self._lock:
+            if len(self._entries) + len(usernames) > max_size:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[1] > now}
+                if len(self._entries) + len(usernames) > max_size:
+                    self._entries = {}
+            expires = now + ttl
+            for user_id, username in usernames.items():
+                self._entries[user_id] = (username, expires)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+author_cache = AuthorCache()
+
+
+def usernames(user_ids):
+    """
+    Имена пользователей по идентификаторам: из кэша воркера (AUTHORS_CACHE_TTL)
+    и одним запросом к БД для отсутствующих в кэше
+    :return: словарь {идентификатор: имя}
+    """
+    config = current_app.config
+    ttl = config['AUTHORS_CACHE_TTL']
+    now = time.monotonic()
+    if ttl:
+        found, missing = author_cache.get_many(user_ids, now)
+    else:
+        found, missing = {}, list(user_ids)
+    if missing:
+        loaded = dict(db.session.query(User.id, User.username).filter(User.id.in_(missing)))
+        if ttl:
+            author_cache.set_many(loaded, ttl, config['AUTHORS_CACHE_SIZE'], now)
+        found.update(loaded)
+    return found
+
+
+def expand_authors(items):
+    """
+    Добавление поля author ({id, username}) к сериализованным постам и их комментариям
+    или к комментариям. Авторы всех объектов загружаются одним запросом.
+    Элементы без author_id (например, сообщения об отсутствующих постах) пропускаются.
+    :return: items
+    """
+    objects = []
+    for item in items:
+        if 'author_id' not in item:
+            continue
+        objects.append(item)
+        objects.extend(item.get('comments', ()))
+    names = usernames({obj['author_id'] for obj in objects})
+    for obj in objects:
+        author_id = obj['author_id']
+        obj['author'] = {'id': author_id, 'username': names.get(author_id)}
+    return items
@@ -0,0 +1,212 @@
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import or_
+
+from . import db
+from .models import User
+from .shared_cache import USERS, current_cache
+
+USERNAME = 'username'
+EMAIL = 'email'
+
+
+class BloomFilter:
+    """
+    Фильтр Блума: проверка принадлежности множеству без ложноотрицательных ответов
+    с вероятностью ложноположительного ответа error_rate при числе элементов не более capacity
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class UserFilter:
+    """
+    Фильтр Блума занятых имен пользователей и email`ов в памяти воркера, используется только
+    с общим кэшем воркеров (SHARED_CACHE_PATH).
+    Заполняется при запуске. Регистрация в любом воркере увеличивает метку регистраций
+    в общем кэше: если метка изменилась после заполнения фильтра, перед отрицательным ответом
+    фильтр дополняется новыми пользователями по идентификатору последнего добавленного пользователя,
+    иначе отрицательный ответ дается без запроса к БД.
+    Периодически (AVAILABILITY_FILTER_REFRESH) перестраивается целиком.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._built_at = None
+        # Идентификатор последнего добавленного пользователя и добавленные идентификаторы окна повторного просмотра
+        self._last_id = 0
+        self._recent = set()
+        # Метка регистраций общего кэша, до которой фильтр дополнен
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(field, value):
+        return f'{field}:{value}'
+
+    def _add(self, bloom, user_id, username, email):
+        bloom.add(self._key(USERNAME, username))
+        bloom.add(self._key(EMAIL, email))
+        self._recent.add(user_id)
+        self._last_id = max(self._last_id, user_id)
+
+    def _prune_recent(self):
+        gap_window = current_app.config['AVAILABILITY_FILTER_GAP_WINDOW']
+        self._recent = {user_id for user_id in self._recent if user_id > self._last_id - gap_window}
+
+    @staticmethod
+    def enabled():
+        """Используется ли фильтр: без общего кэша воркер не узнает о регистрациях в других воркерах"""
+        return current_cache() is not None
+
+    @staticmethod
+    def _registrations():
+        shared = current_cache()
+        return shared.generation(USERS) if shared is not None else None
+
+    def warm(self):
+        """Заполнение фильтра всеми пользователями из БД"""
+        config = current_app.config
+        stamp = self._registrations()
+        total = db.session.query(User.id).count()
+        bloom = BloomFilter(max(total * 2, config['AVAILABILITY_FILTER_CAPACITY']),
+                            config['AVAILABILITY_FILTER_ERROR_RATE'])
+        self._last_id, self._recent = 0, set()
+        for user_id, username, email in db.session.query(User.id, User.username, User.email).yield_per(10000):
+            self._add(bloom, user_id, username, email)
+        self._prune_recent()
+        self._stamp = stamp
+        self._filter = bloom
+        self._built_at = time.monotonic()
+
+    def _stale(self):
+        if self._filter is None:
+            return True
+        refresh = current_app.config['AVAILABILITY_FILTER_REFRESH']
+        if refresh and time.monotonic() - self._built_at > refresh:
+            return True
+        # Фильтр, заполненный сверх расчетного числа элементов, перестраивается с большим размером
+        return self._filter.count > self._filter.capacity
+
+    def _current(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self.warm()
+        return self._filter
+
+    def might_contain(self, field, value):
+        """Возможно ли, что значение занято (False - значение было свободно при последнем дополнении фильтра)"""
+        return self._key(field, value) in self._current()
+
+    def behind(self):
+        """Были ли регистрации после заполнения или дополнения фильтра"""
+        return self._stamp is None or self._stamp != self._registrations()
+
+    def catch_up(self):
+        """
+        Дополнение фильтра пользователями, зарегистрированными после его заполнения, одним запросом
+        по первичному ключу. Пользователь с меньшим идентификатором может быть зафиксирован позже
+        пользователя с большим, поэтому повторно просматривается окно из AVAILABILITY_FILTER_GAP_WINDOW
+        последних идентификаторов
+        """
+        bloom = self._current()
+        stamp = self._registrations()
+        low = max(self._last_id - current_app.config['AVAILABILITY_FILTER_GAP_WINDOW'], 0)
+        rows = db.session.query(User.id, User.username, User.email).filter(User.id > low).order_by(User.id).all()
+        with self._lock:
+            if bloom is not self._filter:
+                # Фильтр перестроен другим потоком
+                return
+            for user_id, username, email in rows:
+                if user_id not in self._recent:
+                    self._add(bloom, user_id, username, email)
+            self._prune_recent()
+            self._stamp = stamp
+
+    def add(self, user):
+        """
+        Добавление пользователя, регистрация которого зафиксирована, и увеличение метки регистраций,
+        по которой фильтры остальных воркеров дополняются перед отрицательным ответом
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._add(self._filter, user.id, user.username, user.email)
+        shared = current_cache()
+        if shared is not None:
+            shared.invalidate_namespace(USERS)
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._built_at = None
+            self._last_id, self._recent = 0, set()
+            self._stamp = None
+
+
+user_filter = UserFilter()
+
+
+def taken_fields(username=None, email=None):
+    """
+    Проверка занятости имени пользователя и email`а одним запросом
+    :return: множество занятых полей (USERNAME, EMAIL)
+    """
+    conditions = []
+    if username:
+        conditions.append(User.username == username)
+    if email:
+        conditions.append(User.email == email)
+    if not conditions:
+        return set()
+    taken = set()
+    for found_username, found_email in db.session.query(User.username, User.email).filter(or_(*conditions)):
+        if username and found_username == username:
+            taken.add(USERNAME)
+        if email and found_email == email:
+            taken.add(EMAIL)
+    return taken
+
+
+def check_availability(username=None, email=None):
+    """
+    Проверка доступности имени пользователя и email`а для регистрации.
+    Значения, отсутствующие в фильтре Блума, считаются свободными без запроса к БД
+    (если после заполнения фильтра были регистрации - после его дополнения),
+    остальные проверяются одним запросом. Без общего кэша все значения проверяются запросом.
+    :return: словарь {поле: свободно ли значение} для переданных значений
+    """
+    values = {field: value for field, value in ((USERNAME, username), (EMAIL, email)) if value}
+    if not user_filter.enabled():
+        taken = taken_fields(**values)
+        return {field: field not in taken for field in values}
+    candidates = {field: value for field, value in values.items() if user_filter.might_contain(field, value)}
+    if len(candidates) < len(values) and user_filter.behind():
+        # Отрицательный ответ фильтра не должен пропустить пользователей, зарегистрированных через другие воркеры
+        user_filter.catch_up()
+        candidates = {field: value for field, value in values.items() if user_filter.might_contain(field, value)}
+    taken = taken_fields(**candidates) if candidates else set()
+    return {field: field not in taken for field in values}
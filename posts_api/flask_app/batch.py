@@ -0,0 +1,174 @@
+"""
+Пакетное выполнение операций API (POST /api/v1/batch).
+
+Операция пакета обрабатывается тем же представлением, что и отдельный запрос, но без повторного
+прохождения хуков blueprint`а (ограничение частоты, профилирование, трассировка): запрос текущего
+контекста на время операции подменяется запросом операции. Пароль проверяется один раз для всего
+пакета, операции выполняются от имени проверенного пользователя.
+
+В атомарном режиме каждая операция выполняется в подтранзакции общей транзакции пакета:
+фиксация в обработчике операции только завершает подтранзакцию, а изменения всех операций
+фиксируются вместе после выполнения последней операции.
+"""
+import re
+from contextlib import contextmanager, nullcontext
+
+from flask import _request_ctx_stack, current_app, g, request, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+from . import db
+from .api.representations import loads
+from .post_cache import post_cache
+from .tracing import span
+
+# Ссылка на поле ответа предыдущей операции в пути: /posts/{0.id}/comments
+REFERENCE = re.compile(r'\{(\d+)\.(\w+)\}')
+# Endpoint`ы, которые нельзя выполнять в пакете
+NOT_BATCHABLE = frozenset(('api.batch', 'api.stream'))
+
+NOT_EXECUTED = 424
+
+
+class UnresolvedReference(Exception):
+    """Ссылка на ответ операции, которая еще не выполнена, завершилась ошибкой или не содержит поля"""
+
+
+def resolve_path(path, results):
+    """
+    Подстановка в путь операции полей ответов предыдущих операций
+    :param results: результаты выполненных операций
+    :raise UnresolvedReference: если ссылку нельзя разрешить
+    """
+    def replace(match):
+        index, field = int(match.group(1)), match.group(2)
+        if index >= len(results) or results[index]['status'] >= 400:
+            raise UnresolvedReference(match.group(0))
+        body = results[index]['body']
+        if not isinstance(body, dict) or body.get(field) is None:
+            raise UnresolvedReference(match.group(0))
+        return str(body[field])
+
+    return REFERENCE.sub(replace, path)
+
+
+@contextmanager
+def _operation_request(method, path, body):
+    """
+    Подмена запроса текущего контекста запросом операции.
+    Контекст запроса не создается заново, т.к. его завершение выполнило бы обработчики
+    teardown_request пакета и сбросило бы сессию БД общей транзакции.
+    """
+    ctx = _request_ctx_stack.top
+    builder = EnvironBuilder(
+        path=url_for('api.api_root').rstrip('/') + path,
+        base_url=request.url_root,
+        method=method,
+        json=body,
+        headers={'Authorization': request.headers.get('Authorization', '')},
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+    try:
+        operation_request = current_app.request_class(builder.get_environ())
+    finally:
+        builder.close()
+    batch_request = ctx.request
+    ctx.request = operation_request
+    try:
+        yield operation_request
+    finally:
+        ctx.request = batch_request
+
+
+def _response_body(response):
+    data = response.get_data()
+    if not data or response.status_code == 204:
+        return None
+    return loads(data) if response.is_json else data.decode('utf-8')
+
+
+def dispatch(method, path, body):
+    """
+    Выполнение операции представлением API
+    :return: (статус-код, тело ответа)
+    """
+    with _operation_request(method, path, body) as operation_request:
+        try:
+            rule, view_args = current_app.create_url_adapter(operation_request).match(return_rule=True)
+        except HTTPException as e:
+            return e.code, {'message': e.name.lower()}
+        if rule.endpoint in NOT_BATCHABLE or not rule.endpoint.startswith('api.'):
+            return 400, {'message': 'operation is not allowed in batch'}
+        operation_request.url_rule, operation_request.view_args = rule, view_args
+
+        try:
+            rv = current_app.view_functions[rule.endpoint](**view_args)
+        except HTTPException as e:
+            rv = current_app.handle_user_exception(e)
+        response = current_app.make_response(rv)
+        return response.status_code, _response_body(response)
+
+
+def _execute(operation, results, atomic):
+    """Выполнение операции пакета, в атомарном режиме - в подтранзакции"""
+    method = operation['method']
+    try:
+        path = resolve_path(operation['path'], results)
+    except UnresolvedReference as e:
+        return {'status': NOT_EXECUTED, 'body': {'message': f'unresolved reference {e}'}}
+
+    session = db.session()
+    subtransaction = session.begin(subtransactions=True) if atomic else None
+    with span('batch.operation', method=method, path=path):
+        try:
+            status, body = dispatch(method, path, operation['body'])
+        except Exception:
+            current_app.logger.exception('batch operation failed: %s %s', method, path)
+            status, body = 500, {'message': 'internal server error'}
+    if status >= 400:
+        # Незафиксированные изменения операции не должны попасть в следующие операции
+        if subtransaction is not None and session.transaction is subtransaction:
+            session.rollback()
+        session.rollback()
+    elif subtransaction is not None and session.transaction is subtransaction:
+        session.commit()
+    return {'status': status, 'body': body}
+
+
+def run_batch(operations, atomic=False):
+    """
+    Выполнение операций пакета по порядку от имени текущего пользователя (g.user).
+    Без атомарного режима каждая операция фиксируется отдельно, ошибка операции
+    не прерывает выполнение пакета.
+    В атомарном режиме при ошибке операции изменения всех операций отменяются,
+    следующие операции не выполняются (статус 424).
+    :param operations: список операций {'method', 'path', 'body'}, путь указывается от корня API
+    :return: результаты операций {'status', 'body'} в порядке операций,
+    в атомарном режиме - и признак фиксации изменений (committed)
+    """
+    g.batch_user = g.user
+    results = []
+    try:
+        # Посты, сброшенные в кэше до фиксации транзакции пакета, сбрасываются повторно после нее
+        with post_cache.deferred() if atomic else nullcontext():
+            for operation in operations:
+                result = _execute(operation, results, atomic)
+                results.append(result)
+                if atomic and result['status'] >= 400:
+                    break
+            committed = len(results) == len(operations)
+            if atomic:
+                if committed:
+                    db.session.commit()
+                else:
+                    db.session.rollback()
+    finally:
+        g.pop('batch_user', None)
+
+    results.extend(
+        {'status': NOT_EXECUTED, 'body': {'message': 'not executed'}}
+        for _ in range(len(operations) - len(results))
+    )
+    if atomic:
+        return {'committed': committed, 'results': results}
+    return {'results': results}
@@ -0,0 +1,132 @@
+import datetime
+
+from sqlalchemy import and_, event, exists, func, select
+from sqlalchemy.orm import aliased
+
+from . import db
+from .api.representations import dumps
+from .models import Change, ChangeCompaction, Comment, Post
+from .serializers import comment_create_schema, post_fragment_schema
+
+POST = 'post'
+COMMENT = 'comment'
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+# Ключ рекомендательной блокировки PostgreSQL, под которой выделяются номера записей журнала
+CHANGE_LOG_LOCK = 0x63686c67
+
+
+@event.listens_for(Change, 'before_insert')
+def _lock_change_log(mapper, connection, target):
+    """
+    Номер записи журнала выделяется под блокировкой, удерживаемой до конца транзакции, поэтому
+    транзакции фиксируют записи журнала в порядке их номеров: клиент, получивший запись N
+    (GET /changes, поток событий), не пропустит запись с меньшим номером, зафиксированную позже.
+    В SQLite запись в БД и так выполняется транзакциями по очереди.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(select([func.pg_advisory_xact_lock(CHANGE_LOG_LOCK)]))
+
+
+def record_change(operation, obj):
+    """
+    Добавление записи в журнал изменений в рамках текущей транзакции
+    :param operation: тип операции (CREATE, UPDATE, DELETE)
+    :param obj: измененный пост или комментарий
+    :return: запись журнала
+    """
+    if obj.id is None:
+        db.session.flush()
+    if isinstance(obj, Post):
+        entity, post_id, schema = POST, obj.id, post_fragment_schema
+    elif isinstance(obj, Comment):
+        entity, post_id, schema = COMMENT, obj.post_id, comment_create_schema
+    else:
+        raise TypeError(f'unsupported entity: {type(obj).__name__}')
+
+    # Для удалений в журнал записывается только "надгробие" без данных,
+    # для остальных операций - фрагмент объекта, если он уже сформирован в этой транзакции
+    rendered = obj.__dict__.get('rendered')
+    if operation == DELETE:
+        data = None
+    elif rendered is not None:
+        data = rendered
+    else:
+        data = dumps(schema.dump(obj)).decode('utf-8')
+    change = Change(entity=entity, entity_id=obj.id, post_id=post_id, operation=operation, data=data)
+    db.session.add(change)
+    return change
+
+
+def changes_horizon():
+    """
+    Номер записи, до которого журнал был сжат с удалением "надгробий".
+    Клиенты, синхронизированные до этого номера, должны загрузить данные заново.
+    """
+    return db.session.query(func.max(ChangeCompaction.horizon)).scalar() or 0
+
+
+def last_change_id():
+    """Номер последней записи журнала (0, если журнал пуст)"""
+    return db.session.query(func.max(Change.id)).scalar() or 0
+
+
+def posts_changed_since(since, first_post_id, last_post_id):
+    """Есть ли в журнале после номера since изменения постов (или их комментариев) из диапазона идентификаторов"""
+    return db.session.query(exists().where(and_(
+        Change.id > since, Change.post_id.between(first_post_id, last_post_id)
+    ))).scalar()
+
+
+def changes_since(since, limit):
+    """
+    Получение записей журнала после указанного номера
+    :return: (список записей, есть ли еще записи)
+    """
+    changes = Change.query.filter(Change.id > since).order_by(Change.id).limit(limit + 1).all()
+    return changes[:limit], len(changes) > limit
+
+
+def compact_changes(retention):
+    """
+    Сжатие журнала изменений. Из записей старше retention удаляются:
+    записи, замененные более новыми записями того же объекта;
+    записи комментариев к удаленным постам;
+    "надгробия" - при этом сохраняется горизонт сжатия.
+    :param retention: datetime.timedelta - срок хранения записей
+    :return: число удаленных записей
+    """
+    threshold = datetime.datetime.utcnow() - retention
+    newer = aliased(Change)
+    post_tombstone = aliased(Change)
+
+    deleted = Change.query.filter(
+        Change.created_at < threshold,
+        exists().where(and_(
+            newer.entity == Change.entity,
+            newer.entity_id == Change.entity_id,
+            newer.id > Change.id
+        ))
+    ).delete(synchronize_session=False)
+
+    deleted += Change.query.filter(
+        Change.created_at < threshold,
+        Change.entity == COMMENT,
+        exists().where(and_(
+            post_tombstone.entity == POST,
+            post_tombstone.entity_id == Change.post_id,
+            post_tombstone.operation == DELETE
+        ))
+    ).delete(synchronize_session=False)
+
+    tombstones = Change.query.filter(Change.created_at < threshold, Change.operation == DELETE)
+    horizon = tombstones.with_entities(func.max(Change.id)).scalar()
+    if horizon is not None:
+        deleted += tombstones.delete(synchronize_session=False)
+        db.session.add(ChangeCompaction(horizon=horizon))
+
+    db.session.commit()
+    return deleted
@@ -0,0 +1,120 @@
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+
+from . import db
+from .models import Post, PostArchive
+
+# Число постов в одном запросе UPDATE
+FLUSH_CHUNK_SIZE = 500
+
+UPDATE_VIEW_COUNTS = (
+    'WITH v(id, delta) AS (VALUES {values}) '
+    'UPDATE {table} SET view_count = view_count + v.delta FROM v WHERE {table}.id = v.id'
+)
+
+
+def apply_view_counts(counts):
+    """
+    Добавление накопленных просмотров к счетчикам постов пакетными запросами
+    UPDATE ... FROM (VALUES ...) в рамках текущей транзакции.
+    Обновляются и основная, и архивная таблицы постов.
+    :param counts: словарь {идентификатор поста: число просмотров}
+    """
+    items = list(counts.items())
+    for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+        chunk = items[start:start + FLUSH_CHUNK_SIZE]
+        values = ', '.join(f'(:id{i}, :delta{i})' for i in range(len(chunk)))
+        params = {}
+        for i, (post_id, delta) in enumerate(chunk):
+            params[f'id{i}'] = post_id
+            params[f'delta{i}'] = delta
+        for model in (Post, PostArchive):
+            stmt = text(UPDATE_VIEW_COUNTS.format(values=values, table=model.__tablename__))
+            db.session.execute(stmt, params)
+
+
+class ViewCounter:
+    """
+    Счетчик просмотров постов в памяти воркера.
+    Просмотры накапливаются и периодически (VIEW_COUNTS_FLUSH_INTERVAL) записываются в БД
+    фоновым потоком, поэтому при аварийном завершении воркера теряются просмотры
+    не более чем за один интервал. При штатном завершении воркера накопленные просмотры
+    записываются хуком worker_exit (gunicorn.conf.py).
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    @property
+    def pending(self):
+        return dict(self._pending)
+
+    def increment(self, post_id):
+        """Учет просмотра поста"""
+        config = current_app.config
+        with self._lock:
+            self._pending[post_id] = self._pending.get(post_id, 0) + 1
+            overflow = len(self._pending) >= config['VIEW_COUNTS_MAX_PENDING']
+        interval = config['VIEW_COUNTS_FLUSH_INTERVAL']
+        if interval is None:
+            return
+        # Поток записи запускается в каждом воркере после fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._wakeup = threading.Event()
+                    thread = threading.Thread(
+                        target=self._flush_loop, args=(current_app._get_current_object(), interval), daemon=True
+                    )
+                    thread.start()
+                    self._pid = os.getpid()
+        if overflow:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Запись накопленных просмотров в БД одной транзакцией.
+        При ошибке просмотры возвращаются в счетчик для следующей попытки.
+        :return: число обновленных постов
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            apply_view_counts(pending)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for post_id, delta in pending.items():
+                    self._pending[post_id] = self._pending.get(post_id, 0) + delta
+            raise
+        return len(pending)
+
+    def _flush_loop(self, app, interval):
+        """Цикл периодической записи просмотров"""
+        wakeup = self._wakeup
+        while True:
+            wakeup.wait(interval)
+            wakeup.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('view counts flush failed')
+                finally:
+                    db.session.remove()
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,127 @@
+from . import db
+from .api.representations import dumps
+from .models import Comment, Post
+from .readers import fetch_post_rows
+from .repository import comment_fragment_rows, comment_rows_by_id, fragment_rows
+from .serializers import comment_create_schema, post_fragment_schema
+from .tracing import span
+
+
+def render_fragment(obj):
+    """
+    Сохранение сериализованного представления поста (без комментариев) или комментария.
+    Вызывается обработчиками изменений перед фиксацией транзакции.
+    """
+    if obj.id is None:
+        db.session.flush()
+    schema = post_fragment_schema if isinstance(obj, Post) else comment_create_schema
+    obj.rendered = dumps(schema.dump(obj)).decode('utf-8')
+    return obj.rendered
+
+
+def assemble_post(post_fragment, comment_fragments, view_count=0):
+    """
+    Сборка JSON поста с комментариями из сохраненных фрагментов.
+    Поля view_count и comments являются последними полями PostSchema.
+    """
+    return (post_fragment[:-1] + f',"view_count":{int(view_count)},"comments":['
+            + ','.join(comment_fragments) + ']}')
+
+
+def _missing_fragments(model, ids, archived=False):
+    """Сериализация строк, для которых фрагменты еще не сохранены"""
+    if not ids:
+        return {}
+    if model is Post:
+        rows = fetch_post_rows(ids, active_only=False, archived=archived).values()
+        schema = post_fragment_schema
+    else:
+        rows = comment_rows_by_id(ids, archived)
+        schema = comment_create_schema
+    return {row.id: dumps(schema.dump(row)).decode('utf-8') for row in rows}
+
+
+def comment_fragments(post_ids, archived=False):
+    """
+    Фрагменты комментариев к постам
+    :return: словарь {идентификатор поста: [фрагменты комментариев]}
+    """
+    result = {post_id: [] for post_id in post_ids}
+    if not post_ids:
+        return result
+    rows = comment_fragment_rows(post_ids, archived)
+    missing = _missing_fragments(Comment, [row.id for row in rows if row.rendered is None], archived)
+    for row in rows:
+        result[row.post_id].append(row.rendered if row.rendered is not None else missing[row.id])
+    return result
+
+
+def assemble_posts(rows, archived=False):
+    """
+    Сборка JSON списка постов из строк (id, rendered, view_count)
+    :param archived: посты и комментарии читаются из архивных таблиц
+    :return: список JSON-строк постов
+    """
+    post_ids = [row.id for row in rows]
+    comments = comment_fragments(post_ids, archived)
+    missing = _missing_fragments(Post, [row.id for row in rows if row.rendered is None], archived)
+    return [
+        assemble_post(
+            row.rendered if row.rendered is not None else missing[row.id], comments[row.id], row.view_count
+        )
+        for row in rows
+    ]
+
+
+def post_rows(post_ids, archived=False):
+    """
+    Строки (id, rendered, view_count) постов по списку идентификаторов одним запросом
+    :return: словарь {идентификатор поста: строка}
+    """
+    if not post_ids:
+        return {}
+    return {row.id: row for row in fragment_rows(post_ids, archived)}
+
+
+class FragmentsDumper:
+    """Объект с интерфейсом сериализатора для Pagination.paginate, собирающий посты из фрагментов"""
+
+    def __init__(self, archived=False):
+        self.archived = archived
+
+    def dump(self, rows, many=True):
+        with span('fragments.assemble'):
+            return assemble_posts(rows, self.archived)
+
+
+def comments_body(post_id, archived=False):
+    """JSON списка комментариев к посту, собранный из фрагментов"""
+    return ('[' + ','.join(comment_fragments([post_id], archived)[post_id]) + ']').encode('utf-8')
+
+
+def page_body(page):
+    """JSON страницы постов: данные пагинации и собранные из фрагментов посты"""
+    envelope = dumps({'pagination': page['pagination']})
+    return envelope[:-1] + b',"data":[' + ','.join(page['data']).encode('utf-8') + b']}'
+
+
+def rebuild_fragments(batch_size):
+    """
+    Пересоздание всех фрагментов, например после изменения сериализаторов
+    :return: (число постов, число комментариев)
+    """
+    counts = []
+    for model in (Post, Comment):
+        total = 0
+        last_id = 0
+        while True:
+            objects = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not objects:
+                break
+            last_id = objects[-1].id
+            for obj in objects:
+                render_fragment(obj)
+            db.session.commit()
+            total += len(objects)
+        counts.append(total)
+    return tuple(counts)
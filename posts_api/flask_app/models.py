@@ -1,9 +1,18 @@
 import datetime
 
+import pytz
 
 from . import db
 from passlib.apps import custom_app_context as password_hasher
 
+# Часовой пояс, в котором хранится время публикации постов и комментариев
+PUBLICATION_TIMEZONE = pytz.timezone('Europe/Moscow')
+
+
+def publication_now():
+    """Текущее время публикации: в часовом поясе PUBLICATION_TIMEZONE без tzinfo, как хранится в БД"""
+    return datetime.datetime.now(PUBLICATION_TIMEZONE).replace(tzinfo=None)
+
 
 class User(db.Model):
     """Модель пользователей"""
@@ -29,11 +38,19 @@ class User(db.Model):
 
 class Post(db.Model):
     """Модель постов"""
+    # Идентификаторы не переиспользуются после переноса постов в архив
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    publication_datetime = db.Column(db.DateTime, default=datetime.datetime.now())
+    publication_datetime = db.Column(db.DateTime, default=publication_now)
+    deleted_at = db.Column(db.DateTime, index=True)
+    # Обновляется пакетно из счетчиков воркеров (counters.ViewCounter)
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Сериализованное представление поста без комментариев
+    rendered = db.deferred(db.Column(db.Text))
 
     comments = db.relationship('Comment', backref='post', cascade='all, delete',
                                passive_deletes=True, lazy='dynamic', order_by="Comment.id")
@@ -44,12 +61,79 @@ class Post(db.Model):
 
 class Comment(db.Model):
     """Модель комментариев"""
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(128), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    publication_datetime = db.Column(db.DateTime, default=datetime.datetime.now())
+    publication_datetime = db.Column(db.DateTime, default=publication_now)
+    # Сериализованное представление комментария
+    rendered = db.deferred(db.Column(db.Text))
 
     def __repr__(self):
         return f'<Comment id: {self.id}, title: {self.title}>'
+
+
+class PostArchive(db.Model):
+    """Модель архива постов"""
+    __tablename__ = 'post_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    publication_datetime = db.Column(db.DateTime, index=True)
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rendered = db.deferred(db.Column(db.Text))
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PostArchive id: {self.id}, title: {self.title}>'
+
+
+class CommentArchive(db.Model):
+    """Модель архива комментариев"""
+    __tablename__ = 'comment_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post_archive.id', ondelete='CASCADE'), nullable=False, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    title = db.Column(db.String(128), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    publication_datetime = db.Column(db.DateTime)
+    rendered = db.deferred(db.Column(db.Text))
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CommentArchive id: {self.id}, title: {self.title}>'
+
+
+class Change(db.Model):
+    """Модель журнала изменений постов и комментариев"""
+    __table_args__ = (
+        db.Index('ix_change_entity', 'entity', 'entity_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(16), nullable=False)
+    data = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<Change id: {self.id}, {self.operation} {self.entity} {self.entity_id}>'
+
+
+class ChangeCompaction(db.Model):
+    """Модель истории сжатия журнала изменений"""
+    id = db.Column(db.Integer, primary_key=True)
+    horizon = db.Column(db.Integer, nullable=False)
+    compacted_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeCompaction id: {self.id}, horizon: {self.horizon}>'
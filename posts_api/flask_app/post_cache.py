@@ -0,0 +1,195 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+from .shared_cache import MISS, PAGES, POSTS, current_cache
+
+# Интервал проверки общего кэша при ожидании поста, загружаемого другим процессом, в секундах
+LEASE_POLL_INTERVAL = 0.01
+
+
+class _Flight:
+    """Загрузка значения, выполняемая одним потоком для всех ожидающих его запросов"""
+    __slots__ = ('done', 'value', 'failed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class PostCache:
+    """
+    Кэш JSON постов (GET /posts/<id>) в памяти воркера или, если он настроен (SHARED_CACHE_PATH),
+    в общем для воркеров хоста кэше.
+    Отсутствующие посты кэшируются как None с коротким временем жизни (POSTS_NEGATIVE_CACHE_TTL),
+    что защищает БД от перебора несуществующих идентификаторов.
+    Одновременные промахи по одному посту в воркере объединяются: пост загружает один поток,
+    остальные ждут его результата (не дольше POSTS_CACHE_WAIT_TIMEOUT). С общим кэшем загрузка
+    объединяется и между воркерами: загружающий поток берет аренду ключа в общем кэше, потоки
+    других воркеров ждут появления поста в нем.
+    Обработчики изменений сбрасывают записи постов после фиксации транзакции. Без общего кэша
+    изменения, сделанные другими воркерами, видны не позже чем через POSTS_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._flights = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, post_id, loader):
+        """
+        Получение поста из кэша или загрузка функцией loader
+        :param loader: функция без аргументов, возвращающая JSON поста или None, если пост не найден
+        :return: JSON поста или None
+        """
+        shared = current_cache()
+        if shared is not None:
+            value = shared.get(POSTS, post_id)
+            if value is not MISS:
+                return value.decode('utf-8') if value is not None else None
+        else:
+            entry = self._entries.get(post_id)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+
+        with self._lock:
+            flight = self._flights.get(post_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[post_id] = _Flight()
+                generation = self._generation
+
+        if not leader:
+            # Если загрузка не удалась или ожидание истекло, пост загружается самостоятельно
+            if flight.done.wait(current_app.config['POSTS_CACHE_WAIT_TIMEOUT']) and not flight.failed:
+                return flight.value
+            return loader()
+
+        leased = False
+        try:
+            value = MISS
+            if shared is not None and current_app.config['POSTS_CACHE_TTL']:
+                leased = shared.lease(POSTS, post_id, current_app.config['POSTS_CACHE_WAIT_TIMEOUT'])
+                if not leased:
+                    value = self._wait_shared(shared, post_id)
+            if value is MISS:
+                token = shared.token(POSTS, post_id) if shared is not None else None
+                value = loader()
+                self._store(post_id, value, generation, shared, token)
+            flight.value = value
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            if leased:
+                shared.release(POSTS, post_id)
+            with self._lock:
+                del self._flights[post_id]
+            flight.done.set()
+        return value
+
+    @staticmethod
+    def _wait_shared(shared, post_id):
+        """
+        Ожидание поста, загружаемого другим процессом, в общем кэше (не дольше POSTS_CACHE_WAIT_TIMEOUT)
+        :return: JSON поста, None или MISS, если пост не появился в кэше до освобождения аренды
+        """
+        expires = time.monotonic() + current_app.config['POSTS_CACHE_WAIT_TIMEOUT']
+        while time.monotonic() < expires:
+            time.sleep(LEASE_POLL_INTERVAL)
+            value = shared.get(POSTS, post_id)
+            if value is not MISS:
+                return value.decode('utf-8') if value is not None else None
+            # Загрузка не удалась или пост не поместился в кэш
+            if not shared.leased(POSTS, post_id):
+                break
+        return MISS
+
+    def _store(self, post_id, value, generation, shared, token):
+        config = current_app.config
+        ttl = config['POSTS_CACHE_TTL'] if value is not None else config['POSTS_NEGATIVE_CACHE_TTL']
+        if not ttl:
+            return
+        if shared is not None:
+            shared.set(POSTS, post_id, value.encode('utf-8') if value is not None else None, ttl, token)
+            return
+        now = time.monotonic()
+        with self._lock:
+            # Значение, загруженное до сброса кэша, могло устареть
+            if generation != self._generation:
+                return
+            if len(self._entries) >= config['POSTS_CACHE_SIZE']:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[1] > now}
+                if len(self._entries) >= config['POSTS_CACHE_SIZE']:
+                    self._entries = {}
+            self._entries[post_id] = (value, now + ttl)
+
+    def invalidate(self, post_id):
+        """
+        Сброс записи поста и кэшированных страниц списка постов,
+        вызывается после фиксации изменения поста или его комментариев
+        """
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred is not None:
+            deferred.add(post_id)
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(post_id, None)
+        shared = current_cache()
+        if shared is not None:
+            shared.delete(POSTS, post_id)
+            shared.invalidate_namespace(PAGES)
+
+    @contextmanager
+    def deferred(self):
+        """
+        Повторный сброс постов, сброшенных внутри блока, при выходе из него.
+        Используется, если изменения фиксируются позже вызова invalidate (транзакция пакета операций):
+        пост, загруженный в кэш до фиксации, не остается в нем до истечения времени жизни.
+        """
+        outer = getattr(self._local, 'deferred', None)
+        pending = self._local.deferred = set()
+        try:
+            yield
+        finally:
+            self._local.deferred = outer
+            for post_id in pending:
+                self.invalidate(post_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries = {}
+        shared = current_cache()
+        if shared is not None:
+            shared.invalidate_namespace(POSTS)
+            shared.invalidate_namespace(PAGES)
+
+
+post_cache = PostCache()
+
+
+def cached_page(key, build):
+    """
+    Тело страницы списка постов из общего кэша (на POSTS_PAGE_CACHE_TTL секунд)
+    или построенное функцией build. Без общего кэша страницы не кэшируются.
+    :param key: ключ страницы (путь с параметрами запроса)
+    :param build: функция без аргументов, возвращающая тело страницы или None (не кэшируется)
+    """
+    shared = current_cache()
+    ttl = current_app.config['POSTS_PAGE_CACHE_TTL']
+    if shared is None or not ttl:
+        return build()
+    body = shared.get(PAGES, key)
+    if body is not MISS and body is not None:
+        return body
+    token = shared.token(PAGES, key)
+    body = build()
+    if body is not None:
+        shared.set(PAGES, key, body, ttl, token)
+    return body
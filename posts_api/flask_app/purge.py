@@ -0,0 +1,47 @@
+import time
+
+from . import db
+from .models import Comment, Post
+
+
+def _purge_batch(query, model, batch_size):
+    """
+    Удаление одного пакета записей, выбранных запросом идентификаторов
+    :return: число удаленных записей
+    """
+    ids = [row[0] for row in query.limit(batch_size)]
+    if not ids:
+        return 0
+    model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+
+def purge_deleted_posts(batch_size, pause=0):
+    """
+    Окончательное удаление помеченных как удаленные постов.
+    Сначала пакетами удаляются комментарии, затем сами посты,
+    каждый пакет выполняется в отдельной транзакции, чтобы не удерживать
+    блокировки на время удаления больших веток комментариев.
+    :param batch_size: размер пакета
+    :param pause: пауза между пакетами в секундах
+    :return: (число удаленных постов, число удаленных комментариев)
+    """
+    comments_query = db.session.query(Comment.id).join(Post, Comment.post_id == Post.id).filter(
+        Post.deleted_at.isnot(None)
+    ).order_by(Comment.id)
+    posts_query = db.session.query(Post.id).filter(Post.deleted_at.isnot(None)).order_by(Post.id)
+
+    purged = []
+    for query, model in ((comments_query, Comment), (posts_query, Post)):
+        total = 0
+        while True:
+            deleted = _purge_batch(query, model, batch_size)
+            if not deleted:
+                break
+            total += deleted
+            if pause:
+                time.sleep(pause)
+        purged.append(total)
+    comments, posts = purged
+    return posts, comments
@@ -0,0 +1,53 @@
+from .repository import comment_columns, comment_rows, comment_table, post_columns, post_rows, post_table
+from .serializers import post_previews_list_schema, posts_list_schema
+
+POST_COLUMNS = post_columns(post_table)
+COMMENT_COLUMNS = comment_columns(comment_table)
+
+
+def fetch_comments(post_ids, archived=False):
+    """
+    Получение комментариев к постам запросом SQLAlchemy Core без создания объектов ORM
+    :return: словарь {идентификатор поста: [строки комментариев]}
+    """
+    result = {post_id: [] for post_id in post_ids}
+    if not post_ids:
+        return result
+    for row in comment_rows(post_ids, archived):
+        result[row.post_id].append(row)
+    return result
+
+
+def fetch_post_rows(post_ids, active_only=True, archived=False, preview=None):
+    """
+    Получение строк постов (без комментариев) запросом SQLAlchemy Core
+    :param preview: длина сокращенного содержания поста
+    :return: словарь {идентификатор поста: строка}
+    """
+    if not post_ids:
+        return {}
+    return {row.id: row for row in post_rows(post_ids, active_only, archived, preview)}
+
+
+def fetch_posts(post_ids, active_only=True, archived=False, preview=None):
+    """
+    Получение постов с комментариями в виде словарей, пригодных для PostSchema
+    (при указании preview - для PostPreviewSchema).
+    Порядок постов соответствует порядку идентификаторов, отсутствующие посты пропускаются.
+    """
+    rows = fetch_post_rows(post_ids, active_only, archived, preview)
+    comments = fetch_comments(list(rows), archived)
+    return [dict(rows[post_id], comments=comments[post_id]) for post_id in post_ids if post_id in rows]
+
+
+class PostsDumper:
+    """Объект с интерфейсом сериализатора для Pagination.paginate, загружающий страницу постов через Core"""
+
+    def __init__(self, archived=False, preview=None):
+        self.archived = archived
+        self.preview = preview
+
+    def dump(self, rows, many=True):
+        posts = fetch_posts([row.id for row in rows], archived=self.archived, preview=self.preview)
+        schema = posts_list_schema if self.preview is None else post_previews_list_schema
+        return schema.dump(posts)
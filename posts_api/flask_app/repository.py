@@ -0,0 +1,300 @@
+"""
+Запросы горячих путей API с кэшированием построения и компиляции.
+
+Выражения SQLAlchemy Core строятся один раз на уровне модуля (параметры передаются
+через bindparam, списки идентификаторов - через раскрываемые bindparam), а их компиляция
+кэшируется в _compiled_cache. Запросы ORM построены на baked-запросах (sqlalchemy.ext.baked),
+кэширующих и построение Query, и компиляцию.
+"""
+import functools
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import Date, and_, bindparam, func, select
+from sqlalchemy.ext import baked
+from sqlalchemy.util import LRUCache
+
+from . import db
+from .models import Comment, CommentArchive, Post, PostArchive, User
+
+# Число скомпилированных выражений Core, хранимых в кэше воркера
+COMPILED_CACHE_SIZE = 500
+
+post_table = Post.__table__
+comment_table = Comment.__table__
+post_archive_table = PostArchive.__table__
+comment_archive_table = CommentArchive.__table__
+
+bakery = baked.bakery()
+_compiled_cache = LRUCache(COMPILED_CACHE_SIZE)
+
+
+def post_columns(table, preview=None):
+    """
+    Колонки поста, необходимые для PostSchema
+    :param preview: длина сокращенного содержания (число или bindparam) - content обрезается в запросе,
+    добавляется колонка content_truncated (PostPreviewSchema)
+    """
+    if preview is None:
+        return [
+            table.c.id, table.c.author_id, table.c.title, table.c.content,
+            table.c.publication_datetime, table.c.view_count,
+        ]
+    return [
+        table.c.id, table.c.author_id, table.c.title,
+        func.substr(table.c.content, 1, preview).label('content'),
+        (func.length(table.c.content) > preview).label('content_truncated'),
+        table.c.publication_datetime, table.c.view_count,
+    ]
+
+
+def comment_columns(table):
+    """Колонки комментария, необходимые для CommentSchema"""
+    return [
+        table.c.id, table.c.author_id, table.c.post_id, table.c.title,
+        table.c.content, table.c.publication_datetime,
+    ]
+
+
+def tables(archived=False):
+    """Таблицы постов и комментариев: основные или архивные"""
+    if archived:
+        return post_archive_table, comment_archive_table
+    return post_table, comment_table
+
+
+def execute(stmt, **params):
+    """Выполнение выражения Core в транзакции сессии с кэшированием его компиляции"""
+    connection = db.session.connection().execution_options(compiled_cache=_compiled_cache)
+    return connection.execute(stmt, params)
+
+
+def _active(stmt, posts, archived):
+    """Исключение помеченных как удаленные постов (в архиве такие посты отсутствуют)"""
+    return stmt if archived else stmt.where(posts.c.deleted_at.is_(None))
+
+
+@functools.lru_cache(maxsize=None)
+def _post_rows_stmt(archived, active_only, preview):
+    posts, _ = tables(archived)
+    columns = post_columns(posts, bindparam('preview') if preview else None)
+    stmt = select(columns).where(posts.c.id.in_(bindparam('ids', expanding=True)))
+    return _active(stmt, posts, archived) if active_only else stmt
+
+
+@functools.lru_cache(maxsize=None)
+def _fragment_rows_stmt(archived):
+    posts, _ = tables(archived)
+    stmt = select([posts.c.id, posts.c.rendered, posts.c.view_count]).where(
+        posts.c.id.in_(bindparam('ids', expanding=True))
+    )
+    return _active(stmt, posts, archived)
+
+
+@functools.lru_cache(maxsize=None)
+def _fragment_row_stmt(archived):
+    posts, _ = tables(archived)
+    stmt = select([posts.c.id, posts.c.rendered, posts.c.view_count]).where(posts.c.id == bindparam('post_id'))
+    return _active(stmt, posts, archived)
+
+
+@functools.lru_cache(maxsize=None)
+def _comments_stmt(archived):
+    _, comments = tables(archived)
+    return select(comment_columns(comments)).where(
+        comments.c.post_id.in_(bindparam('post_ids', expanding=True))
+    ).order_by(comments.c.id)
+
+
+@functools.lru_cache(maxsize=None)
+def _comments_by_id_stmt(archived):
+    _, comments = tables(archived)
+    return select(comment_columns(comments)).where(comments.c.id.in_(bindparam('ids', expanding=True)))
+
+
+@functools.lru_cache(maxsize=None)
+def _comment_fragments_stmt(archived):
+    _, comments = tables(archived)
+    return select([comments.c.id, comments.c.post_id, comments.c.rendered]).where(
+        comments.c.post_id.in_(bindparam('post_ids', expanding=True))
+    ).order_by(comments.c.id)
+
+
+@functools.lru_cache(maxsize=None)
+def _day_fragment_rows_stmt(archived):
+    posts, _ = tables(archived)
+    stmt = select([posts.c.id, posts.c.rendered, posts.c.view_count, posts.c.publication_datetime]).where(
+        and_(posts.c.publication_datetime >= bindparam('start'), posts.c.publication_datetime < bindparam('end'))
+    )
+    return _active(stmt, posts, archived)
+
+
+@functools.lru_cache(maxsize=None)
+def _publication_days_stmt(archived):
+    posts, _ = tables(archived)
+    stmt = select([func.date(posts.c.publication_datetime, type_=Date)]).distinct()
+    return _active(stmt, posts, archived)
+
+
+_active_post_id_stmt = select([post_table.c.id]).where(
+    post_table.c.id == bindparam('post_id')
+).where(post_table.c.deleted_at.is_(None))
+
+
+def post_rows(post_ids, active_only=True, archived=False, preview=None):
+    """Строки постов (колонки post_columns) по списку идентификаторов"""
+    stmt = _post_rows_stmt(archived, active_only, preview is not None)
+    params = {'ids': list(post_ids)}
+    if preview is not None:
+        params['preview'] = preview
+    return execute(stmt, **params)
+
+
+def fragment_rows(post_ids, archived=False):
+    """Строки (id, rendered, view_count) постов по списку идентификаторов"""
+    return execute(_fragment_rows_stmt(archived), ids=list(post_ids))
+
+
+def fragment_row(post_id, archived=False):
+    """Строка (id, rendered, view_count) поста или None"""
+    return execute(_fragment_row_stmt(archived), post_id=post_id).first()
+
+
+def comment_rows(post_ids, archived=False):
+    """Строки комментариев (колонки comment_columns) к постам в порядке идентификаторов"""
+    return execute(_comments_stmt(archived), post_ids=list(post_ids))
+
+
+def comment_rows_by_id(comment_ids, archived=False):
+    """Строки комментариев (колонки comment_columns) по списку идентификаторов"""
+    return execute(_comments_by_id_stmt(archived), ids=list(comment_ids))
+
+
+def comment_fragment_rows(post_ids, archived=False):
+    """Строки (id, post_id, rendered) комментариев к постам в порядке идентификаторов"""
+    return execute(_comment_fragments_stmt(archived), post_ids=list(post_ids)).fetchall()
+
+
+def day_fragment_rows(start, end, archived=False):
+    """Строки (id, rendered, view_count, publication_datetime) постов, опубликованных в интервале [start, end)"""
+    return execute(_day_fragment_rows_stmt(archived), start=start, end=end).fetchall()
+
+
+def publication_days():
+    """Дни, в которые опубликованы посты (в том числе архивные), по возрастанию"""
+    return sorted({row[0] for archived in (False, True) for row in execute(_publication_days_stmt(archived))})
+
+
+def active_post_exists(post_id):
+    """Существует ли пост, не помеченный как удаленный"""
+    return execute(_active_post_id_stmt, post_id=post_id).first() is not None
+
+
+_active_post = bakery(lambda session: session.query(Post))
+_active_post += lambda query: query.filter(Post.id == bindparam('post_id'), Post.deleted_at.is_(None))
+
+_post_with_owner = bakery(lambda session: session.query(
+    Post, (Post.author_id == bindparam('user_id')).label('is_owner')
+))
+_post_with_owner += lambda query: query.filter(Post.id == bindparam('post_id'), Post.deleted_at.is_(None))
+
+_comment_with_owner = bakery(lambda session: session.query(
+    Post.id, Comment, (Comment.author_id == bindparam('user_id')).label('is_owner')
+).select_from(Post))
+_comment_with_owner += lambda query: query.outerjoin(
+    Comment, and_(Comment.post_id == Post.id, Comment.id == bindparam('comment_id'))
+).filter(Post.id == bindparam('post_id'), Post.deleted_at.is_(None))
+
+_user_by_username = bakery(lambda session: session.query(User))
+_user_by_username += lambda query: query.filter(User.username == bindparam('username'))
+
+_user_by_id = bakery(lambda session: session.query(User))
+_user_by_id += lambda query: query.filter(User.id == bindparam('user_id'))
+
+
+def active_post(post_id):
+    """Пост, не помеченный как удаленный, или None"""
+    return _active_post(db.session()).params(post_id=post_id).first()
+
+
+def post_with_owner(post_id, user_id):
+    """(пост, является ли пользователь автором) или None"""
+    return _post_with_owner(db.session()).params(post_id=post_id, user_id=user_id).first()
+
+
+def comment_with_owner(post_id, comment_id, user_id):
+    """
+    (идентификатор поста, комментарий или None, является ли пользователь автором комментария)
+    или None, если пост не найден
+    """
+    return _comment_with_owner(db.session()).params(post_id=post_id, comment_id=comment_id, user_id=user_id).first()
+
+
+def user_by_username(username):
+    """Пользователь по имени или None"""
+    return _user_by_username(db.session()).params(username=username).first()
+
+
+def user_by_id(user_id):
+    """Пользователь по идентификатору или None"""
+    return _user_by_id(db.session()).params(user_id=user_id).first()
+
+
+@functools.lru_cache(maxsize=None)
+def _page_stmts(archived, from_fragments):
+    posts, _ = tables(archived)
+    columns = [posts.c.id, posts.c.rendered, posts.c.view_count] if from_fragments else [posts.c.id]
+    page = _active(select(columns), posts, archived).order_by(posts.c.publication_datetime.desc())
+    page = page.limit(bindparam('limit')).offset(bindparam('offset'))
+    count = _active(select([func.count()]).select_from(posts), posts, archived)
+    return page, count
+
+
+class PostsPage:
+    """
+    Объект с интерфейсом запроса для Pagination.paginate: страница списка постов
+    (новые первыми) на кэшированных выражениях Core.
+    Семантика параметров соответствует BaseQuery.paginate из Flask-SQLAlchemy.
+    :param archived: список архивных постов
+    :param from_fragments: строки (id, rendered, view_count) вместо (id,)
+    """
+
+    def __init__(self, archived=False, from_fragments=False):
+        self.archived = archived
+        self.from_fragments = from_fragments
+
+    def paginate(self, page=1, per_page=20, error_out=False):
+        page = max(page, 1)
+        if per_page < 0:
+            per_page = 20
+        page_stmt, count_stmt = _page_stmts(self.archived, self.from_fragments)
+        items = execute(page_stmt, limit=per_page, offset=(page - 1) * per_page).fetchall()
+        if page == 1 and len(items) < per_page:
+            total = len(items)
+        else:
+            total = execute(count_stmt).scalar()
+        return Pagination(None, page, per_page, total, items)
+
+
+def prime():
+    """
+    Построение и компиляция всех запросов модуля выполнением их с параметрами,
+    не соответствующими ни одной строке. Вызывается при прогреве воркера.
+    """
+    for archived in (False, True):
+        for active_only in (False, True):
+            post_rows([0], active_only, archived).fetchall()
+            post_rows([0], active_only, archived, preview=1).fetchall()
+        fragment_rows([0], archived).fetchall()
+        fragment_row(0, archived)
+        comment_rows([0], archived).fetchall()
+        comment_rows_by_id([0], archived).fetchall()
+        comment_fragment_rows([0], archived)
+        for from_fragments in (False, True):
+            # Вторая страница выполняет и запрос количества постов
+            PostsPage(archived, from_fragments).paginate(page=2, per_page=1)
+    active_post_exists(0)
+    active_post(0)
+    post_with_owner(0, 0)
+    comment_with_owner(0, 0, 0)
+    user_by_username('')
+    user_by_id(0)
@@ -1,34 +1,59 @@
-from marshmallow import Schema, fields, ValidationError
+from marshmallow import Schema, fields, validate, ValidationError, validates_schema
 
-from .models import User
+from .api.representations import loads
+from .availability import EMAIL, USERNAME, taken_fields
+from .tracing import span
+from .validation import compile_loader
 
 
-def unique_email(data):
-    """Проверка наличия пользователя с указанным email`ом"""
-    user = User.query.filter(User.email == data).first()
-    if user:
-        raise ValidationError('email already exists')
+class TracedSchema(Schema):
+    """Базовый сериализатор, выполняющий dump в отдельном span`е трассировки запроса"""
 
+    def dump(self, obj, *, many=None):
+        with span('schema.dump', schema=type(self).__name__):
+            return super().dump(obj, many=many)
 
-def unique_username(data):
-    """Проверка наличия пользователя с указанным именем"""
-    user = User.query.filter(User.username == data).first()
-    if user:
-        raise ValidationError('name already exists')
 
+class CompiledLoadSchema(TracedSchema):
+    """
+    Сериализатор, загружающий данные предкомпилированной проверкой (flask_app.validation),
+    если схема ее допускает, с теми же результатами и сообщениями об ошибках, что и marshmallow
+    """
 
-class UserRegistrationSchema(Schema):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compiled_loader = compile_loader(self)
+
+    def load(self, data, *, many=None, partial=None, unknown=None):
+        if self._compiled_loader is None or many is not None or partial is not None or unknown is not None:
+            return super().load(data, many=many, partial=partial, unknown=unknown)
+        return self._compiled_loader.load(data)
+
+
+class UserRegistrationSchema(TracedSchema):
     """Сериализатор для обработки данных при регистрации пользователя"""
     id = fields.Int(dump_only=True)
-    email = fields.Email(required=True, validate=[fields.Length(max=128), unique_email])
-    username = fields.String(required=True, validate=[fields.Length(min=3, max=128), unique_username])
+    email = fields.Email(required=True, validate=[fields.Length(max=128), ])
+    username = fields.String(required=True, validate=[fields.Length(min=3, max=128), ])
     password = fields.String(required=True, load_only=True, validate=[fields.Length(min=4)])
 
+    @validates_schema(skip_on_field_errors=False)
+    def validate_unique(self, data, **kwargs):
+        """Проверка уникальности email`а и имени пользователя одним запросом"""
+        taken = taken_fields(data.get('username'), data.get('email'))
+        errors = {}
+        if EMAIL in taken:
+            errors['email'] = ['email already exists']
+        if USERNAME in taken:
+            errors['username'] = ['name already exists']
+        if errors:
+            raise ValidationError(errors)
+
     class Meta:
         ordered = True
 
 
-class CommentSchema(Schema):
+class CommentSchema(CompiledLoadSchema):
     """Сериализатор для обработки данных при работе с комментариями"""
     id = fields.Int(dump_only=True)
     author_id = fields.Int(dump_only=True)
@@ -41,24 +66,71 @@ class CommentSchema(Schema):
         ordered = True
 
 
-class PostSchema(Schema):
+class PostSchema(CompiledLoadSchema):
     """Сериализатор для обработки данных при работе с постами"""
     id = fields.Int(dump_only=True)
     author_id = fields.Int(dump_only=True)
     title = fields.Str(required=True, validate=[fields.Length(min=1, max=255), ])
     content = fields.Str(required=True, validate=[fields.Length(min=1), ])
     publication_datetime = fields.DateTime('%d-%m-%Y %H:%M:%S', dump_only=True)
+    view_count = fields.Int(dump_only=True)
     comments = fields.Nested(CommentSchema, many=True, dump_only=True)
 
     class Meta:
         ordered = True
 
 
+class PostPreviewSchema(PostSchema):
+    """Сериализатор для вывода постов с сокращенным содержанием"""
+    content_truncated = fields.Bool(dump_only=True)
+
+
+class ChangeSchema(TracedSchema):
+    """Сериализатор для вывода записей журнала изменений"""
+    sequence = fields.Int(attribute='id')
+    entity = fields.Str()
+    entity_id = fields.Int()
+    post_id = fields.Int()
+    operation = fields.Str()
+    data = fields.Method('get_data')
+    created_at = fields.DateTime('%d-%m-%Y %H:%M:%S')
+
+    class Meta:
+        ordered = True
+
+    @staticmethod
+    def get_data(obj):
+        """Данные сохранены в журнале в виде JSON, для удалений - отсутствуют"""
+        return loads(obj.data) if obj.data is not None else None
+
+
+class BatchOperationSchema(Schema):
+    """Сериализатор для обработки операции пакета"""
+    method = fields.Str(required=True, validate=[validate.OneOf(('GET', 'POST', 'PUT', 'PATCH', 'DELETE')), ])
+    path = fields.Str(required=True, validate=[validate.Regexp('^/'), ])
+    body = fields.Raw(missing=None, allow_none=True)
+
+
+class BatchSchema(Schema):
+    """Сериализатор для обработки данных пакета операций"""
+    operations = fields.List(fields.Nested(BatchOperationSchema), required=True,
+                             validate=[fields.Length(min=1), ])
+    atomic = fields.Bool(missing=False)
+
+
 user_reg_schema = UserRegistrationSchema()
 
 posts_list_schema = PostSchema(many=True)
 post_create_schema = PostSchema()
 post_patch_schema = PostSchema(partial=('title', 'content'))
+post_previews_list_schema = PostPreviewSchema(many=True)
 
 comment_create_schema = CommentSchema()
 comment_patch_schema = CommentSchema(partial=('title', 'content'))
+comments_list_schema = CommentSchema(many=True)
+
+# Счетчик просмотров изменяется без обновления фрагмента и добавляется при сборке поста
+post_fragment_schema = PostSchema(exclude=('view_count', 'comments'))
+changes_list_schema = ChangeSchema(many=True)
+
+batch_schema = BatchSchema()
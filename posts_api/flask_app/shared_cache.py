@@ -0,0 +1,293 @@
+"""
+Общий для воркеров хоста кэш в отображаемом в память файле (mmap).
+
+Файл разбит на наборы (set) из ways слотов фиксированного размера. Ключ хешируется
+в один набор, поиск и замена выполняются только внутри него под блокировкой набора:
+блокировкой потока в процессе и fcntl-блокировкой байта файла между процессами.
+При заполнении набора вытесняется запись по алгоритму часов (clock): запись,
+прочитанная после последнего обхода, получает второй шанс.
+
+Инвалидация версионная:
+- удаление ключа увеличивает версию его набора, поэтому значение, загруженное
+  до удаления (set с токеном, полученным до загрузки), не будет сохранено;
+- у пространства имен есть поколение, его увеличение сразу делает недействительными
+  все записи пространства.
+
+Аренда (lease) ключа - запись с ограниченным временем жизни в отдельном пространстве имен,
+которую может получить только один процесс: он загружает значение, остальные ждут его в кэше.
+"""
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from flask import current_app
+
+MAGIC = b'POSTSSC1'
+# Счетчики поколений пространств имен (пространства с совпадающим хешем инвалидируются вместе)
+NAMESPACE_COUNT = 64
+HEADER_SIZE = 1024
+
+_HEADER = struct.Struct('<8sIII')
+_GENERATION = struct.Struct('<Q')
+_SET = struct.Struct('<QI4x')
+# Слот: хеш ключа, срок действия, поколение пространства, занят, бит обращения,
+# значение None, длина ключа, длина значения
+_SLOT = struct.Struct('<QdQBBBxHI')
+_USED = 24
+_REFERENCED = 25
+
+# Пространства имен приложения
+POSTS = 'posts'
+PAGES = 'pages'
+AUTH = 'auth'
+# Аренды загрузки значений
+LEASES = 'leases'
+# Регистрации пользователей: поколение пространства - метка для фильтров занятых имен воркеров
+USERS = 'users'
+
+MISS = object()
+
+
+class SharedCache:
+    """
+    Кэш байтовых значений (и None) с ограниченным временем жизни в общем файле.
+    Значения, не помещающиеся в слот вместе с ключом, не кэшируются.
+    :param path: путь к файлу кэша, файл создается или пересоздается при изменении параметров
+    :param slots: общее число слотов
+    :param slot_size: размер слота в байтах
+    :param ways: число слотов в наборе
+    """
+
+    def __init__(self, path, slots=8192, slot_size=4096, ways=8):
+        self.path = path
+        self.ways = max(min(ways, slots), 1)
+        self.sets = max(slots // self.ways, 1)
+        self.slot_size = slot_size
+        self.capacity = slot_size - _SLOT.size
+        self._slots_offset = HEADER_SIZE + self.sets * _SET.size
+        size = self._slots_offset + self.sets * self.ways * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = [threading.Lock() for _ in range(self.sets)]
+        self._header_lock = threading.Lock()
+        header = _HEADER.pack(MAGIC, self.sets, self.ways, slot_size)
+        with self._locked(None):
+            if os.fstat(self._fd).st_size != size or os.pread(self._fd, _HEADER.size, 0) != header:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextlib.contextmanager
+    def _locked(self, index):
+        """Блокировка набора index (None - заголовка файла) для потоков и процессов"""
+        thread_lock = self._header_lock if index is None else self._thread_locks[index]
+        offset = 0 if index is None else index + 1
+        with thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def _locate(self, namespace, key):
+        key_bytes = f'{namespace}:{key}'.encode('utf-8')
+        key_hash = int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+        return key_bytes, key_hash, key_hash % self.sets
+
+    @staticmethod
+    def _generation_offset(namespace):
+        return _HEADER.size + zlib.crc32(namespace.encode('utf-8')) % NAMESPACE_COUNT * _GENERATION.size
+
+    def _generation(self, namespace):
+        return _GENERATION.unpack_from(self._map, self._generation_offset(namespace))[0]
+
+    def _set_offset(self, index):
+        return HEADER_SIZE + index * _SET.size
+
+    def _slot_offset(self, index, way):
+        return self._slots_offset + (index * self.ways + way) * self.slot_size
+
+    def _find(self, index, key_bytes, key_hash):
+        """Смещение слота с ключом в наборе или None"""
+        for way in range(self.ways):
+            offset = self._slot_offset(index, way)
+            slot_hash, _, _, used, _, _, key_len, _ = _SLOT.unpack_from(self._map, offset)
+            if used and slot_hash == key_hash:
+                start = offset + _SLOT.size
+                if self._map[start:start + key_len] == key_bytes:
+                    return offset
+        return None
+
+    def _victim(self, index, now):
+        """Слот для новой записи: свободный, устаревший или выбранный стрелкой часов"""
+        for way in range(self.ways):
+            offset = self._slot_offset(index, way)
+            _, expires, _, used, _, _, _, _ = _SLOT.unpack_from(self._map, offset)
+            if not used or expires <= now:
+                return offset
+        set_offset = self._set_offset(index)
+        version, hand = _SET.unpack_from(self._map, set_offset)
+        while True:
+            offset = self._slot_offset(index, hand)
+            hand = (hand + 1) % self.ways
+            if self._map[offset + _REFERENCED]:
+                self._map[offset + _REFERENCED] = 0
+            else:
+                _SET.pack_into(self._map, set_offset, version, hand)
+                return offset
+
+    def get(self, namespace, key):
+        """
+        Получение значения
+        :return: байты, None (сохраненное отсутствие значения) или MISS
+        """
+        key_bytes, key_hash, index = self._locate(namespace, key)
+        now = time.time()
+        with self._locked(index):
+            offset = self._find(index, key_bytes, key_hash)
+            if offset is None:
+                return MISS
+            _, expires, generation, _, _, is_none, key_len, value_len = _SLOT.unpack_from(self._map, offset)
+            if expires <= now or generation != self._generation(namespace):
+                self._map[offset + _USED] = 0
+                return MISS
+            self._map[offset + _REFERENCED] = 1
+            if is_none:
+                return None
+            start = offset + _SLOT.size + key_len
+            return self._map[start:start + value_len]
+
+    def token(self, namespace, key):
+        """Версия ключа, получаемая до загрузки значения и передаваемая в set"""
+        _, _, index = self._locate(namespace, key)
+        with self._locked(index):
+            return _SET.unpack_from(self._map, self._set_offset(index))[0], self._generation(namespace)
+
+    def set(self, namespace, key, value, ttl, token=None):
+        """
+        Сохранение значения (байты или None)
+        :param token: результат token(), полученный до загрузки значения: если ключ или
+        пространство имен с тех пор инвалидированы, значение не сохраняется
+        :return: сохранено ли значение
+        """
+        key_bytes, key_hash, index = self._locate(namespace, key)
+        value_bytes = b'' if value is None else value
+        if len(key_bytes) + len(value_bytes) > self.capacity:
+            return False
+        now = time.time()
+        with self._locked(index):
+            generation = self._generation(namespace)
+            if token is not None and token != (_SET.unpack_from(self._map, self._set_offset(index))[0], generation):
+                return False
+            offset = self._find(index, key_bytes, key_hash)
+            if offset is None:
+                offset = self._victim(index, now)
+            # Бит обращения новой записи сброшен: второй шанс получают только прочитанные записи
+            _SLOT.pack_into(self._map, offset, key_hash, now + ttl, generation, 1, 0, value is None,
+                            len(key_bytes), len(value_bytes))
+            start = offset + _SLOT.size
+            self._map[start:start + len(key_bytes)] = key_bytes
+            self._map[start + len(key_bytes):start + len(key_bytes) + len(value_bytes)] = value_bytes
+        return True
+
+    def delete(self, namespace, key):
+        """Удаление ключа с увеличением версии его набора"""
+        key_bytes, key_hash, index = self._locate(namespace, key)
+        with self._locked(index):
+            set_offset = self._set_offset(index)
+            version, hand = _SET.unpack_from(self._map, set_offset)
+            _SET.pack_into(self._map, set_offset, version + 1, hand)
+            offset = self._find(index, key_bytes, key_hash)
+            if offset is not None:
+                self._map[offset + _USED] = 0
+
+    def lease(self, namespace, key, ttl):
+        """
+        Получение аренды загрузки значения ключа на ttl секунд
+        :return: получена ли аренда (False - ее держит другой процесс или поток)
+        """
+        key_bytes, key_hash, index = self._locate(LEASES, f'{namespace}:{key}')
+        now = time.time()
+        with self._locked(index):
+            offset = self._find(index, key_bytes, key_hash)
+            if offset is None:
+                offset = self._victim(index, now)
+            elif _SLOT.unpack_from(self._map, offset)[1] > now:
+                return False
+            # Бит обращения установлен, чтобы аренда не вытеснялась первой
+            _SLOT.pack_into(self._map, offset, key_hash, now + ttl, self._generation(LEASES), 1, 1, 1,
+                            len(key_bytes), 0)
+            start = offset + _SLOT.size
+            self._map[start:start + len(key_bytes)] = key_bytes
+        return True
+
+    def leased(self, namespace, key):
+        """Удерживается ли аренда ключа"""
+        key_bytes, key_hash, index = self._locate(LEASES, f'{namespace}:{key}')
+        with self._locked(index):
+            offset = self._find(index, key_bytes, key_hash)
+            return offset is not None and _SLOT.unpack_from(self._map, offset)[1] > time.time()
+
+    def release(self, namespace, key):
+        """Освобождение аренды ключа (версия набора не изменяется)"""
+        key_bytes, key_hash, index = self._locate(LEASES, f'{namespace}:{key}')
+        with self._locked(index):
+            offset = self._find(index, key_bytes, key_hash)
+            if offset is not None:
+                self._map[offset + _USED] = 0
+
+    def generation(self, namespace):
+        """Поколение пространства имен, увеличивающееся при каждой его инвалидации"""
+        with self._locked(None):
+            return self._generation(namespace)
+
+    def invalidate_namespace(self, namespace):
+        """Инвалидация всех записей пространства имен"""
+        offset = self._generation_offset(namespace)
+        with self._locked(None):
+            _GENERATION.pack_into(self._map, offset, self._generation(namespace) + 1)
+
+    def clear(self):
+        """Удаление всех записей"""
+        for index in range(self.sets):
+            with self._locked(index):
+                set_offset = self._set_offset(index)
+                version, hand = _SET.unpack_from(self._map, set_offset)
+                _SET.pack_into(self._map, set_offset, version + 1, hand)
+                for way in range(self.ways):
+                    self._map[self._slot_offset(index, way) + _USED] = 0
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def current_cache():
+    """
+    Общий кэш, заданный настройками приложения (SHARED_CACHE_*), или None, если он отключен.
+    Кэш открывается один раз на процесс, при загрузке приложения в мастере (preload_app)
+    отображение файла наследуется воркерами.
+    """
+    config = current_app.config
+    path = config['SHARED_CACHE_PATH']
+    if not path:
+        return None
+    key = (path, config['SHARED_CACHE_SLOTS'], config['SHARED_CACHE_SLOT_SIZE'], config['SHARED_CACHE_WAYS'])
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = _caches[key] = SharedCache(*key)
+    return cache
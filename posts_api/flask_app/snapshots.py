@@ -0,0 +1,244 @@
+"""
+Ежедневные снимки постов (GET /posts?date=YYYY-MM-DD).
+
+Посты завершенного дня почти не изменяются, поэтому для каждого такого дня формируется
+файл с JSON постов дня и их комментариев (и его сжатая gzip версия), который отдается
+без обращения к БД и сериализации (send_file, при USE_X_SENDFILE - веб-сервером).
+
+Снимки формирует команда manage.py write_snapshots. Для каждого снимка в индексе
+сохраняется диапазон идентификаторов постов дня: после фиксации транзакции, записавшей
+в журнал изменения поста или комментария, удаляются снимки, диапазон которых содержит
+пост (без запроса к БД), следующий запуск команды формирует их заново. Клиенты кэшируют
+снимки недолго (SNAPSHOTS_CACHE_MAX_AGE) и затем проверяют их актуальность по ETag.
+"""
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+from flask import current_app, has_app_context, send_file
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .api.representations import JSON_MIMETYPE
+from .changes import last_change_id, posts_changed_since
+from .fragments import assemble_posts
+from .models import Change, publication_now
+from .repository import day_fragment_rows, publication_days
+
+INDEX_NAME = 'index.json'
+# Ключ Session.info: посты, изменения которых записаны в журнал в текущей транзакции
+CHANGED_POSTS = 'snapshots_changed_posts'
+
+
+def now():
+    """Текущее время в часовом поясе публикации постов"""
+    return publication_now()
+
+
+def day_bounds(day):
+    """Интервал [начало дня, начало следующего дня)"""
+    start = datetime.datetime.combine(day, datetime.time())
+    return start, start + datetime.timedelta(days=1)
+
+
+def sealed(day):
+    """Закончился ли день не менее SNAPSHOTS_DELAY_HOURS часов назад (снимок дня можно сформировать)"""
+    _, end = day_bounds(day)
+    return end + datetime.timedelta(hours=current_app.config['SNAPSHOTS_DELAY_HOURS']) <= now()
+
+
+def day_posts(day):
+    """
+    Посты (в том числе архивные), опубликованные в указанный день, в порядке публикации
+    :return: (идентификаторы постов, JSON {"date", "data"})
+    """
+    start, end = day_bounds(day)
+    posts = []
+    for archived in (False, True):
+        rows = day_fragment_rows(start, end, archived)
+        posts.extend(zip(((row.publication_datetime, row.id) for row in rows), assemble_posts(rows, archived)))
+    posts.sort(key=lambda post: post[0])
+    body = '{"date":"' + day.isoformat() + '","data":[' + ','.join(post for _, post in posts) + ']}'
+    return [post_id for (_, post_id), _ in posts], body.encode('utf-8')
+
+
+class SnapshotStore:
+    """
+    Каталог снимков: posts-<день>.json, posts-<день>.json.gz и индекс диапазонов
+    идентификаторов постов дней. Снимки формирует один процесс (manage.py write_snapshots),
+    воркеры их только отдают и удаляют.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self._ranges = {}
+        self._ranges_stamp = None
+        self._lock = threading.Lock()
+
+    def path(self, day):
+        return os.path.join(self.directory, f'posts-{day.isoformat()}.json')
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_NAME)
+
+    def _replace(self, path, data):
+        """Атомарная запись файла: читатели видят либо старое, либо новое содержимое"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def ranges(self):
+        """
+        Диапазоны идентификаторов постов дней {день (ISO): [первый, последний]}.
+        Индекс перечитывается только после его изменения.
+        """
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return {}
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp != self._ranges_stamp:
+                with open(self._index_path, 'rb') as file:
+                    self._ranges = json.load(file)
+                self._ranges_stamp = stamp
+            return self._ranges
+
+    def _update_index(self, day, post_ids):
+        ranges = dict(self.ranges())
+        if post_ids:
+            ranges[day.isoformat()] = [min(post_ids), max(post_ids)]
+        else:
+            ranges.pop(day.isoformat(), None)
+        self._replace(self._index_path, json.dumps(ranges, sort_keys=True).encode('utf-8'))
+
+    def exists(self, day):
+        return os.path.exists(self.path(day))
+
+    def write(self, day):
+        """
+        Формирование снимка дня.
+        Индекс обновляется до записи снимка, чтобы изменения, зафиксированные после записи,
+        удаляли снимок. Если посты дня изменились во время формирования снимка, снимок удаляется.
+        :return: число постов в снимке или None, если снимок удален
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        since = last_change_id()
+        post_ids, body = day_posts(day)
+        self._update_index(day, post_ids)
+        path = self.path(day)
+        self._replace(path + '.gz', gzip.compress(body))
+        self._replace(path, body)
+        if post_ids and posts_changed_since(since, min(post_ids), max(post_ids)):
+            self.remove(day)
+            return None
+        return len(post_ids)
+
+    def write_missing(self):
+        """
+        Формирование снимков завершенных дней с постами, для которых снимков нет
+        (новые дни и дни с удаленными после изменений снимками). Для дней без постов
+        снимки не формируются: такие дни отдаются без снимка.
+        :return: {день: число постов или None}
+        """
+        written = {}
+        for day in publication_days():
+            if sealed(day) and not self.exists(day):
+                written[day] = self.write(day)
+        return written
+
+    def remove(self, day):
+        path = self.path(day)
+        for name in (path, path + '.gz'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, post_id):
+        """Удаление снимков дней, диапазон идентификаторов которых содержит пост"""
+        for day, (first, last) in self.ranges().items():
+            if first <= post_id <= last:
+                self.remove(datetime.date.fromisoformat(day))
+
+    def send(self, day, accept_gzip=False):
+        """
+        Ответ со снимком дня (сжатым, если клиент его принимает). Снимок может быть сформирован заново
+        после изменения постов дня, поэтому клиенты кэшируют его на SNAPSHOTS_CACHE_MAX_AGE секунд,
+        а затем проверяют по ETag (If-None-Match, ответ 304)
+        :return: ответ или None, если снимка нет
+        """
+        path = self.path(day)
+        # Несжатый файл удаляется первым и записывается последним, его наличие означает актуальность снимка
+        if not os.path.exists(path):
+            return None
+        encoded = accept_gzip and os.path.exists(path + '.gz')
+        try:
+            response = send_file(
+                path + '.gz' if encoded else path, mimetype=JSON_MIMETYPE, conditional=True,
+                cache_timeout=current_app.config['SNAPSHOTS_CACHE_MAX_AGE']
+            )
+        except FileNotFoundError:
+            return None
+        response.cache_control.must_revalidate = True
+        if encoded:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def snapshot_store():
+    """Каталог снимков, заданный настройкой SNAPSHOTS_DIR, или None, если снимки отключены"""
+    directory = current_app.config['SNAPSHOTS_DIR']
+    if not directory:
+        return None
+    store = _stores.get(directory)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(directory, SnapshotStore(directory))
+    return store
+
+
+def invalidate(post_id):
+    """Удаление снимков, содержащих пост"""
+    store = snapshot_store()
+    if store is not None:
+        store.invalidate(post_id)
+
+
+@event.listens_for(Change, 'after_insert')
+def _collect_changed_post(mapper, connection, target):
+    """Запоминание поста, изменение которого записано в журнал (changes.record_change)"""
+    object_session(target).info.setdefault(CHANGED_POSTS, set()).add(target.post_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_posts(session):
+    """
+    Удаление снимков постов, изменения которых зафиксированы транзакцией.
+    Изменения записываются в журнал всеми обработчиками изменений (в том числе в пакетах операций),
+    поэтому снимки удаляются в любом воркере и процессе, зафиксировавшем изменение
+    """
+    post_ids = session.info.pop(CHANGED_POSTS, None)
+    if post_ids and has_app_context():
+        for post_id in post_ids:
+            invalidate(post_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_posts(session):
+    session.info.pop(CHANGED_POSTS, None)
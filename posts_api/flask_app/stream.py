@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from . import db
+from .api.representations import dumps
+from .changes import changes_horizon, changes_since
+from .models import Change
+from .serializers import ChangeSchema
+
+change_schema = ChangeSchema()
+
+HEARTBEAT = ': heartbeat\n\n'
+
+
+def format_event(change):
+    """Представление записи журнала изменений в виде события SSE"""
+    data = dumps(change_schema.dump(change)).decode('utf-8')
+    return f'id: {change.id}\nevent: {change.entity}.{change.operation}\ndata: {data}\n\n'
+
+
+class Subscription:
+    """Подписка на события с ограниченным буфером"""
+
+    def __init__(self, buffer_size):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def put(self, event):
+        """
+        Добавление события в буфер
+        :return: False, если буфер переполнен и подписку нужно закрыть
+        """
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+            return False
+        return True
+
+
+class ChangeBroker:
+    """
+    Рассылка событий журнала изменений подписчикам воркера.
+    Журнал опрашивает один поток на воркер с общим для всех подписчиков курсором,
+    поэтому подписчики получают изменения, сделанные любым воркером.
+    Поток запускается при появлении первого подписчика и останавливается,
+    когда подписчиков не остается.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cursor = None
+        self._floor = None
+        self._seen = set()
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """Создание подписки, должно вызываться в контексте приложения"""
+        app = current_app._get_current_object()
+        subscription = Subscription(app.config['STREAM_BUFFER_SIZE'])
+        with self._lock:
+            if self._cursor is None:
+                self._cursor = self._floor = db.session.query(db.func.max(Change.id)).scalar() or 0
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, args=(app,), daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _poll_loop(self, app):
+        """Цикл опроса журнала изменений"""
+        interval = app.config['STREAM_POLL_INTERVAL']
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Без подписчиков курсор не нужен, новый будет получен при подписке
+                    self._thread = None
+                    self._cursor = self._floor = None
+                    self._seen = set()
+                    return
+            try:
+                with app.app_context():
+                    try:
+                        events = self._fetch(app.config['STREAM_GAP_WINDOW'], app.config['STREAM_POLL_BATCH'])
+                    finally:
+                        db.session.remove()
+            except Exception:
+                app.logger.exception('change stream polling failed')
+                events = []
+            if events:
+                self.publish(events)
+            time.sleep(interval)
+
+    def _fetch(self, gap_window, batch):
+        """
+        Получение новых записей журнала.
+        Записи с меньшим номером могут зафиксироваться позже записей с большим,
+        поэтому повторно просматривается окно из gap_window последних номеров.
+        """
+        low = max(self._cursor - gap_window, self._floor)
+        changes = [change for change in changes_since(low, batch)[0] if change.id not in self._seen]
+        if not changes:
+            return []
+        self._seen.update(change.id for change in changes)
+        self._cursor = max(self._cursor, changes[-1].id)
+        self._seen = {seq for seq in self._seen if seq > self._cursor - gap_window}
+        return [(change.id, format_event(change)) for change in changes]
+
+    def publish(self, events):
+        """Рассылка событий подписчикам, переполненные подписки отключаются"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            for event in events:
+                if not subscription.put(event):
+                    self.unsubscribe(subscription)
+                    break
+
+    def stream(self, last_event_id=None):
+        """
+        Генератор событий SSE для одного клиента
+        :param last_event_id: номер последнего полученного клиентом события,
+        события после него повторно отправляются из журнала (не более STREAM_REPLAY_LIMIT за соединение:
+        если пропущенных событий больше, соединение закрывается после последнего отправленного события,
+        и клиент продолжает с него при переподключении)
+        """
+        config = current_app.config
+        subscription = self.subscribe()
+        try:
+            yield f'retry: {config["STREAM_RETRY"]}\n\n'
+            replayed = set()
+            if last_event_id is not None:
+                if last_event_id < changes_horizon():
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                since, remaining, has_more = last_event_id, config['STREAM_REPLAY_LIMIT'], True
+                while has_more and remaining > 0:
+                    changes, has_more = changes_since(since, min(config['STREAM_POLL_BATCH'], remaining))
+                    for change in changes:
+                        replayed.add(change.id)
+                        yield format_event(change)
+                    remaining -= len(changes)
+                    if changes:
+                        since = changes[-1].id
+                if has_more:
+                    # Переход к трансляции пропустил бы события между отправленными и курсором опроса
+                    return
+            # Соединение с БД не удерживается на время трансляции
+            db.session.remove()
+
+            deadline = time.monotonic() + config['STREAM_MAX_DURATION']
+            while time.monotonic() < deadline:
+                try:
+                    seq, event = subscription.queue.get(timeout=config['STREAM_HEARTBEAT_INTERVAL'])
+                except queue.Empty:
+                    if subscription.overflowed:
+                        # Клиент переподключится и получит пропущенное по Last-Event-ID
+                        return
+                    yield HEARTBEAT
+                    continue
+                if seq not in replayed:
+                    yield event
+        finally:
+            self.unsubscribe(subscription)
+
+
+broker = ChangeBroker()
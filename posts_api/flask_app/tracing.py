@@ -0,0 +1,324 @@
+import contextlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+JSONL_EXPORTER_PREFIX = 'jsonl://'
+OTLP_EXPORTER_PREFIXES = ('http://', 'https://')
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+SAMPLED_FLAG = 0x01
+
+# Виды span`ов в терминах OpenTelemetry
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def parse_traceparent(header):
+    """
+    Разбор заголовка W3C traceparent
+    :return: (trace_id, parent_id, sampled) или None, если заголовок отсутствует или некорректен
+    """
+    match = TRACEPARENT_RE.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+def format_traceparent(trace_id, span_id, sampled=True):
+    """Формирование заголовка W3C traceparent"""
+    return f'00-{trace_id}-{span_id}-{SAMPLED_FLAG if sampled else 0:02x}'
+
+
+def _random_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Span:
+    """Участок выполнения запроса"""
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attributes', 'start', 'end', 'error')
+
+    def __init__(self, trace_id, parent_id, name, kind, attributes):
+        self.trace_id = trace_id
+        self.span_id = _random_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': (self.end - self.start) / 1e6,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    """Span`ы одного запроса"""
+
+    def __init__(self, trace_id=None, parent_id=None):
+        self.trace_id = trace_id or _random_id(128)
+        self.parent_id = parent_id
+        self.finished = []
+        self._stack = []
+
+    def start(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        """Начало span`а, вложенного в текущий"""
+        parent_id = self._stack[-1].span_id if self._stack else self.parent_id
+        span = Span(self.trace_id, parent_id, name, kind, attributes)
+        self._stack.append(span)
+        return span
+
+    def finish(self, span, error=None):
+        """Завершение span`а"""
+        span.end = time.time_ns()
+        span.error = error
+        self._stack.remove(span)
+        self.finished.append(span)
+
+    @contextlib.contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        span = self.start(name, kind, **attributes)
+        try:
+            yield span
+        except Exception as exc:
+            self.finish(span, repr(exc))
+            raise
+        self.finish(span)
+
+
+def current_trace():
+    """Трассировка текущего запроса или None, если запрос не выбран для трассировки"""
+    return g.get('trace') if has_request_context() else None
+
+
+def span(name, **attributes):
+    """
+    Контекстный менеджер span`а в трассировке текущего запроса.
+    Вне трассируемого запроса ничего не делает.
+    """
+    trace = current_trace()
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name, **attributes)
+
+
+class JSONLinesExporter:
+    """Запись span`ов в локальный файл, по одному JSON-объекту в строке"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict(), ensure_ascii=False) + '\n' for span in spans)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OTLPExporter:
+    """
+    Отправка span`ов в коллектор OpenTelemetry по протоколу OTLP/HTTP (JSON),
+    например http://localhost:4318/v1/traces.
+    Span`ы отправляются фоновым потоком, при переполнении очереди новые span`ы отбрасываются.
+    """
+    QUEUE_SIZE = 1000
+    TIMEOUT = 2
+
+    def __init__(self, endpoint, service_name='posts_api'):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        # Поток создается в каждом воркере после fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.QUEUE_SIZE)
+                    threading.Thread(target=self._send_loop, args=(self._queue,), daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            pass
+
+    def encode(self, spans):
+        """Тело запроса ExportTraceServiceRequest в JSON-кодировке OTLP"""
+        return json.dumps({
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+                'scopeSpans': [{
+                    'scope': {'name': __name__},
+                    'spans': [{
+                        'traceId': span.trace_id,
+                        'spanId': span.span_id,
+                        'parentSpanId': span.parent_id or '',
+                        'name': span.name,
+                        'kind': span.kind,
+                        'startTimeUnixNano': str(span.start),
+                        'endTimeUnixNano': str(span.end),
+                        'attributes': [{'key': key, 'value': _otlp_value(value)}
+                                       for key, value in span.attributes.items()],
+                        'status': {'code': 2, 'message': span.error} if span.error else {},
+                    } for span in spans]
+                }]
+            }]
+        }).encode('utf-8')
+
+    def _send_loop(self, spans_queue):
+        while True:
+            spans = spans_queue.get()
+            req = urllib.request.Request(self.endpoint, data=self.encode(spans),
+                                         headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(req, timeout=self.TIMEOUT).close()
+            except OSError:
+                # Недоступность коллектора не должна влиять на работу приложения
+                pass
+
+
+def exporter_from_uri(uri):
+    """
+    Создание экспортера по URI из настроек:
+    'jsonl://<путь к файлу>' - локальный файл JSON Lines,
+    'http(s)://<адрес коллектора>/v1/traces' - коллектор OTLP/HTTP
+    """
+    if uri.startswith(JSONL_EXPORTER_PREFIX):
+        return JSONLinesExporter(uri[len(JSONL_EXPORTER_PREFIX):])
+    if uri.startswith(OTLP_EXPORTER_PREFIXES):
+        return OTLPExporter(uri)
+    raise ValueError(f'unsupported tracing exporter: {uri}')
+
+
+class Tracer:
+    """
+    Трассировка запросов: корневой span запроса, span`ы этапов обработки (функция span)
+    и каждого SQL-запроса. Контекст трассировки принимается из заголовка W3C traceparent,
+    решение о выборке родителя соблюдается, остальные запросы выбираются с вероятностью TRACING_SAMPLE_RATE.
+    """
+
+    def __init__(self, app=None):
+        self._exporter = None
+        self._exporter_uri = None
+        self._exporter_lock = threading.Lock()
+        self._sql_listeners = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if not self._sql_listeners:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._sql_listeners = True
+
+    @property
+    def exporter(self):
+        uri = current_app.config['TRACING_EXPORTER']
+        if self._exporter is None or self._exporter_uri != uri:
+            with self._exporter_lock:
+                if self._exporter is None or self._exporter_uri != uri:
+                    self._exporter = exporter_from_uri(uri)
+                    self._exporter_uri = uri
+        return self._exporter
+
+    @staticmethod
+    def _sampled(parent):
+        if parent is not None:
+            return parent[2]
+        return random.random() < current_app.config['TRACING_SAMPLE_RATE']
+
+    def _before_request(self):
+        if not current_app.config['TRACING_EXPORTER']:
+            return None
+        parent = parse_traceparent(request.headers.get('traceparent'))
+        if not self._sampled(parent):
+            return None
+        trace = Trace(*parent[:2]) if parent else Trace()
+        g.trace = trace
+        g.trace_root = trace.start(
+            f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+            SPAN_KIND_SERVER, **{'http.method': request.method, 'http.target': request.full_path.rstrip('?')}
+        )
+        return None
+
+    @staticmethod
+    def _after_request(response):
+        root = g.get('trace_root')
+        if root is not None:
+            root.attributes['http.status_code'] = response.status_code
+            response.headers['traceresponse'] = format_traceparent(root.trace_id, root.span_id)
+        return response
+
+    def _teardown_request(self, exc):
+        trace = g.pop('trace', None)
+        root = g.pop('trace_root', None)
+        if trace is None:
+            return
+        trace.finish(root, repr(exc) if exc is not None else None)
+        self.exporter.export(trace.finished)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace()
+        if trace is not None and context is not None:
+            context._trace_span = trace.start('sql', SPAN_KIND_CLIENT, **{'db.statement': statement})
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        sql_span = getattr(context, '_trace_span', None)
+        trace = current_trace()
+        if sql_span is not None and trace is not None:
+            context._trace_span = None
+            trace.finish(sql_span)
+
+    @staticmethod
+    def _handle_error(exception_context):
+        context = exception_context.execution_context
+        sql_span = getattr(context, '_trace_span', None)
+        trace = current_trace()
+        if sql_span is not None and trace is not None:
+            context._trace_span = None
+            trace.finish(sql_span, repr(exception_context.original_exception))
@@ -0,0 +1,140 @@
+"""
+Предкомпилированная загрузка данных для простых схем marshmallow.
+
+При создании схемы ее поля разбираются один раз в кортежи параметров проверки,
+и Schema.load заменяется одним циклом без вызовов методов полей и валидаторов.
+Сообщения об ошибках, их структура и порядок совпадают с marshmallow.
+Схемы с полями других типов, хуками, проверками уровня схемы и нестандартными
+сообщениями валидаторов не компилируются и загружаются marshmallow.
+"""
+from collections.abc import Mapping
+
+from marshmallow import RAISE, Schema, ValidationError, fields, validate
+from marshmallow.decorators import POST_LOAD, PRE_LOAD, VALIDATES, VALIDATES_SCHEMA
+from marshmallow.utils import is_collection, missing
+
+_INFINITY = float('inf')
+
+
+def _compile_length(validator):
+    """
+    Параметры проверки Length: (минимум, максимум, сообщение о короткой строке, сообщение о длинной строке)
+    """
+    if validator.equal is not None:
+        message = validator._format_error(None, validator.message_equal)
+        return validator.equal, validator.equal, message, message
+    too_short = validator.message_min if validator.max is None else validator.message_all
+    too_long = validator.message_max if validator.min is None else validator.message_all
+    return (
+        validator.min if validator.min is not None else 0,
+        validator.max if validator.max is not None else _INFINITY,
+        validator._format_error(None, too_short) if validator.min is not None else None,
+        validator._format_error(None, too_long) if validator.max is not None else None,
+    )
+
+
+def _compile_field(name, field, partial):
+    """
+    Параметры загрузки строкового поля или None, если поле не поддерживается:
+    (ключ во входных данных, ключ результата, можно ли пропустить, сообщение об отсутствии
+    обязательного поля, допускается ли None, сообщения об ошибках типа, проверки длины)
+    """
+    if type(field) is not fields.String or field.missing is not missing:
+        return None
+    if field.attribute is not None and '.' in field.attribute:
+        return None
+    lengths = []
+    for validator in field.validators:
+        # Сообщения с подстановкой {input} зависят от значения и не вычисляются заранее
+        if type(validator) is not validate.Length or validator.error is not None:
+            return None
+        lengths.append(_compile_length(validator))
+    messages = field.error_messages
+    return (
+        field.data_key if field.data_key is not None else name,
+        field.attribute or name,
+        partial is True or (is_collection(partial) and name in partial),
+        messages['required'] if field.required else None,
+        field.allow_none is True,
+        messages['null'],
+        messages['invalid'],
+        messages['invalid_utf8'],
+        tuple(lengths),
+    )
+
+
+class CompiledLoader:
+    """Загрузка данных схемы по заранее разобранным параметрам полей"""
+
+    def __init__(self, schema, compiled_fields):
+        self.dict_class = schema.dict_class
+        self.fields = compiled_fields
+        self.keys = frozenset(compiled[0] for compiled in compiled_fields)
+        self.type_message = schema.error_messages['type']
+        self.unknown_message = schema.error_messages['unknown']
+
+    def load(self, data):
+        """
+        Проверка и загрузка данных, аналог Schema.load
+        :raise ValidationError: с теми же сообщениями, что и marshmallow
+        """
+        result = self.dict_class()
+        if not isinstance(data, Mapping):
+            raise ValidationError({'_schema': [self.type_message]}, data=data, valid_data=result)
+        errors = {}
+        for key, attribute, skip_missing, required, allow_none, null, invalid, invalid_utf8, lengths in self.fields:
+            value = data.get(key, missing)
+            if value is missing:
+                if required is not None and not skip_missing:
+                    errors[key] = [required]
+                continue
+            if value is None:
+                if allow_none:
+                    result[attribute] = None
+                else:
+                    errors[key] = [null]
+                continue
+            if not isinstance(value, str):
+                if not isinstance(value, bytes):
+                    errors[key] = [invalid]
+                    continue
+                try:
+                    value = value.decode('utf-8')
+                except UnicodeDecodeError:
+                    errors[key] = [invalid_utf8]
+                    continue
+            if lengths:
+                length = len(value)
+                field_errors = [
+                    too_short if length < minimum else too_long
+                    for minimum, maximum, too_short, too_long in lengths
+                    if not minimum <= length <= maximum
+                ]
+                if field_errors:
+                    errors[key] = field_errors
+                    continue
+            result[attribute] = value
+        # Порядок ошибок неизвестных полей совпадает с marshmallow, перебирающим разность множеств
+        for key in set(data) - self.keys:
+            errors[key] = [self.unknown_message]
+        if errors:
+            raise ValidationError(errors, data=data, valid_data=result)
+        return result
+
+
+def compile_loader(schema):
+    """
+    Компиляция загрузки для экземпляра схемы
+    :return: CompiledLoader или None, если схема не поддерживается
+    """
+    if schema.many or schema.unknown != RAISE or type(schema).handle_error is not Schema.handle_error:
+        return None
+    if any(schema._has_processors(tag) for tag in (PRE_LOAD, POST_LOAD, VALIDATES, VALIDATES_SCHEMA)):
+        return None
+    compiled_fields = []
+    for name, field in schema.load_fields.items():
+        compiled = _compile_field(name, field, schema.partial)
+        if compiled is None:
+            return None
+        compiled_fields.append(compiled)
+    return CompiledLoader(schema, tuple(compiled_fields))
@@ -1,35 +1,78 @@
-from flask import jsonify, g, url_for
+from flask import Blueprint, current_app, g, url_for
 from flask_httpauth import HTTPBasicAuth
 from werkzeug.utils import redirect
 
-from . import app
-from .models import User
+from .api.ratelimit import charge_user
+from .api.representations import json_response
+from .auth_cache import cached_user_id, remember_user
+from .repository import user_by_id, user_by_username
+from .tracing import span
+from .warmup import readiness, warm_up
 
+main_bp = Blueprint(name='main', import_name=__name__)
 auth = HTTPBasicAuth()
 
 
-@app.route('/')
+@main_bp.route('/')
 def index():
     """Представление индексной страницы"""
     return redirect(url_for('api.api_root'))
 
 
-@app.errorhandler(404)
+@main_bp.route('/healthz')
+def healthz():
+    """Проверка работоспособности процесса (liveness)"""
+    return json_response({'status': 'ok'})
+
+
+@main_bp.route('/readyz')
+def readyz():
+    """
+    Проверка готовности процесса к обработке запросов: процесс прогрет (readiness).
+    Если прогрев при запуске не удался (например, БД была недоступна), он повторяется.
+    """
+    if not readiness.ready:
+        try:
+            warm_up()
+        except Exception:
+            current_app.logger.exception('warm-up failed')
+            return json_response({'status': 'warming up'}, 503)
+    return json_response({'status': 'ready'})
+
+
+@main_bp.app_errorhandler(404)
 def error_handler(e):
-    return jsonify({'message': 'page not found'}), 404
+    return json_response({'message': 'page not found'}, 404)
 
 
 @auth.verify_password
 def verify_password(username, password):
     """Функция для проверки пользователя и пароля"""
-    user = User.query.filter(User.username == username).first()
-    if not user or not user.verify_password(password):
-        return False
-    g.user = user
-    return True
+    with span('auth.verify_password'):
+        # Операции пакета (POST /batch) выполняются от имени пользователя, проверенного для всего пакета
+        batch_user = g.get('batch_user')
+        if batch_user is not None:
+            g.user = batch_user
+            return True
+        # Недавно проверенный пароль не хешируется повторно (общий кэш воркеров)
+        user_id = cached_user_id(username, password)
+        if user_id is not None:
+            user = user_by_id(user_id)
+            if user is not None and user.username == username:
+                charge_user(user)
+                g.user = user
+                return True
+        user = user_by_username(username)
+        if not user or not user.verify_password(password):
+            return False
+        remember_user(username, password, user.id)
+        # Корзина пользователя расходуется только после проверки пароля
+        charge_user(user)
+        g.user = user
+        return True
 
 
 @auth.error_handler
 def auth_error(status):
     """Кастомная обработка auth ошибок"""
-    return jsonify({'message': 'access denied'}), status
+    return json_response({'message': 'access denied'}, status)
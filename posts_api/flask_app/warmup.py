@@ -0,0 +1,75 @@
+import os
+import time
+
+from flask import current_app
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+
+from . import db, repository
+from .models import password_hasher
+from .shared_cache import current_cache
+
+
+class Readiness:
+    """
+    Готовность процесса к обработке запросов (GET /readyz).
+    Готовность относится к процессу, в котором выполнен прогрев,
+    поэтому воркер, созданный fork`ом, не наследует готовность мастера.
+    """
+
+    def __init__(self):
+        self._pid = None
+
+    @property
+    def ready(self):
+        return self._pid == os.getpid()
+
+    def mark_ready(self):
+        self._pid = os.getpid()
+
+    def reset(self):
+        self._pid = None
+
+
+readiness = Readiness()
+
+
+def open_connections():
+    """
+    Открытие соединений пула (WARMUP_CONNECTIONS, None - размер пула), чтобы первые запросы
+    не ждали подключения к БД. Соединения удерживаются одновременно, иначе пул вернет одно и то же.
+    :return: число открытых соединений
+    """
+    pool = db.engine.pool
+    count = current_app.config['WARMUP_CONNECTIONS']
+    if count is None:
+        count = pool.size() if isinstance(pool, QueuePool) else 1
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(db.engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return count
+
+
+def warm_up():
+    """
+    Прогрев процесса перед обработкой запросов: настройка мапперов ORM, открытие соединений пула
+    и общего кэша, построение и компиляция запросов горячих путей, инициализация обработчика хешей паролей.
+    Выполняется в контексте приложения, после прогрева процесс считается готовым.
+    :return: длительность прогрева в секундах
+    """
+    start = time.monotonic()
+    configure_mappers()
+    open_connections()
+    current_cache()
+    try:
+        repository.prime()
+    finally:
+        db.session.remove()
+    # Первая проверка пароля вычисляет служебный хеш и загружает бэкенд алгоритма
+    password_hasher.dummy_verify()
+    readiness.mark_ready()
+    return time.monotonic() - start
@@ -0,0 +1,71 @@
+"""
+Настройки gunicorn.
+Приложение загружается в мастер-процессе до fork (preload_app), поэтому воркеры
+разделяют импортированный код и данные с мастером по copy-on-write.
+Воркеры многопоточные (gthread): долгоживущие запросы (поток событий /stream)
+занимают поток, а не весь процесс.
+"""
+import gc
+
+from flask_app.config import WORKERS, WORKER_THREADS
+
+preload_app = True
+worker_class = 'gthread'
+workers = WORKERS
+threads = WORKER_THREADS
+
+
+def when_ready(server):
+    """
+    Фильтр занятых имен пользователей заполняется в мастер-процессе и наследуется воркерами.
+    Объекты, созданные при загрузке приложения, исключаются из сборки мусора,
+    чтобы сборщик в воркерах не изменял разделяемые страницы памяти
+    """
+    from flask_app import db
+    from flask_app.availability import user_filter
+
+    app = server.app.wsgi()
+    with app.app_context():
+        try:
+            if user_filter.enabled():
+                user_filter.warm()
+        except Exception:
+            # Фильтр будет заполнен воркерами при первом обращении
+            server.log.exception('availability filter warm-up failed')
+        finally:
+            db.session.remove()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Соединения с БД, открытые в мастер-процессе, не должны использоваться воркерами.
+    Затем воркер прогревается, до окончания прогрева GET /readyz возвращает 503
+    """
+    from flask_app import db
+    from flask_app.warmup import warm_up
+
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
+        try:
+            duration = warm_up()
+        except Exception:
+            server.log.exception('worker warm-up failed')
+        else:
+            server.log.info('worker %s warmed up in %.2fs', worker.pid, duration)
+
+
+def worker_exit(server, worker):
+    """Запись накопленных в воркере просмотров постов при его завершении"""
+    from flask_app import db
+    from flask_app.counters import view_counter
+
+    app = server.app.wsgi()
+    with app.app_context():
+        try:
+            view_counter.flush()
+        except Exception:
+            server.log.exception('view counts flush failed')
+        finally:
+            db.session.remove()
@@ -1,8 +1,112 @@
 #!/usr/bin/env python3
 """Файл для управления приложением."""
+import datetime
+import time
 
-from flask_app import manager, app, db
-import flask_app.views
+from flask_migrate import Migrate, MigrateCommand
+from flask_script import Manager
+
+from flask_app import create_app, db
+from flask_app.archive import archive_posts
+from flask_app.changes import compact_changes
+from flask_app.fragments import rebuild_fragments
+from flask_app.purge import purge_deleted_posts
+from flask_app.snapshots import sealed, snapshot_store
+
+app = create_app()
+
+# Миграции БД
+migrate = Migrate(app, db)
+manager = Manager(app)
+manager.add_command('db', MigrateCommand)
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=None,
+                help='срок хранения записей журнала в днях')
+def compact_change_log(days=None):
+    """Сжатие журнала изменений"""
+    if days is None:
+        days = app.config['CHANGES_RETENTION_DAYS']
+    deleted = compact_changes(datetime.timedelta(days=days))
+    print(f'Удалено записей журнала: {deleted}')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None,
+                help='число записей, удаляемых в одной транзакции')
+@manager.option('-p', '--pause', dest='pause', type=float, default=0,
+                help='пауза между пакетами в секундах')
+@manager.option('-i', '--interval', dest='interval', type=float, default=None,
+                help='периодический запуск с указанным интервалом в секундах')
+def purge_deleted(batch_size=None, pause=0, interval=None):
+    """Окончательное удаление помеченных как удаленные постов и их комментариев"""
+    if batch_size is None:
+        batch_size = app.config['PURGE_BATCH_SIZE']
+    while True:
+        posts, comments = purge_deleted_posts(batch_size, pause)
+        print(f'Удалено постов: {posts}, комментариев: {comments}')
+        if interval is None:
+            break
+        time.sleep(interval)
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=None,
+                help='возраст архивируемых постов в днях')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None,
+                help='число постов, переносимых в одной транзакции')
+@manager.option('-p', '--pause', dest='pause', type=float, default=0,
+                help='пауза между пакетами в секундах')
+def archive_old_posts(days=None, batch_size=None, pause=0):
+    """Перенос старых постов и их комментариев в архивные таблицы"""
+    if days is None:
+        days = app.config['ARCHIVE_AFTER_DAYS']
+    if batch_size is None:
+        batch_size = app.config['ARCHIVE_BATCH_SIZE']
+    archived = archive_posts(datetime.timedelta(days=days), batch_size, pause)
+    print(f'Перенесено в архив постов: {archived}')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=500,
+                help='число записей, обрабатываемых в одной транзакции')
+def rebuild_json_fragments(batch_size=500):
+    """Пересоздание сохраненных JSON-фрагментов постов и комментариев"""
+    posts, comments = rebuild_fragments(batch_size)
+    print(f'Обновлено постов: {posts}, комментариев: {comments}')
+
+
+@manager.option('-d', '--date', dest='date', default=None,
+                help='день (YYYY-MM-DD), снимок которого формируется заново')
+@manager.option('-i', '--interval', dest='interval', type=float, default=None,
+                help='периодический запуск с указанным интервалом в секундах')
+def write_snapshots(date=None, interval=None):
+    """
+    Формирование снимков постов завершенных дней, для которых снимков нет
+    (в том числе удаленных после изменения постов дня)
+    """
+    def report(day, posts):
+        if posts is None:
+            print(f'Снимок {day} удален: посты дня изменились во время его формирования')
+        else:
+            print(f'Снимок {day}, постов: {posts}')
+
+    store = snapshot_store()
+    if store is None:
+        print('Снимки отключены (SNAPSHOTS_DIR)')
+        return
+    if date is not None:
+        day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+        if not sealed(day):
+            print(f'День {day} еще не завершен')
+            return
+        report(day, store.write(day))
+        return
+    while True:
+        written = store.write_missing()
+        for day, posts in written.items():
+            report(day, posts)
+        db.session.remove()
+        if interval is None:
+            break
+        time.sleep(interval)
 
 
 if __name__ == '__main__':
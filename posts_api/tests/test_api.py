@@ -1,24 +1,69 @@
 import base64
-import os
+import datetime
 from unittest import TestCase
+from unittest.mock import Mock, patch
 
-from flask_app import db, app
-from flask_app.models import User, Post, Comment
-from flask_app.serializers import posts_list_schema, post_create_schema
+from sqlalchemy import event
+
+from flask_app import create_app, db
+from flask_app.archive import archive_posts
+from flask_app.changes import _lock_change_log
+from flask_app.authors import author_cache
+from flask_app.availability import user_filter
+from flask_app.config import TestingConfiguration
+from flask_app.counters import view_counter
+from flask_app.fragments import render_fragment
+from flask_app.models import User, Post, Comment, Change, ChangeCompaction
+from flask_app.post_cache import post_cache
+from flask_app.serializers import posts_list_schema, post_create_schema, comment_create_schema
+from flask_app.warmup import readiness
 
 
 class BaseTestCase(TestCase):
 
     def setUp(self):
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'test.db')
-        self.client = app.test_client()
+        self.app = create_app(TestingConfiguration)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
         db.create_all()
+        post_cache.clear()
 
     def tearDown(self):
+        post_cache.clear()
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
+
+
+class HealthTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        readiness.reset()
+
+    def tearDown(self):
+        readiness.reset()
+        super().tearDown()
+
+    def test_healthz(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'status': 'ok'}, response.json)
+
+    def test_readyz(self):
+        response = self.client.get('/readyz')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'status': 'ready'}, response.json)
+        self.assertTrue(readiness.ready)
+
+    def test_readyz_warm_up_failed(self):
+        db.drop_all()
+        response = self.client.get('/readyz')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual({'status': 'warming up'}, response.json)
+        self.assertFalse(readiness.ready)
+        self.assertEqual(200, self.client.get('/healthz').status_code)
 
 
 class AuthTestCase(BaseTestCase):
@@ -193,11 +238,39 @@ class PostsTestCase(BaseTestCase):
         db.session.add(post1)
         db.session.commit()
 
+        auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+        response = self.client.delete(f'/api/v1/posts/{post1.id}', headers={'Authorization': f'Basic {auth}'})
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(0, Post.query.filter(Post.deleted_at.is_(None)).count())
+        self.assertIsNotNone(post1.deleted_at)
+        self.assertEqual(404, self.client.get(f'/api/v1/posts/{post1.id}').status_code)
+
+    def test_delete_post_owner_without_soft_delete(self):
+        self.app.config['SOFT_DELETE'] = False
+        post1 = Post(author_id=self.user.id, title='Title 1', content='Content 1')
+        db.session.add(post1)
+        db.session.commit()
+
         auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
         response = self.client.delete(f'/api/v1/posts/{post1.id}', headers={'Authorization': f'Basic {auth}'})
         self.assertEqual(204, response.status_code)
         self.assertEqual(0, Post.query.count())
 
+    def test_deleted_post_hidden(self):
+        post1 = Post(author_id=self.user.id, title='Title 1', content='Content 1')
+        post2 = Post(author_id=self.user.id, title='Title 2', content='Content 2',
+                     deleted_at=datetime.datetime.utcnow())
+        db.session.add_all([post1, post2])
+        db.session.commit()
+
+        response = self.client.get('/api/v1/posts')
+        self.assertEqual([post1.id], [post['id'] for post in response.get_json()['data']])
+
+        auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+        response = self.client.post(f'/api/v1/posts/{post2.id}/comments', headers={'Authorization': f'Basic {auth}'},
+                                    json={'title': 'Comment title', 'content': 'Comment content'})
+        self.assertEqual(404, response.status_code)
+
 
 class CommentsTestCase(BaseTestCase):
 
@@ -348,3 +421,777 @@ class CommentsTestCase(BaseTestCase):
                                       headers={'Authorization': f'Basic {auth}'})
         self.assertEqual(204, response.status_code)
         self.assertEqual(0, Comment.query.count())
+
+
+class ChangesTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+
+    def test_changes_recorded(self):
+        headers = {'Authorization': f'Basic {self.auth}'}
+        response = self.client.post('/api/v1/posts', headers=headers, json={'title': 'Title', 'content': 'Content'})
+        post_id = response.get_json()['id']
+        response = self.client.post(f'/api/v1/posts/{post_id}/comments', headers=headers,
+                                    json={'title': 'Comment title', 'content': 'Comment content'})
+        comment_id = response.get_json()['id']
+        self.client.patch(f'/api/v1/posts/{post_id}', headers=headers, json={'title': 'New title'})
+        self.client.delete(f'/api/v1/posts/{post_id}/comments/{comment_id}', headers=headers)
+
+        response = self.client.get('/api/v1/changes')
+        self.assertEqual(200, response.status_code)
+        response_data = response.get_json()
+        self.assertFalse(response_data['has_more'])
+        self.assertEqual(
+            [('post', 'create'), ('comment', 'create'), ('post', 'update'), ('comment', 'delete')],
+            [(change['entity'], change['operation']) for change in response_data['changes']]
+        )
+        self.assertEqual('New title', response_data['changes'][2]['data']['title'])
+        self.assertNotIn('comments', response_data['changes'][2]['data'])
+        self.assertIsNone(response_data['changes'][3]['data'])
+        self.assertEqual(response_data['changes'][-1]['sequence'], response_data['next'])
+
+    def test_changes_since_and_limit(self):
+        for i in range(3):
+            db.session.add(Change(entity='post', entity_id=i + 1, post_id=i + 1, operation='create', data='{}'))
+        db.session.commit()
+
+        response = self.client.get('/api/v1/changes?since=1&limit=1')
+        response_data = response.get_json()
+        self.assertEqual([2], [change['sequence'] for change in response_data['changes']])
+        self.assertTrue(response_data['has_more'])
+        self.assertEqual(2, response_data['next'])
+
+    def test_change_ids_allocated_under_lock(self):
+        connection = Mock()
+        connection.dialect.name = 'postgresql'
+        _lock_change_log(None, connection, None)
+        statement = connection.execute.call_args[0][0]
+        self.assertIn('pg_advisory_xact_lock', str(statement))
+
+        connection = Mock()
+        connection.dialect.name = 'sqlite'
+        _lock_change_log(None, connection, None)
+        connection.execute.assert_not_called()
+
+    def test_changes_not_valid_params(self):
+        self.assertEqual(400, self.client.get('/api/v1/changes?since=abc').status_code)
+        self.assertEqual(400, self.client.get('/api/v1/changes?limit=0').status_code)
+
+    def test_changes_compacted(self):
+        db.session.add(ChangeCompaction(horizon=5))
+        db.session.commit()
+
+        self.assertEqual(410, self.client.get('/api/v1/changes?since=4').status_code)
+        self.assertEqual(200, self.client.get('/api/v1/changes?since=5').status_code)
+
+
+class FragmentsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+
+    def test_fragments_rendered_on_write(self):
+        headers = {'Authorization': f'Basic {self.auth}'}
+        response = self.client.post('/api/v1/posts', headers=headers, json={'title': 'Title', 'content': 'Content'})
+        post_id = response.get_json()['id']
+        self.client.post(f'/api/v1/posts/{post_id}/comments', headers=headers,
+                         json={'title': 'Comment title', 'content': 'Comment content'})
+        self.client.patch(f'/api/v1/posts/{post_id}', headers=headers, json={'title': 'New title'})
+
+        post = Post.query.get(post_id)
+        self.assertIn('"title":"New title"', post.rendered)
+        self.assertIsNotNone(post.comments.first().rendered)
+
+        response = self.client.get(f'/api/v1/posts/{post_id}')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(post_create_schema.dump(post), response.get_json())
+
+        response = self.client.get('/api/v1/posts')
+        self.assertEqual(posts_list_schema.dump([post]), response.get_json()['data'])
+        self.assertEqual(1, response.get_json()['pagination']['totalElements'])
+
+    def test_stored_fragments_served(self):
+        post1 = Post(author_id=self.user.id, title='Title 1', content='Content 1', rendered='{"id":1,"title":"Stored"}')
+        db.session.add(post1)
+        db.session.commit()
+
+        response = self.client.get(f'/api/v1/posts/{post1.id}')
+        self.assertEqual({'id': 1, 'title': 'Stored', 'view_count': 0, 'comments': []}, response.get_json())
+
+    def test_empty_posts_list(self):
+        response = self.client.get('/api/v1/posts')
+        self.assertEqual({'message': 'There is no posts'}, response.get_json())
+
+
+class CoreReadPathTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['READ_FROM_FRAGMENTS'] = False
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.post1 = Post(author_id=self.user.id, title='Title 1', content='Content 1')
+        self.post2 = Post(author_id=self.user.id, title='Title 2', content='Content 2')
+        db.session.add_all([self.post1, self.post2])
+        db.session.commit()
+
+        self.comment1 = Comment(author_id=self.user.id,
+                                post_id=self.post1.id,
+                                title='Comment Title 1',
+                                content='Comment Content 1')
+        db.session.add(self.comment1)
+        db.session.commit()
+
+    def test_posts_list(self):
+        response = self.client.get('/api/v1/posts')
+        self.assertEqual(200, response.status_code)
+
+        posts = Post.query.order_by(Post.publication_datetime.desc()).all()
+        self.assertEqual(posts_list_schema.dump(posts), response.get_json()['data'])
+
+    def test_get_post(self):
+        response = self.client.get(f'/api/v1/posts/{self.post1.id}')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(post_create_schema.dump(self.post1), response.get_json())
+
+    def test_get_post_not_found(self):
+        response = self.client.get('/api/v1/posts/100')
+        self.assertEqual(404, response.status_code)
+        self.assertEqual({'message': 'post not found'}, response.get_json())
+
+    def test_comments_list(self):
+        expected = [comment_create_schema.dump(self.comment1)]
+        response = self.client.get(f'/api/v1/posts/{self.post1.id}/comments')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(expected, response.get_json())
+
+        self.app.config['READ_FROM_FRAGMENTS'] = True
+        response = self.client.get(f'/api/v1/posts/{self.post1.id}/comments')
+        self.assertEqual(expected, response.get_json())
+
+    def test_comments_list_post_not_found(self):
+        response = self.client.get('/api/v1/posts/100/comments')
+        self.assertEqual(404, response.status_code)
+
+
+class ArchiveTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+
+        headers = {'Authorization': f'Basic {self.auth}'}
+        response = self.client.post('/api/v1/posts', headers=headers, json={'title': 'Title', 'content': 'Content'})
+        self.post_id = response.get_json()['id']
+        self.client.post(f'/api/v1/posts/{self.post_id}/comments', headers=headers,
+                         json={'title': 'Comment title', 'content': 'Comment content'})
+        self.expected = self.client.get(f'/api/v1/posts/{self.post_id}').get_json()
+        archive_posts(datetime.timedelta(days=-1), batch_size=10)
+
+    def test_read_through(self):
+        for from_fragments in (True, False):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+
+            response = self.client.get(f'/api/v1/posts/{self.post_id}')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(self.expected, response.get_json())
+
+            response = self.client.get(f'/api/v1/posts/{self.post_id}/comments')
+            self.assertEqual(self.expected['comments'], response.get_json())
+
+            response = self.client.get('/api/v1/posts')
+            self.assertEqual({'message': 'There is no posts'}, response.get_json())
+
+            response = self.client.get('/api/v1/posts?archived=true')
+            self.assertEqual([self.expected], response.get_json()['data'])
+
+    def test_write_rejected(self):
+        self.app.config['ARCHIVE_WRITE_POLICY'] = 'reject'
+        headers = {'Authorization': f'Basic {self.auth}'}
+        response = self.client.patch(f'/api/v1/posts/{self.post_id}', headers=headers, json={'title': 'New title'})
+        self.assertEqual(409, response.status_code)
+        self.assertEqual({'message': 'post is archived'}, response.get_json())
+
+        response = self.client.post(f'/api/v1/posts/{self.post_id}/comments', headers=headers,
+                                    json={'title': 'Comment title', 'content': 'Comment content'})
+        self.assertEqual(409, response.status_code)
+
+    def test_write_rehydrates(self):
+        headers = {'Authorization': f'Basic {self.auth}'}
+        response = self.client.patch(f'/api/v1/posts/{self.post_id}', headers=headers, json={'title': 'New title'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('New title', response.get_json()['title'])
+
+        response = self.client.get('/api/v1/posts')
+        self.assertEqual(1, response.get_json()['pagination']['totalElements'])
+        self.assertEqual(1, len(response.get_json()['data'][0]['comments']))
+        response = self.client.get('/api/v1/posts?archived=true')
+        self.assertEqual({'message': 'There is no posts'}, response.get_json())
+
+
+class MultiGetTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.posts = [Post(author_id=self.user.id, title=f'Title {i}', content=f'Content {i}') for i in range(3)]
+        db.session.add_all(self.posts)
+        db.session.commit()
+        comments = [
+            Comment(author_id=self.user.id, post_id=post.id, title='Comment title', content='Comment content')
+            for post in self.posts
+        ]
+        db.session.add_all(comments)
+        for obj in self.posts + comments:
+            render_fragment(obj)
+        db.session.commit()
+        self.expected = {post.id: post_create_schema.dump(post) for post in self.posts}
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_request_order_and_missing(self):
+        first, second, third = (post.id for post in self.posts)
+        for from_fragments in (False, True):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            self.statements.clear()
+
+            response = self.client.get(f'/api/v1/posts?ids={third},100,{first},{third}')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual([
+                self.expected[third],
+                {'id': 100, 'message': 'post not found'},
+                self.expected[first],
+                self.expected[third],
+            ], response.get_json()['data'])
+
+    def test_two_queries(self):
+        ids = ','.join(str(post.id) for post in self.posts)
+        for from_fragments in (False, True):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            self.statements.clear()
+            response = self.client.get(f'/api/v1/posts?ids={ids}')
+            self.assertEqual(list(self.expected.values()), response.get_json()['data'])
+            self.assertEqual(2, len(self.statements))
+
+    def test_archived_posts(self):
+        post_id = self.posts[0].id
+        archive_posts(datetime.timedelta(days=-1), batch_size=10)
+        for from_fragments in (False, True):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            response = self.client.get(f'/api/v1/posts?ids={post_id}')
+            self.assertEqual([self.expected[post_id]], response.get_json()['data'])
+
+    def test_invalid_ids(self):
+        response = self.client.get('/api/v1/posts?ids=1,a')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'message': 'ids must be a comma-separated list of integers'}, response.get_json())
+
+        self.app.config['POSTS_MULTIGET_MAX_IDS'] = 2
+        response = self.client.get('/api/v1/posts?ids=1,2,3')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'message': 'no more than 2 ids allowed'}, response.get_json())
+
+
+class ExpandAuthorTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        author_cache.clear()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        self.user2 = User(
+            email='t2@t.com',
+            username='user2'
+        )
+        self.user2.hash_password('1q2w3e')
+        db.session.add_all([self.user, self.user2])
+        db.session.commit()
+
+        self.post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(self.post)
+        db.session.commit()
+        self.comment = Comment(author_id=self.user2.id, post_id=self.post.id,
+                               title='Comment title', content='Comment content')
+        db.session.add(self.comment)
+        db.session.commit()
+
+        self.author1 = {'id': self.user.id, 'username': 'user1'}
+        self.author2 = {'id': self.user2.id, 'username': 'user2'}
+        self.user_queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count_user_query)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_user_query)
+        author_cache.clear()
+        super().tearDown()
+
+    def _count_user_query(self, conn, cursor, statement, parameters, context, executemany):
+        if 'FROM user' in statement:
+            self.user_queries += 1
+
+    def assert_expanded(self, post):
+        self.assertEqual(self.author1, post['author'])
+        self.assertEqual([self.author2], [comment['author'] for comment in post['comments']])
+
+    def test_expand_posts(self):
+        for from_fragments in (False, True):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            author_cache.clear()
+            self.user_queries = 0
+
+            response = self.client.get('/api/v1/posts?expand=author')
+            self.assertEqual(200, response.status_code)
+            self.assert_expanded(response.get_json()['data'][0])
+            self.assertEqual(1, response.get_json()['pagination']['totalElements'])
+            self.assertEqual(1, self.user_queries)
+
+            self.assert_expanded(self.client.get(f'/api/v1/posts/{self.post.id}?expand=author').get_json())
+            data = self.client.get(f'/api/v1/posts?ids={self.post.id},100&expand=author').get_json()['data']
+            self.assert_expanded(data[0])
+            self.assertEqual({'id': 100, 'message': 'post not found'}, data[1])
+
+            response = self.client.get(f'/api/v1/posts/{self.post.id}/comments?expand=author')
+            self.assertEqual([self.author2], [comment['author'] for comment in response.get_json()])
+            # Последующие запросы используют кэш имен
+            self.assertEqual(1, self.user_queries)
+
+    def test_cache_disabled(self):
+        self.app.config['AUTHORS_CACHE_TTL'] = 0
+        self.client.get('/api/v1/posts?expand=author')
+        self.client.get('/api/v1/posts?expand=author')
+        self.assertEqual(2, self.user_queries)
+
+    def test_not_expanded_by_default(self):
+        response = self.client.get(f'/api/v1/posts/{self.post.id}')
+        self.assertNotIn('author', response.get_json())
+        self.assertEqual(0, self.user_queries)
+
+    def test_unsupported_expand(self):
+        response = self.client.get('/api/v1/posts?expand=author,post')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'message': 'unsupported expand: post'}, response.get_json())
+
+
+class AvailabilityTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user_filter.reset()
+
+        user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        user.hash_password('1q2w3e')
+        db.session.add(user)
+        db.session.commit()
+
+        self.user_queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count_user_query)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_user_query)
+        user_filter.reset()
+        super().tearDown()
+
+    def _count_user_query(self, conn, cursor, statement, parameters, context, executemany):
+        if 'FROM user' in statement:
+            self.user_queries += 1
+
+    def test_availability(self):
+        response = self.client.get('/api/v1/registration/availability?username=user1&email=new@t.com')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'username': False, 'email': True}, response.get_json())
+
+        response = self.client.get('/api/v1/registration/availability?email=t@t.com')
+        self.assertEqual({'email': False}, response.get_json())
+
+    def test_single_query(self):
+        user_filter.warm()
+        self.user_queries = 0
+
+        response = self.client.get('/api/v1/registration/availability?username=user1&email=t@t.com')
+        self.assertEqual({'username': False, 'email': False}, response.get_json())
+        self.assertEqual(1, self.user_queries)
+
+        # Без общего кэша фильтр не используется: свободные значения проверяются тем же одним запросом
+        self.user_queries = 0
+        response = self.client.get('/api/v1/registration/availability?username=new_user&email=new@t.com')
+        self.assertEqual({'username': True, 'email': True}, response.get_json())
+        self.assertEqual(1, self.user_queries)
+
+    def test_user_registered_by_other_worker(self):
+        user_filter.warm()
+        # Пользователь зарегистрирован другим воркером: в фильтр этого воркера он не добавлялся
+        user = User(email='other@t.com', username='other_user')
+        user.hash_password('password')
+        db.session.add(user)
+        db.session.commit()
+
+        response = self.client.get('/api/v1/registration/availability?username=other_user&email=other@t.com')
+        self.assertEqual({'username': False, 'email': False}, response.get_json())
+
+    def test_user_committed_out_of_order(self):
+        user_filter.warm()
+        for user_id, username in ((5, 'user5'), (3, 'user3')):
+            user = User(id=user_id, email=f'{username}@t.com', username=username)
+            user.hash_password('password')
+            db.session.add(user)
+            db.session.commit()
+            # Пользователь с меньшим идентификатором зафиксирован после дополнения фильтра
+            self.client.get('/api/v1/registration/availability?username=nobody')
+
+        response = self.client.get('/api/v1/registration/availability?username=user3')
+        self.assertEqual({'username': False}, response.get_json())
+
+    def test_filter_updated_on_registration(self):
+        user_filter.warm()
+        post_data = {
+            'email': 'new@t.com',
+            'username': 'new_user',
+            'password': 'password'
+        }
+        self.assertEqual(201, self.client.post('/api/v1/registration', json=post_data).status_code)
+        response = self.client.get('/api/v1/registration/availability?username=new_user&email=new@t.com')
+        self.assertEqual({'username': False, 'email': False}, response.get_json())
+
+    def test_registration_single_query(self):
+        self.user_queries = 0
+        post_data = {
+            'email': 't@t.com',
+            'username': 'user1',
+            'password': 'password'
+        }
+        response = self.client.post('/api/v1/registration', json=post_data)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'email': ['email already exists'], 'username': ['name already exists']},
+                         response.get_json())
+        self.assertEqual(1, self.user_queries)
+
+    def test_no_parameters(self):
+        response = self.client.get('/api/v1/registration/availability')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'message': 'username or email is required'}, response.get_json())
+
+
+class PreviewTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.long_post = Post(author_id=self.user.id, title='Long', content='x' * 1000,
+                              publication_datetime=datetime.datetime(2021, 1, 2))
+        self.short_post = Post(author_id=self.user.id, title='Short', content='short',
+                               publication_datetime=datetime.datetime(2021, 1, 1))
+        db.session.add_all([self.long_post, self.short_post])
+        db.session.commit()
+        db.session.add(Comment(author_id=self.user.id, post_id=self.long_post.id,
+                               title='Comment title', content='y' * 100))
+        db.session.commit()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_preview(self):
+        for from_fragments in (False, True):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            self.statements.clear()
+
+            response = self.client.get('/api/v1/posts?preview=10')
+            self.assertEqual(200, response.status_code)
+            long_post, short_post = response.get_json()['data']
+            self.assertEqual('x' * 10, long_post['content'])
+            self.assertTrue(long_post['content_truncated'])
+            self.assertEqual('short', short_post['content'])
+            self.assertFalse(short_post['content_truncated'])
+            # Комментарии не сокращаются
+            self.assertEqual('y' * 100, long_post['comments'][0]['content'])
+            self.assertTrue(any('substr(post.content' in statement for statement in self.statements))
+
+    def test_full_content_by_id(self):
+        response = self.client.get(f'/api/v1/posts/{self.long_post.id}')
+        self.assertEqual('x' * 1000, response.get_json()['content'])
+        self.assertNotIn('content_truncated', response.get_json())
+
+    def test_preview_multi_get(self):
+        response = self.client.get(f'/api/v1/posts?ids={self.long_post.id}&preview=5')
+        post, = response.get_json()['data']
+        self.assertEqual('xxxxx', post['content'])
+        self.assertTrue(post['content_truncated'])
+
+    def test_invalid_preview(self):
+        for preview in ('0', 'abc', '100001'):
+            response = self.client.get(f'/api/v1/posts?preview={preview}')
+            self.assertEqual(400, response.status_code)
+            self.assertEqual({'message': 'preview must be an integer between 1 and 10000'}, response.get_json())
+
+
+class PostCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(self.post)
+        db.session.commit()
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(b"user1:1q2w3e").decode("utf-8")}
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_cached(self):
+        first = self.client.get(f'/api/v1/posts/{self.post.id}')
+        queries = len(self.statements)
+        second = self.client.get(f'/api/v1/posts/{self.post.id}')
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(queries, len(self.statements))
+
+    def test_not_found_cached(self):
+        self.assertEqual(404, self.client.get('/api/v1/posts/100').status_code)
+        queries = len(self.statements)
+        response = self.client.get('/api/v1/posts/100')
+        self.assertEqual(404, response.status_code)
+        self.assertEqual({'message': 'post not found'}, response.get_json())
+        self.assertEqual(queries, len(self.statements))
+
+    def test_invalidated_by_mutations(self):
+        url = f'/api/v1/posts/{self.post.id}'
+        self.client.get(url)
+        self.client.patch(url, headers=self.headers, json={'title': 'New title'})
+        self.assertEqual('New title', self.client.get(url).get_json()['title'])
+
+        response = self.client.post(f'{url}/comments', headers=self.headers,
+                                    json={'title': 'Comment', 'content': 'Content'})
+        comment_id = response.get_json()['id']
+        self.assertEqual([comment_id], [comment['id'] for comment in self.client.get(url).get_json()['comments']])
+        self.client.delete(f'{url}/comments/{comment_id}', headers=self.headers)
+        self.assertEqual([], self.client.get(url).get_json()['comments'])
+
+        self.client.delete(url, headers=self.headers)
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_created_after_not_found(self):
+        next_id = self.post.id + 1
+        self.assertEqual(404, self.client.get(f'/api/v1/posts/{next_id}').status_code)
+        response = self.client.post('/api/v1/posts', headers=self.headers, json={'title': 'T', 'content': 'C'})
+        self.assertEqual(next_id, response.get_json()['id'])
+        self.assertEqual(200, self.client.get(f'/api/v1/posts/{next_id}').status_code)
+
+
+class ViewCountTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        view_counter.reset()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(self.post)
+        db.session.commit()
+
+    def tearDown(self):
+        view_counter.reset()
+        super().tearDown()
+
+    def test_views_counted(self):
+        for from_fragments in (True, False):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            self.client.get(f'/api/v1/posts/{self.post.id}')
+        self.client.get('/api/v1/posts/100')
+        self.assertEqual({self.post.id: 2}, view_counter.pending)
+
+        # Просмотры записываются в БД пакетно
+        self.assertEqual(0, self.client.get('/api/v1/posts').get_json()['data'][0]['view_count'])
+        view_counter.flush()
+        # Пост в кэше воркера обновляется по истечении POSTS_CACHE_TTL
+        post_cache.clear()
+        for from_fragments in (True, False):
+            self.app.config['READ_FROM_FRAGMENTS'] = from_fragments
+            self.assertEqual(2, self.client.get('/api/v1/posts').get_json()['data'][0]['view_count'])
+            self.assertEqual(2, self.client.get(f'/api/v1/posts/{self.post.id}').get_json()['view_count'])
+
+
+class BatchTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(b"user1:1q2w3e").decode("utf-8")}
+
+    def test_post_with_comments(self):
+        operations = [
+            {'method': 'POST', 'path': '/posts', 'body': {'title': 'Title', 'content': 'Content'}},
+            {'method': 'POST', 'path': '/posts/{0.id}/comments', 'body': {'title': 'C1', 'content': 'Content'}},
+            {'method': 'POST', 'path': '/posts/{0.id}/comments', 'body': {'title': 'C2', 'content': 'Content'}},
+            {'method': 'GET', 'path': '/posts/{0.id}'},
+        ]
+        with patch.object(User, 'verify_password', autospec=True, side_effect=User.verify_password) as verify:
+            response = self.client.post('/api/v1/batch', headers=self.headers, json={'operations': operations})
+            self.assertEqual(1, verify.call_count)
+        self.assertEqual(200, response.status_code)
+        results = response.get_json()['results']
+        self.assertEqual([201, 201, 201, 200], [result['status'] for result in results])
+        post_id = results[0]['body']['id']
+        self.assertEqual([post_id, post_id], [result['body']['post_id'] for result in results[1:3]])
+        self.assertEqual(['C1', 'C2'], [comment['title'] for comment in results[3]['body']['comments']])
+
+    def test_errors_do_not_stop_batch(self):
+        post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(post)
+        db.session.commit()
+        operations = [
+            {'method': 'POST', 'path': '/posts', 'body': {'title': ''}},
+            {'method': 'PATCH', 'path': '/posts/100', 'body': {'title': 'New title'}},
+            {'method': 'GET', 'path': '/unknown'},
+            {'method': 'GET', 'path': '/stream'},
+            {'method': 'POST', 'path': '/posts/{0.id}/comments', 'body': {'title': 'C', 'content': 'C'}},
+            {'method': 'PATCH', 'path': f'/posts/{post.id}', 'body': {'title': 'New title'}},
+            {'method': 'DELETE', 'path': f'/posts/{post.id}'},
+        ]
+        response = self.client.post('/api/v1/batch', headers=self.headers, json={'operations': operations})
+        results = response.get_json()['results']
+        self.assertEqual([400, 404, 404, 400, 424, 200, 204], [result['status'] for result in results])
+        self.assertEqual({'message': 'post not found'}, results[1]['body'])
+        self.assertEqual({'message': 'unresolved reference {0.id}'}, results[4]['body'])
+        self.assertEqual('New title', results[5]['body']['title'])
+        self.assertIsNone(results[6]['body'])
+        self.assertEqual(404, self.client.get(f'/api/v1/posts/{post.id}').status_code)
+
+    def test_atomic(self):
+        operations = [
+            {'method': 'POST', 'path': '/posts', 'body': {'title': 'Title', 'content': 'Content'}},
+            {'method': 'POST', 'path': '/posts/{0.id}/comments', 'body': {'title': 'C', 'content': 'Content'}},
+        ]
+        response = self.client.post('/api/v1/batch', headers=self.headers,
+                                    json={'operations': operations, 'atomic': True})
+        body = response.get_json()
+        self.assertTrue(body['committed'])
+        post_id = body['results'][0]['body']['id']
+        self.assertEqual(1, len(self.client.get(f'/api/v1/posts/{post_id}').get_json()['comments']))
+        self.assertEqual(2, Change.query.count())
+
+    def test_atomic_rolled_back(self):
+        self.client.get('/api/v1/posts/1')
+        operations = [
+            {'method': 'POST', 'path': '/posts', 'body': {'title': 'Title', 'content': 'Content'}},
+            {'method': 'GET', 'path': '/posts/{0.id}'},
+            {'method': 'POST', 'path': '/posts/{0.id}/comments', 'body': {'title': ''}},
+            {'method': 'POST', 'path': '/posts', 'body': {'title': 'Title 2', 'content': 'Content'}},
+        ]
+        response = self.client.post('/api/v1/batch', headers=self.headers,
+                                    json={'operations': operations, 'atomic': True})
+        body = response.get_json()
+        self.assertFalse(body['committed'])
+        self.assertEqual([201, 200, 400, 424], [result['status'] for result in body['results']])
+        self.assertEqual(0, Post.query.count())
+        self.assertEqual(0, Change.query.count())
+        # Пост, прочитанный в пакете до отмены транзакции, не остается в кэше
+        self.assertEqual(404, self.client.get('/api/v1/posts/1').status_code)
+
+    def test_validation(self):
+        response = self.client.post('/api/v1/batch', json={'operations': [{'method': 'GET', 'path': '/posts'}]})
+        self.assertEqual(401, response.status_code)
+
+        response = self.client.post('/api/v1/batch', headers=self.headers,
+                                    json={'operations': [{'method': 'HEAD', 'path': 'posts'}]})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'method', 'path'}, set(response.get_json()['operations']['0']))
+
+        self.app.config['BATCH_MAX_OPERATIONS'] = 1
+        response = self.client.post('/api/v1/batch', headers=self.headers,
+                                    json={'operations': [{'method': 'GET', 'path': '/posts'}] * 2})
+        self.assertEqual({'message': 'no more than 1 operations allowed'}, response.get_json())
@@ -0,0 +1,147 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from flask import g
+
+from flask_app import create_app, db
+from flask_app.api.deadlines import Deadline, DeadlineExceeded, RequestDeadlines
+from flask_app.config import TestingConfiguration
+
+# Бесконечный запрос, прерываемый только по истечении срока
+ENDLESS_QUERY = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n'
+# Бесконечная выборка строк: запрос выполняется сразу, строки вычисляются при получении результата
+ENDLESS_ROWS = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT x FROM n'
+
+
+class QueryCanceled(Exception):
+    """Ошибка psycopg2 при отмене запроса по statement_timeout"""
+    pgcode = '57014'
+
+
+def endless_query():
+    return db.session.execute(ENDLESS_QUERY).scalar()
+
+
+class BaseTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+        self.app.config['REQUEST_TIMEOUTS'] = {'api.changes': {'GET': 0.2}}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+class RequestDeadlinesTestCase(BaseTestCase):
+
+    def test_configured_deadline(self):
+        with patch('flask_app.api.blueprint.changes_horizon', side_effect=endless_query):
+            response = self.client.get('/api/v1/changes')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual({'message': 'request deadline exceeded'}, response.get_json())
+        self.assertNotIn('deadline', g)
+
+    def test_client_deadline(self):
+        with patch('flask_app.api.blueprint.changes_horizon', side_effect=endless_query):
+            response = self.client.get('/api/v1/changes', headers={'X-Request-Timeout': '0.05'})
+            self.assertEqual(504, response.status_code)
+            self.assertEqual({'message': 'request deadline exceeded'}, response.get_json())
+
+            # Заголовок не продлевает срок, заданный настройками
+            response = self.client.get('/api/v1/changes', headers={'X-Request-Timeout': '60'})
+            self.assertEqual(503, response.status_code)
+
+    def test_client_deadline_without_configured(self):
+        self.app.config['REQUEST_TIMEOUT_DEFAULT'] = None
+        with patch('flask_app.api.blueprint.changes_horizon', side_effect=endless_query):
+            response = self.client.get('/api/v1/changes', headers={'X-Request-Timeout': '0.05'})
+        self.assertEqual(504, response.status_code)
+
+    def test_invalid_header(self):
+        for value in ('soon', '0', '-1', 'nan', 'inf'):
+            response = self.client.get('/api/v1/changes', headers={'X-Request-Timeout': value})
+            self.assertEqual(400, response.status_code)
+            self.assertEqual({'message': 'X-Request-Timeout must be a positive number of seconds'},
+                             response.get_json())
+
+    def test_within_deadline(self):
+        response = self.client.get('/api/v1/changes', headers={'X-Request-Timeout': '5'})
+        self.assertEqual(200, response.status_code)
+        # Обработчик прогресса SQLite не прерывает запросы вне срока запроса к API
+        self.assertEqual(1, db.session.execute('SELECT 1').scalar())
+
+    def test_lazy_fetch(self):
+        g.deadline = Deadline(0.2)
+        try:
+            result = db.session.execute(ENDLESS_ROWS)
+            with self.assertRaises(DeadlineExceeded):
+                result.fetchall()
+        finally:
+            g.pop('deadline')
+        db.session.rollback()
+        self.assertEqual(1, db.session.execute('SELECT 1').scalar())
+
+    def test_expired_before_statement(self):
+        g.deadline = Deadline(0)
+        try:
+            with self.assertRaises(DeadlineExceeded) as raised:
+                db.session.execute('SELECT 1')
+            self.assertEqual(503, raised.exception.code)
+        finally:
+            g.pop('deadline')
+
+
+class PostgreSQLStatementTimeoutTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+        self.conn = Mock(info={})
+        self.conn.dialect.name = 'postgresql'
+        self.cursor = Mock()
+
+    def _execute(self):
+        RequestDeadlines._before_cursor_execute(self.conn, self.cursor, 'SELECT 1', (), None, False)
+
+    def _timeouts(self):
+        return [call[0][1][0] for call in self.cursor.execute.call_args_list]
+
+    def test_set_local(self):
+        with self.app.app_context():
+            g.deadline = deadline = Deadline(2)
+            self._execute()
+            self._execute()
+            self.assertEqual(1, self.cursor.execute.call_count)
+            statement, (timeout,) = self.cursor.execute.call_args[0]
+            self.assertEqual('SET LOCAL statement_timeout = %s', statement)
+            self.assertTrue(1900 < timeout <= 2000)
+
+            # Оставшееся время стало заметно меньше установленного значения
+            deadline.expires -= 1
+            self._execute()
+            self.assertEqual(2, self.cursor.execute.call_count)
+            self.assertTrue(900 < self._timeouts()[1] <= 1000)
+            deadline.expires -= 0.05
+            self._execute()
+            self.assertEqual(2, self.cursor.execute.call_count)
+
+            RequestDeadlines._end_transaction(self.conn)
+            self._execute()
+            self.assertEqual(3, self.cursor.execute.call_count)
+
+    def test_query_canceled(self):
+        with self.app.app_context():
+            g.deadline = Deadline(2, client=True)
+            context = Mock(connection=self.conn, original_exception=QueryCanceled())
+            with self.assertRaises(DeadlineExceeded) as raised:
+                RequestDeadlines._handle_error(context)
+            self.assertEqual(504, raised.exception.code)
+
+            # Другие ошибки не заменяются
+            context.original_exception = ValueError()
+            RequestDeadlines._handle_error(context)
@@ -0,0 +1,76 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from flask_app import create_app
+from flask_app.api.profiling import sign_profile_request
+from flask_app.config import TestingConfiguration
+
+
+class RequestProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(TestingConfiguration)
+        self.app.config['PROFILING_TOKEN'] = 'admin-token'
+        self.app.config['PROFILING_SECRET'] = 'secret'
+        self.app.config['PROFILING_DIR'] = self.directory
+        self.app.config['PROFILING_TOP'] = 3
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_not_profiled_by_default(self):
+        response = self.client.get('/api/v1/')
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('X-Profile-Summary', response.headers)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_admin_token(self):
+        response = self.client.get('/api/v1/', headers={'X-Profile-Token': 'admin-token'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(response.headers['X-Profile-Summary'].split('; ')))
+
+        name = response.headers['X-Profile-Id']
+        self.assertEqual([name], os.listdir(self.directory))
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        self.assertTrue(any(func == 'api_root' for _, _, func in stats.stats))
+
+    def test_wrong_token(self):
+        response = self.client.get('/api/v1/', headers={'X-Profile-Token': 'wrong'})
+        self.assertNotIn('X-Profile-Summary', response.headers)
+
+    def test_signed_header(self):
+        expires = time.time() + 60
+        signature = sign_profile_request('secret', 'GET', '/api/v1/?page=2', expires)
+        response = self.client.get('/api/v1/?page=2', headers={'X-Profile-Signature': signature})
+        self.assertIn('X-Profile-Summary', response.headers)
+
+        # Подпись действует только для указанного пути
+        response = self.client.get('/api/v1/?page=3', headers={'X-Profile-Signature': signature})
+        self.assertNotIn('X-Profile-Summary', response.headers)
+
+        expired = sign_profile_request('secret', 'GET', '/api/v1/', time.time() - 1)
+        response = self.client.get('/api/v1/', headers={'X-Profile-Signature': expired})
+        self.assertNotIn('X-Profile-Summary', response.headers)
+
+    def test_sampling(self):
+        self.app.config['PROFILING_SAMPLE_RATE'] = 3
+        for _ in range(9):
+            response = self.client.get('/api/v1/')
+            # Результаты автоматического профилирования клиенту не возвращаются
+            self.assertNotIn('X-Profile-Summary', response.headers)
+        self.assertEqual(3, len(os.listdir(self.directory)))
+
+    def test_rotation(self):
+        self.app.config['PROFILING_SAMPLE_RATE'] = 1
+        self.app.config['PROFILING_MAX_FILES'] = 2
+        names = []
+        for _ in range(4):
+            names.append(self.client.get('/api/v1/', headers={'X-Profile-Token': 'admin-token'}).headers['X-Profile-Id'])
+            time.sleep(0.01)
+        self.assertEqual(sorted(names[-2:]), sorted(os.listdir(self.directory)))
@@ -0,0 +1,154 @@
+import base64
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from flask_app import create_app, db
+from flask_app.api.blueprint import limiter
+from flask_app.api.ratelimit import MemoryStorage, SQLiteStorage
+from flask_app.config import TestingConfiguration
+from flask_app.models import User
+
+
+class MemoryStorageTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_consume_until_empty(self):
+        self.assertEqual((True, 0), self.storage.consume('ip:1', 2, 4, 1, 100.0))
+        self.assertEqual((True, 0), self.storage.consume('ip:1', 2, 4, 1, 100.0))
+        allowed, retry_after = self.storage.consume('ip:1', 2, 4, 1, 100.0)
+        self.assertFalse(allowed)
+        self.assertEqual(2, retry_after)
+
+    def test_refill(self):
+        self.storage.consume('ip:1', 4, 4, 1, 100.0)
+        self.assertFalse(self.storage.consume('ip:1', 1, 4, 1, 100.5)[0])
+        self.assertTrue(self.storage.consume('ip:1', 1, 4, 1, 101.5)[0])
+
+    def test_keys_are_independent(self):
+        self.storage.consume('ip:1', 4, 4, 1, 100.0)
+        self.assertTrue(self.storage.consume('ip:2', 4, 4, 1, 100.0)[0])
+
+
+class SQLiteStorageTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.storage = SQLiteStorage(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_shared_between_instances(self):
+        self.assertTrue(self.storage.consume('user:user1', 3, 4, 1, 100.0)[0])
+        other = SQLiteStorage(self.path)
+        allowed, retry_after = other.consume('user:user1', 3, 4, 1, 100.0)
+        self.assertFalse(allowed)
+        self.assertEqual(2, retry_after)
+
+
+class RateLimiterTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+        self.app.config['RATELIMIT_ENABLED'] = True
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            limiter.reset()
+
+    def test_too_many_requests(self):
+        self.app.config['RATELIMIT_CAPACITY'] = 2
+        self.app.config['RATELIMIT_REFILL_RATE'] = 0.1
+        with self.app.app_context():
+            limiter.reset()
+
+        self.assertEqual(200, self.client.get('/api/v1/').status_code)
+        self.assertEqual(200, self.client.get('/api/v1/').status_code)
+        response = self.client.get('/api/v1/')
+        self.assertEqual(429, response.status_code)
+        self.assertEqual({'message': 'too many requests'}, response.get_json())
+        self.assertEqual('10', response.headers['Retry-After'])
+
+    def test_forwarded_clients(self):
+        self.app.config['RATELIMIT_CAPACITY'] = 2
+        self.app.config['RATELIMIT_REFILL_RATE'] = 0.1
+        with self.app.app_context():
+            limiter.reset()
+
+        def get(client_ip):
+            # Адрес клиента добавлен прокси в конец заголовка, предыдущие значения задает клиент
+            return self.client.get('/api/v1/', headers={'X-Forwarded-For': f'10.1.1.1, {client_ip}'},
+                                   environ_base={'REMOTE_ADDR': '10.0.0.254'}).status_code
+
+        self.assertEqual([200, 200, 429], [get('203.0.113.1') for _ in range(3)])
+        self.assertEqual(200, get('203.0.113.2'))
+
+    def test_load_shedding(self):
+        self.app.config['LOAD_SHEDDING_MAX_QUEUE_TIME'] = 1
+        response = self.client.get('/api/v1/', headers={'X-Request-Start': f't={time.time() - 3:.3f}'})
+        self.assertEqual(503, response.status_code)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(0, limiter.in_flight)
+
+        # Heroku передает время в миллисекундах
+        start = int((time.time() - 0.1) * 1000)
+        self.assertEqual(200, self.client.get('/api/v1/', headers={'X-Request-Start': str(start)}).status_code)
+        self.assertEqual(200, self.client.get('/api/v1/', headers={'X-Request-Start': 'invalid'}).status_code)
+
+    def test_stream_is_not_in_flight(self):
+        with self.app.test_request_context('/api/v1/stream'):
+            self.app.preprocess_request()
+            self.assertEqual(0, limiter.in_flight)
+
+
+class UserRateLimitTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+        self.app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_CAPACITY=10, RATELIMIT_REFILL_RATE=0.01)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        user = User(username='user1', email='user1@test.com')
+        user.hash_password('password1')
+        db.session.add(user)
+        db.session.commit()
+        limiter.reset()
+
+    def tearDown(self):
+        limiter.reset()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, username, password, ip):
+        credentials = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        return self.client.post(
+            '/api/v1/posts', json={}, headers={'Authorization': f'Basic {credentials}'},
+            environ_base={'REMOTE_ADDR': ip}
+        )
+
+    def test_forged_usernames_use_ip_bucket(self):
+        # Стоимость запроса 5 (1 + проверка пароля), емкость корзины 10
+        statuses = [self.create_post(f'user{i}', 'password', '10.0.0.1').status_code for i in range(3)]
+        self.assertEqual([401, 401, 429], statuses)
+
+    def test_wrong_passwords_do_not_drain_user_bucket(self):
+        for _ in range(3):
+            self.create_post('user1', 'wrong', '10.0.0.1')
+        self.assertEqual(400, self.create_post('user1', 'password1', '10.0.0.2').status_code)
+
+    def test_user_bucket_shared_between_ips(self):
+        self.assertEqual(400, self.create_post('user1', 'password1', '10.0.0.1').status_code)
+        self.assertEqual(400, self.create_post('user1', 'password1', '10.0.0.2').status_code)
+        response = self.create_post('user1', 'password1', '10.0.0.3')
+        self.assertEqual(429, response.status_code)
+        self.assertEqual({'message': 'too many requests'}, response.get_json())
+        self.assertIn('Retry-After', response.headers)
@@ -0,0 +1,49 @@
+import datetime
+import json
+from collections import OrderedDict
+from unittest import TestCase
+
+from flask_app import create_app
+from flask_app.api import representations
+from flask_app.config import TestingConfiguration
+
+
+class DumpsTestCase(TestCase):
+
+    def test_ordered_dict_keeps_order(self):
+        data = OrderedDict([('id', 1), ('title', 'Title'), ('content', 'Content')])
+        dumped = representations.dumps(data)
+        self.assertIsInstance(dumped, bytes)
+        self.assertEqual(b'{"id":1,"title":"Title","content":"Content"}', dumped)
+
+    def test_datetime_string(self):
+        data = {'publication_datetime': '01-02-2021 10:20:30'}
+        self.assertEqual(data, json.loads(representations.dumps(data)))
+
+    def test_datetime_object(self):
+        data = {'publication_datetime': datetime.datetime(2021, 2, 1, 10, 20, 30)}
+        self.assertEqual({'publication_datetime': '2021-02-01T10:20:30'}, json.loads(representations.dumps(data)))
+
+    def test_non_ascii(self):
+        data = {'title': 'Заголовок'}
+        self.assertEqual(data, json.loads(representations.dumps(data).decode('utf-8')))
+
+
+class OutputJsonTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+
+    def test_output_json(self):
+        with self.app.test_request_context():
+            response = representations.output_json({'message': 'ok'}, 201, {'X-Test': '1'})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual('1', response.headers['X-Test'])
+        self.assertEqual({'message': 'ok'}, response.get_json())
+
+    def test_api_root(self):
+        response = self.app.test_client().get('/api/v1/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual('/api/v1/posts', response.get_json()['posts'])
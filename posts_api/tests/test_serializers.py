@@ -1,9 +1,9 @@
-import os
 from unittest import TestCase
 
-from marshmallow import ValidationError
+from marshmallow import Schema, ValidationError
 
-from flask_app import app, db
+from flask_app import create_app, db
+from flask_app.config import TestingConfiguration
 from flask_app.serializers import user_reg_schema, post_create_schema, posts_list_schema, post_patch_schema, \
     comment_create_schema, comment_patch_schema
 from flask_app.models import User, Post, Comment
@@ -12,15 +12,16 @@ from flask_app.models import User, Post, Comment
 class BaseTestCase(TestCase):
 
     def setUp(self):
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'test.db')
-        self.client = app.test_client()
+        self.app = create_app(TestingConfiguration)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
         db.create_all()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
 
 class UserRegistrationSerializerTestCase(BaseTestCase):
@@ -91,6 +92,27 @@ class UserRegistrationSerializerTestCase(BaseTestCase):
         with self.assertRaises(ValidationError):
             user_reg_schema.load(load_data)
 
+    def test_load_not_unique_email_and_username(self):
+        user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        user.hash_password('1q2w3e')
+        db.session.add(user)
+        db.session.commit()
+
+        load_data = {
+            'email': 't@t.com',
+            'username': 'user1',
+            'password': 'testpass'
+        }
+        with self.assertRaises(ValidationError) as context:
+            user_reg_schema.load(load_data)
+        self.assertEqual(
+            {'email': ['email already exists'], 'username': ['name already exists']},
+            context.exception.messages
+        )
+
     def test_load_not_valid_username(self):
         load_data = {
             'email': 'email@test.com',
@@ -159,6 +181,7 @@ class PostsListSerializerTestCase(BaseTestCase):
                 'title': 'Title 1',
                 'content': 'Content 1',
                 'publication_datetime': post1.publication_datetime.strftime('%d-%m-%Y %H:%M:%S'),
+                'view_count': 0,
                 'comments': []
             },
             {
@@ -167,6 +190,7 @@ class PostsListSerializerTestCase(BaseTestCase):
                 'title': 'Title 2',
                 'content': 'Content 2',
                 'publication_datetime': post2.publication_datetime.strftime('%d-%m-%Y %H:%M:%S'),
+                'view_count': 0,
                 'comments': []
             }
         ]
@@ -247,6 +271,7 @@ class PostCreateUpdateSerializerTestCase(BaseTestCase):
             'title': 'Title 1',
             'content': 'Content 1',
             'publication_datetime': post1.publication_datetime.strftime('%d-%m-%Y %H:%M:%S'),
+            'view_count': 0,
             'comments': [
                 {
                     'id': comment1.id,
@@ -410,3 +435,52 @@ class CommentPartialUpdateSerializerTestCase(BaseTestCase):
         }
         with self.assertRaises(ValidationError):
             comment_patch_schema.load(load_data)
+
+
+class CompiledLoaderParityTestCase(TestCase):
+    """Предкомпилированная загрузка возвращает те же данные и ошибки, что и marshmallow"""
+
+    cases = [
+        # Данные из тестов сериализаторов постов и комментариев
+        {'title': 'Title', 'content': 'Content'},
+        {'id': 1, 'title': 'Title', 'content': 'Content'},
+        {'title': 'Title'},
+        {'title': '', 'content': 'Content'},
+        {'title': 'Title', 'content': ''},
+        {'id': 1, 'title': 'Title'},
+        {'title': ''},
+        {'content': ''},
+        # Граничные случаи
+        {},
+        {'title': 'x' * 255, 'content': 'Content'},
+        {'title': 'x' * 256, 'content': 'Content'},
+        {'title': None, 'content': 'Content'},
+        {'title': 1, 'content': ['Content']},
+        {'title': b'Title', 'content': b'\xff'},
+        {'id': 1, 'author_id': 2},
+        {'author_id': 2, 'title': '', 'content': None},
+        [],
+        'Title',
+        None,
+    ]
+
+    @staticmethod
+    def _result(load, data):
+        try:
+            return 'data', list(load(data).items())
+        except ValidationError as err:
+            return 'errors', list(err.messages.items()), list(err.valid_data.items())
+
+    def test_parity(self):
+        for schema in (post_create_schema, post_patch_schema, comment_create_schema, comment_patch_schema):
+            self.assertIsNotNone(schema._compiled_loader)
+            for data in self.cases:
+                with self.subTest(schema=type(schema).__name__, partial=schema.partial, data=data):
+                    self.assertEqual(
+                        self._result(lambda value: Schema.load(schema, value), data),
+                        self._result(schema._compiled_loader.load, data),
+                    )
+
+    def test_not_compiled(self):
+        self.assertIsNone(posts_list_schema._compiled_loader)
+        self.assertFalse(hasattr(user_reg_schema, '_compiled_loader'))
@@ -1,13 +1,28 @@
-import os
+import datetime
+import json
+import threading
 from unittest import TestCase
 from unittest.mock import Mock
 
 from marshmallow import ValidationError
+from sqlalchemy import event
 
-from flask_app import db, app
+from flask_app import create_app, db
+from flask_app.config import TestingConfiguration
 from flask_app.api.mixins import DataHandlerMixin
-from flask_app.models import User, Post, Comment
+from flask_app.api.resolvers import Archived, NotFound, Forbidden, post_exists, resolve_comment, resolve_post
+from flask_app.archive import archive_posts, rehydrate_post
+from flask_app.authors import AuthorCache
+from flask_app.availability import BloomFilter
+from flask_app.changes import changes_horizon, compact_changes
+from flask_app.counters import ViewCounter
+from flask_app.models import User, Post, Comment, Change, PostArchive, CommentArchive, publication_now
+from flask_app.post_cache import PostCache
+from flask_app.purge import purge_deleted_posts
+from flask_app.repository import PostsPage, _compiled_cache, active_post, post_rows, post_with_owner, user_by_username
+from flask_app.fragments import rebuild_fragments
 from flask_app.serializers import post_create_schema
+from flask_app.warmup import open_connections, readiness, warm_up
 
 
 def raise_validation_error(_data):
@@ -17,15 +32,16 @@ def raise_validation_error(_data):
 class BaseTestCase(TestCase):
 
     def setUp(self):
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'test.db')
-        self.client = app.test_client()
+        self.app = create_app(TestingConfiguration)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
         db.create_all()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
 
 class RequestDataHandlerTestCase(BaseTestCase):
@@ -63,25 +79,45 @@ class RequestDataHandlerTestCase(BaseTestCase):
         self.assertEqual(['validation error'], message)
 
 
-class CheckDataTestCase(BaseTestCase):
+class CompactChangesTestCase(BaseTestCase):
 
-    def test_existing_single_data_without_owner_check(self):
-        user = User(
-            email='t@t.com',
-            username='user1'
-        )
-        user.hash_password('1q2w3e')
-        db.session.add(user)
+    def add_change(self, entity, entity_id, post_id, operation, days_ago):
+        change = Change(entity=entity, entity_id=entity_id, post_id=post_id, operation=operation,
+                        data=None if operation == 'delete' else '{}',
+                        created_at=datetime.datetime.utcnow() - datetime.timedelta(days=days_ago))
+        db.session.add(change)
         db.session.commit()
+        return change.id
+
+    def test_compact(self):
+        superseded = self.add_change('post', 1, 1, 'create', 10)
+        latest = self.add_change('post', 1, 1, 'update', 10)
+        deleted_post_comment = self.add_change('comment', 1, 2, 'create', 10)
+        tombstone = self.add_change('post', 2, 2, 'delete', 10)
+        recent_superseded = self.add_change('post', 3, 3, 'create', 0)
+        self.add_change('post', 3, 3, 'update', 0)
+
+        deleted = compact_changes(datetime.timedelta(days=1))
+
+        self.assertEqual(3, deleted)
+        remaining = [change.id for change in Change.query.order_by(Change.id)]
+        self.assertNotIn(superseded, remaining)
+        self.assertNotIn(deleted_post_comment, remaining)
+        self.assertNotIn(tombstone, remaining)
+        self.assertIn(latest, remaining)
+        self.assertIn(recent_superseded, remaining)
+        self.assertEqual(tombstone, changes_horizon())
+
+    def test_compact_without_tombstones(self):
+        self.add_change('post', 1, 1, 'create', 10)
+
+        self.assertEqual(0, compact_changes(datetime.timedelta(days=1)))
+        self.assertEqual(0, changes_horizon())
 
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
-        db.session.commit()
 
-        not_found = DataHandlerMixin._check_data(post=post1)
-        self.assertIsNone(not_found)
+class PurgeDeletedPostsTestCase(BaseTestCase):
 
-    def test_existing_single_data_with_owner_check_from_owner(self):
+    def test_purge(self):
         user = User(
             email='t@t.com',
             username='user1'
@@ -91,80 +127,221 @@ class CheckDataTestCase(BaseTestCase):
         db.session.commit()
 
         post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        post2 = Post(author_id=user.id, title='Title 2', content='Content 2', deleted_at=datetime.datetime.utcnow())
+        db.session.add_all([post1, post2])
         db.session.commit()
 
-        not_found_or_not_owner = DataHandlerMixin._check_data('post', user, post=post1)
-        self.assertIsNone(not_found_or_not_owner)
+        for post in (post1, post2):
+            for i in range(3):
+                db.session.add(Comment(author_id=user.id, post_id=post.id,
+                                       title=f'Comment Title {i}', content=f'Comment Content {i}'))
+        db.session.commit()
+        post1_id = post1.id
 
-    def test_existing_single_data_with_owner_check_from_not_owner(self):
-        user = User(
+        self.assertEqual((1, 3), purge_deleted_posts(batch_size=2))
+        self.assertEqual([post1_id], [post.id for post in Post.query])
+        self.assertEqual(3, Comment.query.count())
+        self.assertEqual((0, 0), purge_deleted_posts(batch_size=2))
+
+
+class ArchivePostsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(
             email='t@t.com',
             username='user1'
         )
-        user.hash_password('1q2w3e')
-        user2 = User(
-            email='t@t2.com',
-            username='user2'
-        )
-        user2.hash_password('1q2w3e')
-        db.session.add_all([user, user2])
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=400)
+        self.old_posts = [
+            Post(author_id=self.user.id, title=f'Old {i}', content='Content', publication_datetime=old)
+            for i in range(3)
+        ]
+        self.new_post = Post(author_id=self.user.id, title='New', content='Content')
+        self.deleted_post = Post(author_id=self.user.id, title='Deleted', content='Content',
+                                 publication_datetime=old, deleted_at=datetime.datetime.utcnow())
+        db.session.add_all(self.old_posts + [self.new_post, self.deleted_post])
+        db.session.commit()
+        for post in self.old_posts:
+            db.session.add(Comment(author_id=self.user.id, post_id=post.id, title='Comment', content='Content'))
+        db.session.commit()
+        self.old_ids = [post.id for post in self.old_posts]
+        self.new_id = self.new_post.id
+
+    def test_archive(self):
+        self.assertEqual(3, archive_posts(datetime.timedelta(days=365), batch_size=2))
+        self.assertEqual(self.old_ids, [post.id for post in PostArchive.query.order_by(PostArchive.id)])
+        self.assertEqual(3, CommentArchive.query.count())
+        self.assertTrue(all(post.archived_at for post in PostArchive.query))
+        self.assertEqual({self.new_id, self.deleted_post.id}, {post.id for post in Post.query})
+        self.assertEqual(0, Comment.query.count())
+        self.assertEqual(0, archive_posts(datetime.timedelta(days=365), batch_size=2))
+
+    def test_rehydrate(self):
+        archive_posts(datetime.timedelta(days=365), batch_size=10)
+        post_id = self.old_ids[0]
+
+        self.assertTrue(rehydrate_post(post_id))
+        db.session.commit()
+        post = Post.query.get(post_id)
+        self.assertEqual('Old 0', post.title)
+        self.assertEqual(1, post.comments.count())
+        self.assertIsNone(PostArchive.query.get(post_id))
+        self.assertEqual(2, CommentArchive.query.count())
+        self.assertFalse(rehydrate_post(100))
+
+    def test_write_policy(self):
+        archive_posts(datetime.timedelta(days=365), batch_size=10)
+        post_id = self.old_ids[0]
+
+        self.app.config['ARCHIVE_WRITE_POLICY'] = 'reject'
+        post, archived = resolve_post(post_id, self.user)
+        self.assertIsNone(post)
+        self.assertIsInstance(archived, Archived)
+        self.assertEqual(({'message': 'post is archived'}, 409), archived.response)
+        self.assertIsInstance(post_exists(post_id, for_write=True), Archived)
+        self.assertIsInstance(post_exists(post_id), NotFound)
+        self.assertIsInstance(post_exists(100, for_write=True), NotFound)
+
+        self.app.config['ARCHIVE_WRITE_POLICY'] = 'rehydrate'
+        comment_id = CommentArchive.query.filter_by(post_id=post_id).first().id
+        comment, failure = resolve_comment(post_id, comment_id, self.user)
+        self.assertIsNone(failure)
+        self.assertEqual(comment_id, comment.id)
+        self.assertIsNone(PostArchive.query.get(post_id))
+
+    def test_non_owner_does_not_rehydrate(self):
+        archive_posts(datetime.timedelta(days=365), batch_size=10)
+        post_id = self.old_ids[0]
+        comment_id = CommentArchive.query.filter_by(post_id=post_id).first().id
+        other = User(email='o@t.com', username='user2')
+        other.hash_password('1q2w3e')
+        db.session.add(other)
         db.session.commit()
 
-        post1 = Post(author_id=user2.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        self.assertIsInstance(resolve_post(post_id, other)[1], Forbidden)
+        self.assertIsInstance(resolve_comment(post_id, comment_id, other)[1], Forbidden)
+        self.assertIsInstance(resolve_comment(post_id, 1000, other)[1], NotFound)
+        self.assertIsInstance(resolve_post(1000, other)[1], NotFound)
+        self.assertFalse([statement for statement in statements if not statement.lstrip().startswith('SELECT')])
+        self.assertIsNotNone(PostArchive.query.get(post_id))
+
+    def test_archive_uses_publication_clock(self):
+        # Пост опубликован по часовому поясу публикации ровно ARCHIVE_AFTER_DAYS дней назад
+        post = Post(author_id=self.user.id, title='Boundary', content='Content',
+                    publication_datetime=publication_now() - datetime.timedelta(days=365, minutes=1))
+        db.session.add(post)
         db.session.commit()
+        post_id = post.id
+        archive_posts(datetime.timedelta(days=365), batch_size=10)
+        self.assertIsNotNone(PostArchive.query.get(post_id))
 
-        not_found_or_not_owner = DataHandlerMixin._check_data('post', user, post=post1)
-        self.assertEqual({'message': 'you cannot edit this post'}, not_found_or_not_owner[0])
-        self.assertEqual(403, not_found_or_not_owner[1])
 
-    def test_not_existing_single_data_without_owner_check(self):
-        post1 = None
+class AuthorCacheTestCase(TestCase):
 
-        not_found = DataHandlerMixin._check_data(post=post1)
-        self.assertEqual({'message': 'post not found'}, not_found[0])
-        self.assertEqual(404, not_found[1])
+    def test_expiration(self):
+        cache = AuthorCache()
+        cache.set_many({1: 'user1', 2: 'user2'}, ttl=10, max_size=100, now=100)
+        self.assertEqual(({1: 'user1'}, [3]), cache.get_many([1, 3], now=105))
+        self.assertEqual(({}, [1, 2]), cache.get_many([1, 2], now=110))
 
-    def test_not_existing_single_data_with_owner_check(self):
-        user = User(
-            email='t@t.com',
-            username='user1'
-        )
-        user.hash_password('1q2w3e')
-        db.session.add(user)
-        db.session.commit()
+    def test_max_size(self):
+        cache = AuthorCache()
+        cache.set_many({1: 'user1'}, ttl=10, max_size=2, now=100)
+        cache.set_many({2: 'user2'}, ttl=100, max_size=2, now=100)
+        # Устаревшая запись удаляется, действующая сохраняется
+        cache.set_many({3: 'user3'}, ttl=10, max_size=2, now=150)
+        self.assertEqual(({2: 'user2', 3: 'user3'}, [1]), cache.get_many([1, 2, 3], now=150))
+        # Все записи действуют - кэш очищается
+        cache.set_many({4: 'user4'}, ttl=10, max_size=2, now=150)
+        self.assertEqual(({4: 'user4'}, [2, 3]), cache.get_many([2, 3, 4], now=150))
 
-        post1 = None
 
-        not_found_or_not_owner = DataHandlerMixin._check_data('post', user, post=post1)
-        self.assertEqual({'message': 'post not found'}, not_found_or_not_owner[0])
-        self.assertEqual(404, not_found_or_not_owner[1])
+class BloomFilterTestCase(TestCase):
 
-    def test_existing_data_without_owner_check(self):
-        user = User(
-            email='t@t.com',
-            username='user1'
-        )
-        user.hash_password('1q2w3e')
-        db.session.add(user)
-        db.session.commit()
+    def test_membership(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f'username:user{i}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
 
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
-        db.session.commit()
+        false_positives = sum(f'username:other{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
 
-        comment1 = Comment(author_id=user.id,
-                           post_id=post1.id,
-                           title='Comment Title 1',
-                           content='Comment Content 1')
-        db.session.add(comment1)
-        db.session.commit()
 
-        not_found = DataHandlerMixin._check_data(post=post1, comment=comment1)
-        self.assertIsNone(not_found)
+class PostCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = PostCache()
+
+    def test_single_flight(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return '{"id":1}'
+
+        results = []
+
+        def get():
+            with self.app.app_context():
+                results.append(self.cache.get(1, loader))
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['{"id":1}'] * 5, results)
 
-    def test_existing_data_with_owner_check_from_owner(self):
+    def test_negative_ttl(self):
+        self.app.config['POSTS_NEGATIVE_CACHE_TTL'] = 0
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return None
+
+        self.assertIsNone(self.cache.get(1, loader))
+        self.assertIsNone(self.cache.get(1, loader))
+        self.assertEqual(2, len(calls))
+
+    def test_failed_load_not_cached(self):
+        def failing():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get(1, failing)
+        self.assertEqual('{}', self.cache.get(1, lambda: '{}'))
+
+    def test_invalidated_during_load(self):
+        def loader():
+            self.cache.invalidate(1)
+            return 'stale'
+
+        self.assertEqual('stale', self.cache.get(1, loader))
+        self.assertEqual('fresh', self.cache.get(1, lambda: 'fresh'))
+
+
+class ViewCounterTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
         user = User(
             email='t@t.com',
             username='user1'
@@ -172,70 +349,209 @@ class CheckDataTestCase(BaseTestCase):
         user.hash_password('1q2w3e')
         db.session.add(user)
         db.session.commit()
-
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        self.posts = [Post(author_id=user.id, title=f'Title {i}', content='Content') for i in range(3)]
+        db.session.add_all(self.posts)
         db.session.commit()
+        self.post_ids = [post.id for post in self.posts]
+        self.counter = ViewCounter()
 
-        comment1 = Comment(author_id=user.id,
-                           post_id=post1.id,
-                           title='Comment Title 1',
-                           content='Comment Content 1')
-        db.session.add(comment1)
-        db.session.commit()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
 
-        not_found_or_not_owner = DataHandlerMixin._check_data('comment', user, post=post1, comment=comment1)
-        self.assertIsNone(not_found_or_not_owner)
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
 
-    def test_existing_data_with_owner_check_from_not_owner(self):
-        user = User(
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def view_counts(self):
+        return [count for count, in db.session.query(Post.view_count).order_by(Post.id)]
+
+    def test_flush(self):
+        first, second, third = self.post_ids
+        for post_id in (first, first, third, first):
+            self.counter.increment(post_id)
+        self.assertEqual({first: 3, third: 1}, self.counter.pending)
+        self.assertEqual([0, 0, 0], self.view_counts())
+
+        self.assertEqual(2, self.counter.flush())
+        self.assertEqual({}, self.counter.pending)
+        # По одному пакетному UPDATE для основной и архивной таблиц
+        self.assertEqual(2, len([statement for statement in self.statements if 'UPDATE' in statement]))
+        self.assertEqual([3, 0, 1], self.view_counts())
+
+        self.counter.increment(first)
+        self.counter.flush()
+        self.assertEqual([4, 0, 1], self.view_counts())
+        self.assertEqual(0, self.counter.flush())
+
+    def test_archived_post(self):
+        archive_posts(datetime.timedelta(days=-1), batch_size=10)
+        self.counter.increment(self.post_ids[0])
+        self.counter.flush()
+        self.assertEqual(1, PostArchive.query.get(self.post_ids[0]).view_count)
+
+
+class ResolversTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(
             email='t@t.com',
             username='user1'
         )
-        user.hash_password('1q2w3e')
-        user2 = User(
+        self.user.hash_password('1q2w3e')
+        self.user2 = User(
             email='t@t2.com',
             username='user2'
         )
-        user2.hash_password('1q2w3e')
-        db.session.add_all([user, user2])
+        self.user2.hash_password('1q2w3e')
+        db.session.add_all([self.user, self.user2])
         db.session.commit()
 
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        self.post = Post(author_id=self.user.id, title='Title 1', content='Content 1')
+        db.session.add(self.post)
         db.session.commit()
 
-        comment1 = Comment(author_id=user2.id,
-                           post_id=post1.id,
-                           title='Comment Title 1',
-                           content='Comment Content 1')
-        db.session.add(comment1)
+        self.comment = Comment(author_id=self.user2.id,
+                               post_id=self.post.id,
+                               title='Comment Title 1',
+                               content='Comment Content 1')
+        db.session.add(self.comment)
         db.session.commit()
 
-        not_found_or_not_owner = DataHandlerMixin._check_data('comment', user, post=post1, comment=comment1)
-        self.assertEqual({'message': 'you cannot edit this comment'}, not_found_or_not_owner[0])
-        self.assertEqual(403, not_found_or_not_owner[1])
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
 
-    def test_not_existing_data_without_owner_check(self):
-        user = User(
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_resolve_post(self):
+        self.assertEqual((self.post, None), resolve_post(self.post.id))
+        self.assertEqual((self.post, None), resolve_post(self.post.id, self.user))
+
+    def test_resolve_post_not_found(self):
+        post, not_found = resolve_post(100, self.user)
+        self.assertIsNone(post)
+        self.assertIsInstance(not_found, NotFound)
+        self.assertEqual(({'message': 'post not found'}, 404), not_found.response)
+
+    def test_resolve_post_not_owner(self):
+        post, not_owner = resolve_post(self.post.id, self.user2)
+        self.assertIsNone(post)
+        self.assertIsInstance(not_owner, Forbidden)
+        self.assertEqual(({'message': 'you cannot edit this post'}, 403), not_owner.response)
+
+    def test_post_exists(self):
+        self.assertIsNone(post_exists(self.post.id))
+        self.assertIsInstance(post_exists(100), NotFound)
+
+    def test_resolve_comment_single_query(self):
+        post_id, comment_id, user2 = self.post.id, self.comment.id, self.user2
+        self.assertIsNotNone(user2.id)
+        self.statements.clear()
+
+        comment, error = resolve_comment(post_id, comment_id, user2)
+        self.assertEqual(1, len(self.statements))
+        self.assertIsNone(error)
+        self.assertEqual(self.comment, comment)
+
+    def test_resolve_comment_not_found(self):
+        self.assertEqual(({'message': 'post not found'}, 404),
+                         resolve_comment(100, self.comment.id, self.user2)[1].response)
+        self.assertEqual(({'message': 'comment not found'}, 404),
+                         resolve_comment(self.post.id, 100, self.user2)[1].response)
+
+    def test_resolve_comment_not_owner(self):
+        comment, not_owner = resolve_comment(self.post.id, self.comment.id, self.user)
+        self.assertIsNone(comment)
+        self.assertEqual(({'message': 'you cannot edit this comment'}, 403), not_owner.response)
+
+
+class RepositoryTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(
             email='t@t.com',
             username='user1'
         )
-        user.hash_password('1q2w3e')
-        db.session.add(user)
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
         db.session.commit()
-
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        now = datetime.datetime(2021, 1, 1)
+        self.posts = [
+            Post(author_id=self.user.id, title=f'Title {i}', content=f'Content {i}',
+                 publication_datetime=now + datetime.timedelta(days=i))
+            for i in range(3)
+        ]
+        self.posts[0].deleted_at = now
+        db.session.add_all(self.posts)
         db.session.commit()
+        self.post_ids = [post.id for post in self.posts]
+
+    def test_statement_compiled_once(self):
+        _compiled_cache.clear()
+        for count in range(1, 4):
+            rows = post_rows(self.post_ids[:count], active_only=False).fetchall()
+            self.assertEqual(count, len(rows))
+        self.assertEqual(1, len(_compiled_cache))
+        rows = post_rows(self.post_ids, preview=3).fetchall()
+        self.assertEqual(['Con', 'Con'], [row.content for row in rows])
+        self.assertEqual(2, len(_compiled_cache))
+
+    def test_baked_queries(self):
+        self.assertIsNone(active_post(self.post_ids[0]))
+        self.assertEqual(self.post_ids[1], active_post(self.post_ids[1]).id)
+        post, is_owner = post_with_owner(self.post_ids[2], self.user.id)
+        self.assertTrue(is_owner)
+        self.assertFalse(post_with_owner(self.post_ids[2], self.user.id + 1)[1])
+        self.assertEqual(self.user.id, user_by_username('user1').id)
+        self.assertIsNone(user_by_username('user2'))
+
+    def test_posts_page(self):
+        page = PostsPage().paginate(page=1, per_page=1)
+        self.assertEqual(2, page.total)
+        self.assertEqual([self.post_ids[2]], [row.id for row in page.items])
+        self.assertTrue(page.has_next)
+        page = PostsPage().paginate(page=2, per_page=1)
+        self.assertEqual([self.post_ids[1]], [row.id for row in page.items])
+        self.assertFalse(page.has_next)
+        self.assertEqual([], PostsPage().paginate(page=5, per_page=1).items)
+        page = PostsPage(from_fragments=True).paginate(page=1, per_page=10)
+        self.assertEqual(2, page.total)
+        self.assertEqual(('id', 'rendered', 'view_count'), tuple(page.items[0].keys()))
+
+
+class WarmUpTestCase(BaseTestCase):
 
-        comment1 = None
+    def tearDown(self):
+        readiness.reset()
+        super().tearDown()
 
-        not_found = DataHandlerMixin._check_data(post=post1, comment=comment1)
-        self.assertEqual({'message': 'comment not found'}, not_found[0])
-        self.assertEqual(404, not_found[1])
+    def test_warm_up(self):
+        readiness.reset()
+        _compiled_cache.clear()
+        warm_up()
+        self.assertTrue(readiness.ready)
+        compiled = len(_compiled_cache)
+        self.assertGreater(compiled, 0)
+        post_rows([1, 2]).fetchall()
+        self.assertEqual(compiled, len(_compiled_cache))
 
-    def test_not_existing_data_with_owner_check(self):
+    def test_open_connections(self):
+        self.app.config['WARMUP_CONNECTIONS'] = 3
+        self.assertEqual(3, open_connections())
+
+
+class RebuildFragmentsTestCase(BaseTestCase):
+
+    def test_rebuild(self):
         user = User(
             email='t@t.com',
             username='user1'
@@ -244,12 +560,14 @@ class CheckDataTestCase(BaseTestCase):
         db.session.add(user)
         db.session.commit()
 
-        post1 = Post(author_id=user.id, title='Title 1', content='Content 1')
-        db.session.add(post1)
+        posts = [Post(author_id=user.id, title=f'Title {i}', content=f'Content {i}') for i in range(3)]
+        db.session.add_all(posts)
+        db.session.commit()
+        db.session.add(Comment(author_id=user.id, post_id=posts[0].id, title='Comment Title', content='Content'))
         db.session.commit()
 
-        comment1 = None
-
-        not_found_or_not_owner = DataHandlerMixin._check_data('comment', user, post=post1, comment=comment1)
-        self.assertEqual({'message': 'comment not found'}, not_found_or_not_owner[0])
-        self.assertEqual(404, not_found_or_not_owner[1])
+        self.assertEqual((3, 1), rebuild_fragments(batch_size=2))
+        for post in Post.query:
+            self.assertEqual(post_create_schema.dump(post)['title'], json.loads(post.rendered)['title'])
+            self.assertNotIn('comments', json.loads(post.rendered))
+        self.assertIsNotNone(Comment.query.first().rendered)
@@ -0,0 +1,285 @@
+import base64
+import multiprocessing
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from flask_app import create_app, db
+from flask_app.availability import user_filter
+from flask_app.config import TestingConfiguration
+from flask_app.models import Post, User
+from flask_app.post_cache import post_cache
+from flask_app.shared_cache import MISS, POSTS, USERS, SharedCache, _caches, current_cache
+
+
+def set_in_child(path, key, value):
+    cache = SharedCache(path, slots=16, slot_size=256, ways=4)
+    cache.set('test', key, value, 60)
+    cache.close()
+
+
+class SharedCacheTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.cache')
+        os.close(fd)
+        self.cache = SharedCache(self.path, slots=16, slot_size=256, ways=4)
+
+    def tearDown(self):
+        self.cache.close()
+        os.remove(self.path)
+
+    def test_get_set(self):
+        self.assertIs(MISS, self.cache.get('test', 1))
+        self.assertTrue(self.cache.set('test', 1, b'value', 60))
+        self.assertEqual(b'value', self.cache.get('test', 1))
+        self.assertTrue(self.cache.set('test', 1, None, 60))
+        self.assertIsNone(self.cache.get('test', 1))
+        self.assertIs(MISS, self.cache.get('other', 1))
+
+    def test_expired(self):
+        self.cache.set('test', 1, b'value', -1)
+        self.assertIs(MISS, self.cache.get('test', 1))
+
+    def test_too_large(self):
+        self.assertFalse(self.cache.set('test', 1, b'x' * 256, 60))
+        self.assertIs(MISS, self.cache.get('test', 1))
+
+    def test_delete_invalidates_token(self):
+        self.cache.set('test', 1, b'old', 60)
+        token = self.cache.token('test', 1)
+        self.cache.delete('test', 1)
+        self.assertIs(MISS, self.cache.get('test', 1))
+        self.assertFalse(self.cache.set('test', 1, b'stale', 60, token))
+        self.assertTrue(self.cache.set('test', 1, b'new', 60, self.cache.token('test', 1)))
+        self.assertEqual(b'new', self.cache.get('test', 1))
+
+    def test_invalidate_namespace(self):
+        self.cache.set('a', 1, b'a', 60)
+        self.cache.set('b', 1, b'b', 60)
+        self.cache.invalidate_namespace('a')
+        self.assertIs(MISS, self.cache.get('a', 1))
+        self.assertEqual(b'b', self.cache.get('b', 1))
+
+    def test_lease(self):
+        self.cache.set('test', 1, b'value', 60)
+        token = self.cache.token('test', 1)
+        self.assertTrue(self.cache.lease('test', 1, 60))
+        self.assertFalse(self.cache.lease('test', 1, 60))
+        self.assertTrue(self.cache.leased('test', 1))
+        self.assertFalse(self.cache.leased('test', 2))
+        self.cache.release('test', 1)
+        self.assertFalse(self.cache.leased('test', 1))
+        # Аренда не относится к значению ключа и не изменяет его версию
+        self.assertEqual(b'value', self.cache.get('test', 1))
+        self.assertTrue(self.cache.set('test', 1, b'new', 60, token))
+
+    def test_lease_expired(self):
+        self.assertTrue(self.cache.lease('test', 1, -1))
+        self.assertFalse(self.cache.leased('test', 1))
+        self.assertTrue(self.cache.lease('test', 1, 60))
+
+    def test_generation(self):
+        generation = self.cache.generation('test')
+        self.cache.invalidate_namespace('test')
+        self.assertEqual(generation + 1, self.cache.generation('test'))
+
+    def test_clock_eviction(self):
+        cache = SharedCache(self.path + '.single', slots=4, slot_size=256, ways=4)
+        try:
+            for key in range(4):
+                cache.set('test', key, b'value', 60)
+            cache.get('test', 0)
+            cache.set('test', 4, b'value', 60)
+            # Прочитанная запись получает второй шанс, вытесняется следующая
+            self.assertEqual(b'value', cache.get('test', 0))
+            self.assertIs(MISS, cache.get('test', 1))
+            self.assertEqual(b'value', cache.get('test', 4))
+        finally:
+            cache.close()
+            os.remove(self.path + '.single')
+
+    def test_shared_between_processes(self):
+        process = multiprocessing.get_context('fork').Process(target=set_in_child, args=(self.path, 1, b'child'))
+        process.start()
+        process.join(10)
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual(b'child', self.cache.get('test', 1))
+
+    def test_reopen_keeps_entries(self):
+        self.cache.set('test', 1, b'value', 60)
+        reopened = SharedCache(self.path, slots=16, slot_size=256, ways=4)
+        try:
+            self.assertEqual(b'value', reopened.get('test', 1))
+        finally:
+            reopened.close()
+
+
+class BaseTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.cache')
+        os.close(fd)
+        self.app = create_app(TestingConfiguration)
+        self.app.config['SHARED_CACHE_PATH'] = self.path
+        self.app.config['SHARED_CACHE_SLOTS'] = 64
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        post_cache.clear()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(b"user1:1q2w3e").decode("utf-8")}
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_statement)
+        post_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        for cache in _caches.values():
+            cache.close()
+        _caches.clear()
+        os.remove(self.path)
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class SharedPostCacheTestCase(BaseTestCase):
+
+    def test_post_cached(self):
+        post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(post)
+        db.session.commit()
+        url = f'/api/v1/posts/{post.id}'
+
+        body = self.client.get(url).get_data()
+        self.assertEqual(body, bytes(current_cache().get(POSTS, post.id)))
+        self.client.patch(url, headers=self.headers, json={'title': 'New title'})
+        self.assertEqual('New title', self.client.get(url).get_json()['title'])
+
+    def test_post_loaded_by_lease_holder(self):
+        post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(post)
+        db.session.commit()
+        url = f'/api/v1/posts/{post.id}'
+        body = self.client.get(url).get_data()
+        post_cache.clear()
+
+        # Пост загружает другой воркер, взявший аренду: запрос ждет его в общем кэше
+        cache = current_cache()
+        self.assertTrue(cache.lease(POSTS, post.id, 60))
+
+        def load():
+            cache.set(POSTS, post.id, body, 60)
+            cache.release(POSTS, post.id)
+
+        timer = threading.Timer(0.05, load)
+        timer.start()
+        self.statements.clear()
+        try:
+            self.assertEqual(body, self.client.get(url).get_data())
+        finally:
+            timer.join()
+        self.assertFalse([statement for statement in self.statements if 'FROM post' in statement])
+
+    def test_post_loaded_after_lease_released(self):
+        post = Post(author_id=self.user.id, title='Title', content='Content')
+        db.session.add(post)
+        db.session.commit()
+        cache = current_cache()
+        self.assertTrue(cache.lease(POSTS, post.id, 60))
+        # Другой воркер освободил аренду, не сохранив пост
+        timer = threading.Timer(0.05, cache.release, (POSTS, post.id))
+        timer.start()
+        try:
+            self.assertEqual('Title', self.client.get(f'/api/v1/posts/{post.id}').get_json()['title'])
+        finally:
+            timer.join()
+        self.assertFalse(cache.leased(POSTS, post.id))
+
+    def test_page_cached(self):
+        self.assertEqual({'message': 'There is no posts'}, self.client.get('/api/v1/posts').get_json())
+        self.client.post('/api/v1/posts', headers=self.headers, json={'title': 'Title', 'content': 'Content'})
+
+        first = self.client.get('/api/v1/posts').get_data()
+        queries = len(self.statements)
+        self.assertEqual(first, self.client.get('/api/v1/posts').get_data())
+        self.assertEqual(queries, len(self.statements))
+
+        self.client.post('/api/v1/posts', headers=self.headers, json={'title': 'Title 2', 'content': 'Content'})
+        self.assertEqual(2, len(self.client.get('/api/v1/posts').get_json()['data']))
+
+    def test_auth_cached(self):
+        with patch.object(User, 'verify_password', autospec=True, side_effect=User.verify_password) as verify:
+            for _ in range(2):
+                response = self.client.post('/api/v1/posts', headers=self.headers,
+                                            json={'title': 'Title', 'content': 'Content'})
+                self.assertEqual(201, response.status_code)
+            self.assertEqual(1, verify.call_count)
+
+            wrong = {'Authorization': 'Basic ' + base64.b64encode(b"user1:wrong").decode("utf-8")}
+            for _ in range(2):
+                response = self.client.post('/api/v1/posts', headers=wrong, json={'title': 'T', 'content': 'C'})
+                self.assertEqual(401, response.status_code)
+            self.assertEqual(3, verify.call_count)
+
+
+class SharedAvailabilityTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user_filter.reset()
+        user_filter.warm()
+        self.statements.clear()
+
+    def tearDown(self):
+        user_filter.reset()
+        super().tearDown()
+
+    def _check(self, query):
+        return self.client.get(f'/api/v1/registration/availability?{query}').get_json()
+
+    def _user_queries(self):
+        return [statement for statement in self.statements if 'FROM user' in statement]
+
+    def test_free_values_without_queries(self):
+        self.assertEqual({'username': True, 'email': True}, self._check('username=new_user&email=new@t.com'))
+        self.assertEqual([], self._user_queries())
+        self.assertEqual({'username': False}, self._check('username=user1'))
+        self.assertEqual(1, len(self._user_queries()))
+
+    def test_user_registered_by_other_worker(self):
+        # Пользователь зарегистрирован другим воркером: он не добавлен в фильтр, метка регистраций увеличена
+        user = User(email='other@t.com', username='other_user')
+        user.hash_password('password')
+        db.session.add(user)
+        db.session.commit()
+        current_cache().invalidate_namespace(USERS)
+
+        self.assertEqual({'username': False, 'email': False}, self._check('username=other_user&email=other@t.com'))
+        # После дополнения фильтра свободные значения снова проверяются без запросов
+        self.statements.clear()
+        self.assertEqual({'username': True}, self._check('username=new_user'))
+        self.assertEqual([], self._user_queries())
+
+    def test_registration_moves_stamp(self):
+        post_data = {'email': 'new@t.com', 'username': 'new_user', 'password': 'password'}
+        self.assertEqual(201, self.client.post('/api/v1/registration', json=post_data).status_code)
+        self.assertTrue(user_filter.behind())
+        self.assertEqual({'username': False, 'email': False}, self._check('username=new_user&email=new@t.com'))
@@ -0,0 +1,178 @@
+import base64
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask_app import create_app, db
+from flask_app.changes import CREATE, UPDATE, record_change
+from flask_app.config import TestingConfiguration
+from flask_app.models import Comment, Post, User
+from flask_app.post_cache import post_cache
+from flask_app.snapshots import _stores, day_posts, now, snapshot_store
+
+
+class BaseTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(TestingConfiguration)
+        self.app.config['SNAPSHOTS_DIR'] = self.directory
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        post_cache.clear()
+
+        self.user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        self.user.hash_password('1q2w3e')
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(b"user1:1q2w3e").decode("utf-8")}
+
+        self.day = (now() - datetime.timedelta(days=3)).date()
+        self.posts = [self._post(self.day, hour) for hour in (15, 10)]
+        self.store = snapshot_store()
+
+    def tearDown(self):
+        post_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        _stores.clear()
+        shutil.rmtree(self.directory)
+
+    def _post(self, day, hour):
+        post = Post(author_id=self.user.id, title=f'Title {hour}', content='Content',
+                    publication_datetime=datetime.datetime.combine(day, datetime.time(hour)))
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def _url(self, day):
+        return f'/api/v1/posts?date={day.isoformat()}'
+
+
+class SnapshotsTestCase(BaseTestCase):
+
+    def test_write_missing(self):
+        first = self.day - datetime.timedelta(days=2)
+        self._post(first, 12)
+        self._post(now().date(), 0)
+        written = self.store.write_missing()
+        # Снимки не формируются для дней без постов и незавершенных дней
+        self.assertEqual({first: 1, self.day: 2}, written)
+        self.assertFalse(self.store.exists(first + datetime.timedelta(days=1)))
+        self.assertEqual({}, self.store.write_missing())
+
+    def test_served_from_snapshot(self):
+        dynamic = self.client.get(self._url(self.day))
+        self.assertIsNone(dynamic.cache_control.max_age)
+        body = dynamic.get_json()
+        self.assertEqual(self.day.isoformat(), body['date'])
+        self.assertEqual([self.posts[1].id, self.posts[0].id], [post['id'] for post in body['data']])
+
+        self.store.write(self.day)
+        response = self.client.get(self._url(self.day))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(body, response.get_json())
+        self.assertEqual(60, response.cache_control.max_age)
+        self.assertTrue(response.cache_control.must_revalidate)
+        self.assertTrue(response.cache_control.public)
+        response.close()
+
+        response = self.client.get(self._url(self.day), headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(304, response.status_code)
+        response.close()
+
+        response = self.client.get(self._url(self.day), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(body, json.loads(gzip.decompress(response.get_data())))
+        response.close()
+
+    def test_not_sealed_day(self):
+        today = now().date()
+        self._post(today, 0)
+        self.store.write(today)
+        response = self.client.get(self._url(today))
+        self.assertIsNone(response.cache_control.max_age)
+        self.assertEqual(1, len(response.get_json()['data']))
+
+    def test_invalid_date(self):
+        response = self.client.get('/api/v1/posts?date=yesterday')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'message': 'date must be in YYYY-MM-DD format'}, response.get_json())
+
+    def test_invalidated_by_late_edit(self):
+        self.store.write(self.day)
+        other_day = self.day - datetime.timedelta(days=1)
+        self.store.write(other_day)
+        post_id = self.posts[0].id
+
+        response = self.client.post(f'/api/v1/posts/{post_id}/comments', headers=self.headers,
+                                    json={'title': 'Late', 'content': 'Comment'})
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(self.store.exists(self.day))
+        self.assertFalse(os.path.exists(self.store.path(self.day) + '.gz'))
+        self.assertTrue(self.store.exists(other_day))
+
+        posts = self.client.get(self._url(self.day)).get_json()['data']
+        self.assertEqual(['Late'], [comment['title'] for comment in posts[1]['comments']])
+        self.assertEqual(2, self.store.write_missing()[self.day])
+        response = self.client.get(self._url(self.day))
+        self.assertEqual(posts, response.get_json()['data'])
+        response.close()
+
+    def test_etag_changes_after_rewrite(self):
+        self.store.write(self.day)
+        response = self.client.get(self._url(self.day))
+        etag = response.headers['ETag']
+        response.close()
+
+        self.client.patch(f'/api/v1/posts/{self.posts[0].id}', headers=self.headers, json={'title': 'Late'})
+        self.store.write_missing()
+        response = self.client.get(self._url(self.day), headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+        response.close()
+
+    def test_invalidated_on_commit(self):
+        self.store.write(self.day)
+        # Сброс кэша постов не затрагивает снимки
+        post_cache.invalidate(self.posts[0].id)
+        self.assertTrue(self.store.exists(self.day))
+
+        self.posts[0].title = 'Changed'
+        record_change(UPDATE, self.posts[0])
+        db.session.flush()
+        self.assertTrue(self.store.exists(self.day))
+        db.session.rollback()
+        self.assertTrue(self.store.exists(self.day))
+
+        self.posts[0].title = 'Changed'
+        record_change(UPDATE, self.posts[0])
+        db.session.commit()
+        self.assertFalse(self.store.exists(self.day))
+
+    def test_changed_while_writing(self):
+        comment = Comment(post_id=self.posts[0].id, author_id=self.user.id, title='C', content='C')
+        db.session.add(comment)
+        db.session.commit()
+
+        def concurrent_change(day):
+            result = day_posts(day)
+            # Изменение, зафиксированное другим запросом во время формирования снимка
+            record_change(CREATE, comment)
+            db.session.commit()
+            return result
+
+        with patch('flask_app.snapshots.day_posts', side_effect=concurrent_change):
+            self.assertIsNone(self.store.write(self.day))
+        self.assertFalse(self.store.exists(self.day))
@@ -0,0 +1,89 @@
+from unittest import TestCase
+
+from flask_app import create_app, db
+from flask_app.config import TestingConfiguration
+from flask_app.models import Change
+from flask_app.stream import ChangeBroker, Subscription, broker
+
+
+class BaseTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfiguration)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+class SubscriptionTestCase(TestCase):
+
+    def test_overflow(self):
+        subscription = Subscription(1)
+        self.assertTrue(subscription.put((1, 'event')))
+        self.assertFalse(subscription.put((2, 'event')))
+        self.assertTrue(subscription.overflowed)
+
+    def test_overflowed_subscription_is_dropped(self):
+        broker = ChangeBroker()
+        subscription = Subscription(1)
+        broker._subscribers.add(subscription)
+
+        broker.publish([(1, 'event 1'), (2, 'event 2')])
+        self.assertEqual(0, broker.subscribers)
+        self.assertEqual((1, 'event 1'), subscription.queue.get_nowait())
+
+
+class StreamTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config.update(STREAM_MAX_DURATION=0.3, STREAM_HEARTBEAT_INTERVAL=0.1, STREAM_POLL_INTERVAL=0.05)
+
+    def test_resume_from_last_event_id(self):
+        for i in range(3):
+            db.session.add(Change(entity='post', entity_id=i + 1, post_id=i + 1, operation='create', data='{}'))
+        db.session.commit()
+
+        response = self.client.get('/api/v1/stream', headers={'Last-Event-ID': '1'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+        body = response.get_data(as_text=True)
+        self.assertNotIn('id: 1\n', body)
+        self.assertIn('id: 2\nevent: post.create\n', body)
+        self.assertIn('id: 3\nevent: post.create\n', body)
+        self.assertIn(': heartbeat', body)
+
+    def test_not_valid_last_event_id(self):
+        response = self.client.get('/api/v1/stream', headers={'Last-Event-ID': 'abc'})
+        self.assertEqual(400, response.status_code)
+
+    def test_replay_limit_closes_stream(self):
+        self.app.config.update(STREAM_REPLAY_LIMIT=3, STREAM_POLL_BATCH=2)
+        for i in range(5):
+            db.session.add(Change(entity='post', entity_id=i + 1, post_id=i + 1, operation='create', data='{}'))
+        db.session.commit()
+
+        body = self.client.get('/api/v1/stream', headers={'Last-Event-ID': '0'}).get_data(as_text=True)
+        self.assertEqual(['1', '2', '3'], [line[4:] for line in body.splitlines() if line.startswith('id: ')])
+        self.assertNotIn(': heartbeat', body)
+
+        body = self.client.get('/api/v1/stream', headers={'Last-Event-ID': '3'}).get_data(as_text=True)
+        self.assertEqual(['4', '5'], [line[4:] for line in body.splitlines() if line.startswith('id: ')])
+        self.assertIn(': heartbeat', body)
+
+    def test_too_many_subscribers(self):
+        self.app.config['STREAM_MAX_SUBSCRIBERS'] = 1
+        subscription = broker.subscribe()
+        try:
+            response = self.client.get('/api/v1/stream')
+        finally:
+            broker.unsubscribe(subscription)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual({'message': 'too many subscribers'}, response.get_json())
+        self.assertIn('Retry-After', response.headers)
@@ -0,0 +1,142 @@
+import base64
+import http.server
+import json
+import os
+import queue
+import tempfile
+import threading
+from unittest import TestCase
+
+from flask_app import create_app, db
+from flask_app.config import TestingConfiguration
+from flask_app.models import User
+from flask_app.tracing import OTLPExporter, Trace, format_traceparent, parse_traceparent
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class BaseTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.app = create_app(TestingConfiguration)
+        self.app.config['TRACING_EXPORTER'] = 'jsonl://' + self.path
+        self.app.config['TRACING_SAMPLE_RATE'] = 0
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def exported_spans(self):
+        with open(self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+
+class TraceparentTestCase(TestCase):
+
+    def test_parse(self):
+        self.assertEqual((TRACE_ID, PARENT_ID, True), parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01'))
+        self.assertEqual((TRACE_ID, PARENT_ID, False), parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-00'))
+        self.assertIsNone(parse_traceparent(None))
+        self.assertIsNone(parse_traceparent('00-xyz-00f067aa0ba902b7-01'))
+        self.assertIsNone(parse_traceparent(f'00-{"0" * 32}-{PARENT_ID}-01'))
+
+    def test_format(self):
+        self.assertEqual(f'00-{TRACE_ID}-{PARENT_ID}-01', format_traceparent(TRACE_ID, PARENT_ID))
+
+
+class TracingTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User(
+            email='t@t.com',
+            username='user1'
+        )
+        user.hash_password('1q2w3e')
+        db.session.add(user)
+        db.session.commit()
+        self.auth = base64.b64encode(b"user1:1q2w3e").decode("utf-8")
+
+    def test_request_spans(self):
+        headers = {'Authorization': f'Basic {self.auth}', 'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'}
+        response = self.client.post('/api/v1/posts', headers=headers, json={'title': 'Title', 'content': 'Content'})
+        self.assertEqual(201, response.status_code)
+
+        spans = self.exported_spans()
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span['name'], []).append(span)
+        self.assertTrue(all(span['trace_id'] == TRACE_ID for span in spans))
+
+        root, = by_name['POST /api/v1/posts']
+        self.assertEqual(PARENT_ID, root['parent_id'])
+        self.assertEqual(201, root['attributes']['http.status_code'])
+        self.assertEqual(format_traceparent(TRACE_ID, root['span_id']), response.headers['traceresponse'])
+
+        auth, = by_name['auth.verify_password']
+        validation, = by_name['validation']
+        self.assertEqual(root['span_id'], auth['parent_id'])
+        self.assertEqual('PostSchema', validation['attributes']['schema'])
+        self.assertIn('schema.dump', by_name)
+        self.assertIn('json.encode', by_name)
+
+        sql_parents = {span['parent_id'] for span in by_name['sql']}
+        self.assertIn(auth['span_id'], sql_parents)
+        self.assertTrue(any('INSERT INTO post' in span['attributes']['db.statement'] for span in by_name['sql']))
+
+    def test_not_sampled(self):
+        self.client.get('/api/v1/posts', headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-00'})
+        self.client.get('/api/v1/posts')
+        self.assertEqual([], self.exported_spans())
+
+    def test_sample_rate(self):
+        self.app.config['TRACING_SAMPLE_RATE'] = 1
+        response = self.client.get('/api/v1/posts')
+        spans = self.exported_spans()
+        self.assertIn('GET /api/v1/posts', [span['name'] for span in spans])
+        self.assertEqual(1, len({span['trace_id'] for span in spans}))
+        self.assertIn('traceresponse', response.headers)
+
+
+class OTLPExporterTestCase(TestCase):
+
+    def test_export(self):
+        received = queue.Queue()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.put((self.path, json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            trace = Trace(TRACE_ID, PARENT_ID)
+            span = trace.start('sql', 3, **{'db.statement': 'SELECT 1'})
+            trace.finish(span)
+
+            exporter = OTLPExporter(f'http://127.0.0.1:{server.server_port}/v1/traces')
+            exporter.export(trace.finished)
+            path, body = received.get(timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual('/v1/traces', path)
+        exported, = body['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual(TRACE_ID, exported['traceId'])
+        self.assertEqual(PARENT_ID, exported['parentSpanId'])
+        self.assertEqual([{'key': 'db.statement', 'value': {'stringValue': 'SELECT 1'}}], exported['attributes'])